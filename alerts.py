@@ -0,0 +1,182 @@
+import itertools
+import json
+import logging
+import queue
+import threading
+import time
+from collections import deque
+from os import environ
+
+import requests
+
+from metrics import errors, stage_latency
+
+# Alerts are only sent when a webhook is configured
+DISCORD_WEBHOOK_URL = environ.get("DISCORD_WEBHOOK_URL")
+# Alerts for the same article or monitor arriving within this many seconds become one message
+ALERT_COALESCE_WINDOW = float(environ.get("ALERT_COALESCE_WINDOW", "3"))
+ALERT_QUEUE_SIZE = int(environ.get("ALERT_QUEUE_SIZE", "1000"))
+ALERT_MAX_ATTEMPTS = int(environ.get("ALERT_MAX_ATTEMPTS", "5"))
+ALERT_HISTORY = int(environ.get("ALERT_HISTORY", "500"))
+DISCORD_MAX_CONTENT = 2000
+
+
+def format_alerts(alerts):
+    """Render one or more coalesced alerts as a single Discord message."""
+    if len(alerts) == 1:
+        alert = alerts[0]
+        return (
+            f"Critical risk detected in article:\n"
+            f"Monitor Triggered: {alert['monitor']}\n"
+            f"Reason: {alert.get('reason')}\n"
+            f"Risk Assessment: {alert.get('risk', 'critical')}"
+        )
+    lines = [f"Critical risk detected in {len(alerts)} assessments:"]
+    for alert in alerts:
+        source = f" ({alert['article']})" if alert.get("article") else ""
+        lines.append(f"- Monitor Triggered: {alert['monitor']}{source}\n  Reason: {alert.get('reason')}")
+    message = "\n".join(lines)
+    if len(message) > DISCORD_MAX_CONTENT:
+        message = message[:DISCORD_MAX_CONTENT - 20] + "\n...(truncated)"
+    return message
+
+
+def coalesce(alerts):
+    """Group alerts that share an article or a monitor."""
+    groups = []
+    for alert in alerts:
+        keys = {("article", alert.get("article")), ("monitor", alert["monitor"])} - {("article", None)}
+        matches = [group for group in groups if group["keys"] & keys]
+        merged = {"keys": set(keys), "alerts": []}
+        for group in matches:
+            merged["keys"] |= group["keys"]
+            merged["alerts"] += group["alerts"]
+            groups.remove(group)
+        merged["alerts"].append(alert)
+        groups.append(merged)
+    return [group["alerts"] for group in groups]
+
+
+class AlertDispatcher:
+    """Background Discord alert queue.
+
+    The request path only enqueues alerts. A worker thread coalesces
+    alerts over a short window, posts them on a persistent session, honours
+    429 Retry-After responses with backoff, and records the delivery status
+    of every message.
+    """
+
+    def __init__(self, webhook_url=DISCORD_WEBHOOK_URL, window=ALERT_COALESCE_WINDOW, max_attempts=ALERT_MAX_ATTEMPTS):
+        self.webhook_url = webhook_url
+        self.window = window
+        self.max_attempts = max_attempts
+        self.queue = queue.Queue(maxsize=ALERT_QUEUE_SIZE)
+        self.session = requests.Session()
+        self.deliveries = deque(maxlen=ALERT_HISTORY)
+        self.ids = itertools.count(1)
+        if not webhook_url:
+            logging.warning("DISCORD_WEBHOOK_URL is not set, critical verdicts will not be alerted")
+        self.start()
+
+    def start(self):
+        self.thread = threading.Thread(target=self._run, name="alert-dispatcher", daemon=True)
+        self.thread.start()
+
+    def after_fork(self):
+        """Restart the worker in a forked child with its own queue and session; the parent sends what it queued."""
+        self.queue = queue.Queue(maxsize=self.queue.maxsize)
+        self.session = requests.Session()
+        self.start()
+
+    def enqueue(self, monitor, reason=None, risk="critical", article=None) -> bool:
+        """Queue an alert without blocking; returns False if the queue is full or alerting is disabled."""
+        alert = {"monitor": monitor, "reason": reason, "risk": risk, "article": article, "queued_at": time.time()}
+        if not self.webhook_url:
+            self._record([alert], "disabled", attempts=0)
+            return False
+        try:
+            self.queue.put_nowait(alert)
+            return True
+        except queue.Full:
+            logging.error(f"Alert queue full, dropping alert for {monitor}")
+            errors.inc(stage="alert_dropped")
+            self._record([alert], "dropped", attempts=0)
+            return False
+
+    def _run(self):
+        while True:
+            batch = [self.queue.get()]
+            deadline = time.monotonic() + self.window
+            while (remaining := deadline - time.monotonic()) > 0:
+                try:
+                    batch.append(self.queue.get(timeout=remaining))
+                except queue.Empty:
+                    break
+            for alerts in coalesce(batch):
+                try:
+                    self._deliver(alerts)
+                except Exception as e:
+                    logging.error(f"Failed to send alert: {e}")
+                    errors.inc(stage="alert")
+                    self._record(alerts, "failed", attempts=0, error=str(e))
+
+    def _deliver(self, alerts):
+        payload = json.dumps({"content": format_alerts(alerts)})
+        headers = {"Content-Type": "application/json"}
+        delay = 1.0
+        status_code, error = None, None
+        start = time.perf_counter()
+        for attempt in range(1, self.max_attempts + 1):
+            try:
+                response = self.session.post(self.webhook_url, data=payload, headers=headers, timeout=10)
+                status_code = response.status_code
+                if status_code in (200, 204):
+                    self._record(alerts, "delivered", attempts=attempt, http_status=status_code)
+                    stage_latency.observe(time.perf_counter() - start, stage="alert")
+                    return
+                error = response.text[:200]
+                if status_code == 429:
+                    wait = retry_after(response, delay)
+                elif status_code >= 500:
+                    wait = delay
+                else:
+                    break
+            except requests.RequestException as e:
+                error, wait = str(e), delay
+            if attempt == self.max_attempts:
+                break
+            logging.warning(f"Alert delivery attempt {attempt} failed ({status_code}), retrying in {wait:.1f}s")
+            time.sleep(wait)
+            delay = min(delay * 2, 60)
+        logging.error(f"Failed to send alert: {status_code}, {error}")
+        errors.inc(stage="alert")
+        self._record(alerts, "failed", attempts=attempt, http_status=status_code, error=error)
+
+    def _record(self, alerts, status, attempts, http_status=None, error=None):
+        self.deliveries.append({
+            "id": next(self.ids),
+            "status": status,
+            "alerts": len(alerts),
+            "monitors": sorted({alert["monitor"] for alert in alerts}),
+            "articles": sorted({alert["article"] for alert in alerts if alert.get("article")}),
+            "attempts": attempts,
+            "http_status": http_status,
+            "error": error,
+            "queued_at": min(alert["queued_at"] for alert in alerts),
+            "finished_at": time.time(),
+        })
+
+    def status(self, limit=50):
+        return {"queue_depth": self.queue.qsize(), "deliveries": list(self.deliveries)[-limit:]}
+
+
+def retry_after(response, default):
+    """Seconds to wait after a 429, from the Retry-After header or Discord's JSON body."""
+    try:
+        return float(response.headers["Retry-After"])
+    except (KeyError, ValueError):
+        pass
+    try:
+        return float(response.json()["retry_after"])
+    except (ValueError, KeyError, TypeError):
+        return default
@@ -1,23 +1,141 @@
-from flask import Flask, request, jsonify
-import requests
-from observer import PRMonitorAgent
+from flask import Flask, Response, request, jsonify
+from alerts import AlertDispatcher
+from assessment_cache import text_hash
+from assessment_store import AssessmentStore
+from jobs import JobManager, QueueFull
+from poller import FeedPoller
+from startup import AgentLoader, NotReady
+from streaming import sse
+import metrics
+from async_runtime import get_runtime
 import json
-from twilio.rest import Client
+import logging
+import time
+import os
+from os import environ
 app = Flask(__name__)
+metrics.setup_tracing()
 
-monitorAgent = PRMonitorAgent()
+# Seconds a request waits for the agent while it is still loading before getting a 503
+AGENT_READY_WAIT = float(environ.get('AGENT_READY_WAIT', '0'))
 
-def send_alert(message):
-    webhook_url = "https://discord.com/api/webhooks/1342998251770740776/CWhA8IXewHg4zB3-_uNM56UZJ5OrL-IkD9ad2oCsg9r5cwg1OGUu6zq06eelP1a6Sgx6"
-    payload = {
-        "content": message
-    }
-    headers = {
-        "Content-Type": "application/json"
-    }
-    response = requests.post(webhook_url, data=json.dumps(payload), headers=headers)
-    if response.status_code != 204:
-        print(f"Failed to send alert: {response.status_code}, {response.text}")
+def build_agent(timings):
+    # llama_index and the LLM client are only imported here, off the import path of the server
+    start = time.perf_counter()
+    from observer import PRMonitorAgent
+    timings['import_s'] = round(time.perf_counter() - start, 3)
+    start = time.perf_counter()
+    agent = PRMonitorAgent()
+    timings['build_s'] = round(time.perf_counter() - start, 3)
+    return agent
+
+agentLoader = AgentLoader(build_agent).start()
+
+def monitorAgent():
+    return agentLoader.get(timeout=AGENT_READY_WAIT)
+
+def monitor_companies(version):
+    # The company of each monitor, for verdicts the LLM reported without one
+    agent = agentLoader.agent
+    if agent is None:
+        return {}
+    return {row['monitor'].lower(): row['company'] for row in agent.monitors.rows()}
+
+alertDispatcher = AlertDispatcher()
+assessmentStore = AssessmentStore(companies=monitor_companies)
+jobManager = JobManager(
+    get_agent=lambda: agentLoader.get(timeout=None),
+    on_done=lambda job, payload: finish(job['result'], payload),
+)
+
+def prepare_fork():
+    # A server that imports this module before forking its workers (gunicorn --preload) waits here for
+    # the agent, so the workers inherit it and its monitor index instead of each loading their own, and
+    # stops polling so that one of the workers takes the poller over.
+    agentLoader.before_fork()
+    if feedPoller is not None:
+        feedPoller.stop()
+
+def restart_in_child():
+    # Threads do not survive a fork: each worker reopens the agent's connections and starts its own
+    # loader, alert, store and job threads. The monitor vectors stay shared with the parent.
+    agentLoader.after_fork()
+    alertDispatcher.after_fork()
+    assessmentStore.after_fork()
+    jobManager.after_fork()
+    if feedPoller is not None:
+        feedPoller.after_fork()
+
+os.register_at_fork(before=prepare_fork, after_in_child=restart_in_child)
+
+@app.errorhandler(NotReady)
+def not_ready(e):
+    return jsonify({'error': str(e)}), 503, {'Retry-After': '5'}
+
+def cache_samples():
+    agent = agentLoader.agent
+    if agent is None or agent.cache is None:
+        return []
+    stats = agent.cache.stats()
+    return [({'result': key}, value) for key, value in stats.items() if key not in ('hits', 'misses')]
+
+metrics.register_collector('monitor_cache_requests_total', 'Assessment cache lookups, by result.', 'counter', cache_samples)
+metrics.register_collector('monitor_queue_depth', 'Items waiting or running, by queue.', 'gauge', lambda: [
+    ({'queue': 'jobs'}, jobManager.depth()['pending']),
+    ({'queue': 'alerts'}, alertDispatcher.queue.qsize()),
+    ({'queue': 'assessments'}, assessmentStore.queue.qsize()),
+])
+
+BATCH_MAX_ITEMS = int(environ.get("BATCH_MAX_ITEMS", "500"))
+BATCH_MAX_CONCURRENCY = int(environ.get("BATCH_MAX_CONCURRENCY", "32"))
+# Default time window of assessment queries, in seconds, and the largest page they return
+ASSESSMENT_QUERY_WINDOW = float(environ.get("ASSESSMENT_QUERY_WINDOW", str(24 * 60 * 60)))
+ASSESSMENT_PAGE_MAX = int(environ.get("ASSESSMENT_PAGE_MAX", "500"))
+
+def claim_alert(result):
+    """Whether to alert on a result: it is new, or it came from a cache entry nobody alerted on yet."""
+    agent = agentLoader.agent
+    if result.get('cache_id') is None or agent is None or agent.cache is None:
+        return not result.get('cache')
+    return agent.cache.claim_alert(result['cache_id'])
+
+def release_alert(result):
+    # The alert could not be queued; let the next hit on the cache entry try again
+    agent = agentLoader.agent
+    if result.get('cache_id') is not None and agent is not None and agent.cache is not None:
+        agent.cache.release_alert(result['cache_id'])
+
+def alert_critical(result, article=None):
+    """Queue an alert for every critical verdict in an assessment result, once per cache entry."""
+    critical = [i for i in result.get('monitors', []) if i.get('risk') == 'critical']
+    if not critical or not claim_alert(result):
+        return
+    queued = [alertDispatcher.enqueue(i['monitor'], reason=i.get('reason'), risk=i['risk'], article=article) for i in critical]
+    if not all(queued):
+        release_alert(result)
+
+def finish(result, item):
+    """Queue an assessment result for the history store and alert on its critical verdicts."""
+    assessmentStore.record(result, article=article_key(item), source=item.get('source'), feed=item.get('feed'))
+    alert_critical(result, article=article_key(item))
+
+def article_key(item):
+    """Identify an article in alerts by its URL, or by a short hash of its text."""
+    return item.get('url') or f"article {text_hash(item.get('article', ''))[:12]}"
+
+def submit_polled_url(url, feed=None):
+    """Poller sink: queue a newly discovered article as a job, refusing it while the queue is full."""
+    try:
+        jobManager.submit('url', {'url': url, 'source': 'poller', 'feed': feed})
+        return True
+    except QueueFull:
+        return False
+
+# Every process starts a poller, but only the one holding its lock polls
+feedPoller = None
+if environ.get('POLLER_ENABLED') == '1':
+    feedPoller = FeedPoller(sink=submit_polled_url)
+    feedPoller.start()
 
 @app.route('/check_article', methods=['POST'])
 def check_article():
@@ -33,8 +151,9 @@ def check_article():
     # Here you can add your logic to process the article
     # For example, you can check the length of the article
 
-    result = monitorAgent.check_article(article)
+    result = json.loads(monitorAgent().check_article(article, threshold=data.get('threshold'), mode=data.get('mode')))
     print(result)
+    finish(result, data)
     return result, 200
 @app.route('/check_article_url', methods=['POST'])
 def check_article_url():
@@ -48,28 +167,255 @@ def check_article_url():
     url = data['url']
     # Here you can add your logic to process the URL
 
-    result = monitorAgent.check_article_url(url)
-    print(type(result))
-    print(result)
-    # result = "{\"monitors\": " + result[1:-1] + "}"
-    # result = json.loads(result)
-    # Parse the result string into a JSON object
-    result = json.loads(result)
-    print(type(result))
-    result = json.loads(result)
-    print(type(result))
+    result = json.loads(monitorAgent().check_article_url(url, threshold=data.get('threshold'), mode=data.get('mode')))
     print("Result: " + str(result))
-    for i in result: 
-        print(i)
-        if i['risk'] == 'critical':
-            message = (
-                f"Critical risk detected in article:\n"
-                f"Monitor Triggered: {i['monitor']}\n"
-                f"Reason: {i['reason']}\n"
-                f"Risk Assessment: {i['risk']}"
-            )
-            send_alert(message)
+    finish(result, data)
     return result, 200
 
+def batch_item_error(item):
+    """Why a batch item cannot be assessed, or None for a valid {'article': text} or {'url': url}."""
+    if not isinstance(item, dict):
+        return "Expected an object with an 'article' or a 'url'"
+    key = 'url' if item.get('url') else 'article'
+    if not item.get(key):
+        return "Batch items need an 'article' or a 'url'"
+    if not isinstance(item[key], str):
+        return f"'{key}' must be a string"
+    return None
+
+@app.route('/check_batch', methods=['POST'])
+def check_batch():
+    try:
+        data = request.get_json()
+    except:
+        return jsonify({'error': 'Invalid JSON'}), 400
+    if not isinstance(data, dict):
+        return jsonify({'error': 'Expected a JSON object'}), 400
+    if not data:
+        return jsonify({'error': 'No items provided'}), 400
+
+    # Items are {"article": text} or {"url": url}; plain "articles"/"urls" lists are accepted too
+    if not all(isinstance(data.get(key, []), list) for key in ('items', 'articles', 'urls')):
+        return jsonify({'error': "'items', 'articles' and 'urls' must be lists"}), 400
+    items = list(data.get('items', []))
+    items += [{'article': article} for article in data.get('articles', [])]
+    items += [{'url': url} for url in data.get('urls', [])]
+    if not items:
+        return jsonify({'error': 'No items provided'}), 400
+    if len(items) > BATCH_MAX_ITEMS:
+        return jsonify({'error': f'At most {BATCH_MAX_ITEMS} items per batch'}), 400
+    # Concurrency and timeout default to BATCH_CONCURRENCY and BATCH_ITEM_TIMEOUT in observer.py
+    options = {}
+    try:
+        if 'concurrency' in data:
+            options['concurrency'] = max(1, min(int(data['concurrency']), BATCH_MAX_CONCURRENCY))
+        if 'timeout' in data:
+            options['timeout'] = float(data['timeout'])
+    except (TypeError, ValueError):
+        return jsonify({'error': 'Invalid concurrency or timeout'}), 400
+
+    # Malformed items get an error result of their own; the rest of the batch still runs
+    problems = [batch_item_error(item) for item in items]
+    valid = [item for item, problem in zip(items, problems) if problem is None]
+    assessed = iter(get_runtime().run(monitorAgent().acheck_batch(
+        valid, threshold=data.get('threshold'), mode=data.get('mode'), **options,
+    )) if valid else [])
+    results = []
+    for index, (item, problem) in enumerate(zip(items, problems)):
+        if problem is not None:
+            results.append({'index': index, 'status': 'error', 'error': problem})
+            continue
+        result = {**next(assessed), 'index': index}
+        finish(result, item)
+        results.append(result)
+    summary = {status: sum(1 for r in results if r['status'] == status) for status in ('ok', 'error', 'timeout')}
+    return {'results': results, 'summary': summary}, 200
+
+@app.route('/check_article_stream', methods=['POST'])
+def check_article_stream():
+    try:
+        data = request.get_json()
+    except:
+        return jsonify({'error': 'Invalid JSON'}), 400
+    if not data or not (data.get('article') or data.get('url')):
+        return jsonify({'error': 'No article or URL provided'}), 400
+
+    item = {'url': data['url']} if data.get('url') else {'article': data['article']}
+    agent = monitorAgent()
+    def events():
+        queued = True
+        try:
+            for event, payload in agent.stream_check(item, threshold=data.get('threshold'), mode=data.get('mode')):
+                if event == 'verdict' and payload.get('risk') == 'critical' and not payload.get('cached'):
+                    # Alert as soon as the verdict is parsed, not after the whole response
+                    queued &= alertDispatcher.enqueue(payload['monitor'], reason=payload.get('reason'), risk=payload['risk'], article=article_key(item))
+                if event == 'done':
+                    if payload.get('cache'):
+                        alert_critical(payload, article=article_key(item))
+                    elif claim_alert(payload) and not queued:
+                        release_alert(payload)
+                    assessmentStore.record(payload, article=article_key(item), source=data.get('source'))
+                yield sse(event, payload)
+        except Exception as e:
+            logging.error(f"Error while streaming assessment: {e}")
+            yield sse('error', {'error': str(e)})
+
+    return Response(events(), mimetype='text/event-stream', headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
+def monitor_row(data):
+    """Validate a monitor from a request body as {'monitor', 'company'}."""
+    if not isinstance(data, dict) or not str(data.get('monitor') or '').strip():
+        return None
+    return {'monitor': str(data['monitor']).strip(), 'company': str(data.get('company') or '').strip()}
+
+def find_monitor(rows, name):
+    key = name.strip().lower()
+    return next((row for row in rows if row['monitor'].lower() == key), None)
+
+@app.route('/monitors', methods=['GET'])
+def list_monitors():
+    agent = monitorAgent()
+    rows = agent.monitors.rows()
+    offset = max(0, request.args.get('offset', 0, type=int))
+    limit = max(1, min(request.args.get('limit', 100, type=int), 1000))
+    return jsonify({'version': agent.view.version, 'total': len(rows), 'monitors': rows[offset:offset + limit]}), 200
+
+@app.route('/monitors', methods=['POST'])
+def create_monitor():
+    row = monitor_row(request.get_json(silent=True))
+    if row is None:
+        return jsonify({'error': 'No monitor provided'}), 400
+    agent = monitorAgent()
+    if find_monitor(agent.monitors.rows(), row['monitor']) is not None:
+        return jsonify({'error': 'Monitor already exists'}), 409
+    return jsonify({'monitor': row, **agent.update_monitors(upserts=[row])}), 201
+
+@app.route('/monitors/<path:name>', methods=['PUT'])
+def update_monitor(name):
+    data = request.get_json(silent=True)
+    agent = monitorAgent()
+    existing = find_monitor(agent.monitors.rows(), name)
+    if existing is None:
+        return jsonify({'error': 'Unknown monitor'}), 404
+    # The name can be changed too; a rename replaces the old monitor
+    row = monitor_row({**existing, **data} if isinstance(data, dict) else None)
+    if row is None:
+        return jsonify({'error': 'No monitor provided'}), 400
+    renamed = row['monitor'].lower() != existing['monitor'].lower()
+    if renamed and find_monitor(agent.monitors.rows(), row['monitor']) is not None:
+        return jsonify({'error': 'Monitor already exists'}), 409
+    changes = agent.update_monitors(upserts=[row], removals=[existing['monitor']] if renamed else ())
+    return jsonify({'monitor': row, **changes}), 200
+
+@app.route('/monitors/<path:name>', methods=['DELETE'])
+def delete_monitor(name):
+    try:
+        changes = monitorAgent().update_monitors(removals=[name])
+    except KeyError:
+        return jsonify({'error': 'Unknown monitor'}), 404
+    return jsonify(changes), 200
+
+@app.route('/jobs', methods=['POST'])
+def submit_job():
+    try:
+        data = request.get_json()
+    except:
+        return jsonify({'error': 'Invalid JSON'}), 400
+    if not data or not (data.get('article') or data.get('url')):
+        return jsonify({'error': 'No article or URL provided'}), 400
+
+    kind = 'url' if data.get('url') else 'article'
+    payload = {key: data.get(key) for key in (kind, 'threshold', 'mode', 'source')}
+    try:
+        job = jobManager.submit(kind, payload)
+    except QueueFull:
+        return jsonify({'error': 'Job queue is full, retry later', **jobManager.depth()}), 503, {'Retry-After': '5'}
+    status_url = f"/jobs/{job['id']}"
+    return jsonify({**job, 'status_url': status_url}), 202, {'Location': status_url}
+
+@app.route('/jobs/<job_id>', methods=['GET'])
+def job_status(job_id):
+    job = jobManager.get(job_id)
+    if job is None:
+        return jsonify({'error': 'Unknown job'}), 404
+    return jsonify(job), 200
+
+@app.route('/alerts', methods=['GET'])
+def alert_status():
+    return jsonify(alertDispatcher.status(limit=request.args.get('limit', 50, type=int))), 200
+
+def time_window():
+    # since/until are Unix timestamps; the window defaults to the last ASSESSMENT_QUERY_WINDOW seconds
+    until = request.args.get('until', type=float)
+    since = request.args.get('since', type=float)
+    if since is None:
+        since = (until or time.time()) - ASSESSMENT_QUERY_WINDOW
+    return since, until
+
+def page_limit():
+    return max(1, min(request.args.get('limit', 50, type=int), ASSESSMENT_PAGE_MAX))
+
+@app.route('/assessments', methods=['GET'])
+def list_assessments():
+    since, until = time_window()
+    page = assessmentStore.assessments(
+        since=since, until=until, source=request.args.get('source'), status=request.args.get('status'),
+        limit=page_limit(), before=request.args.get('before', type=int),
+    )
+    return jsonify(page), 200
+
+@app.route('/assessments/verdicts', methods=['GET'])
+def list_verdicts():
+    since, until = time_window()
+    try:
+        page = assessmentStore.verdicts(
+            monitor=request.args.get('monitor'), company=request.args.get('company'), risk=request.args.get('risk'),
+            since=since, until=until, limit=page_limit(), before=request.args.get('before'),
+        )
+    except ValueError:
+        return jsonify({'error': 'Invalid cursor'}), 400
+    return jsonify(page), 200
+
+@app.route('/assessments/stats', methods=['GET'])
+def assessment_stats():
+    # e.g. /assessments/stats?risk=critical&group_by=monitor&bucket=hour for critical hits per monitor per hour
+    since, until = time_window()
+    try:
+        buckets = assessmentStore.aggregate(
+            bucket=request.args.get('bucket', 'hour'), group_by=request.args.get('group_by', 'monitor'),
+            monitor=request.args.get('monitor'), company=request.args.get('company'), risk=request.args.get('risk'),
+            since=since, until=until,
+        )
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    return jsonify({'since': since, 'until': until, 'buckets': buckets}), 200
+
+@app.route('/assessments/store', methods=['GET'])
+def assessment_store_status():
+    return jsonify(assessmentStore.status()), 200
+
+@app.route('/cache_stats', methods=['GET'])
+def cache_stats():
+    agent = monitorAgent()
+    if agent.cache is None:
+        return jsonify({'enabled': False}), 200
+    return jsonify({'enabled': True, **agent.cache.stats()}), 200
+
+@app.route('/healthz', methods=['GET'])
+def healthz():
+    # Liveness: the process serves requests; a failed agent load needs a restart
+    status = agentLoader.status()
+    return jsonify({'ok': status['error'] is None, **status}), 200 if status['error'] is None else 500
+
+@app.route('/readyz', methods=['GET'])
+def readyz():
+    status = agentLoader.status()
+    return jsonify(status), 200 if status['ready'] else 503
+
+@app.route('/metrics', methods=['GET'])
+def metrics_endpoint():
+    return Response(metrics.render(), mimetype='text/plain; version=0.0.4')
+
 if __name__ == '__main__':
-    app.run(debug=True)
+    # Development server only; run production deployments under a WSGI server such as gunicorn
+    app.run(debug=environ.get('FLASK_DEBUG') == '1', threaded=True)
@@ -0,0 +1,205 @@
+import hashlib
+import json
+import logging
+import re
+import sqlite3
+import threading
+import time
+from collections import Counter
+from os import environ
+from urllib.parse import parse_qsl, urlencode, urlsplit, urlunsplit
+
+import numpy as np
+
+ASSESSMENT_CACHE_PATH = environ.get("ASSESSMENT_CACHE_PATH", "assessment_cache.db")
+ASSESSMENT_CACHE_TTL = float(environ.get("ASSESSMENT_CACHE_TTL", str(24 * 60 * 60)))
+ASSESSMENT_CACHE_MAX_ENTRIES = int(environ.get("ASSESSMENT_CACHE_MAX_ENTRIES", "100000"))
+# Max SimHash bit distance for a repost to reuse a verdict; banding below only finds up to 3
+NEAR_DUPLICATE_DISTANCE = min(int(environ.get("NEAR_DUPLICATE_DISTANCE", "3")), 3)
+NEAR_DUPLICATE_MIN_WORDS = 50
+PRUNE_EVERY = 100
+
+TRACKING_PARAMS = {"fbclid", "gclid", "mc_cid", "mc_eid", "ref", "ref_src", "igshid", "cmpid"}
+SIMHASH_BANDS = 4
+
+
+def canonical_url(url):
+    """Normalize a URL so syndicated copies and tracking variants share one cache key."""
+    parts = urlsplit(url.strip())
+    host = (parts.hostname or "").lower()
+    if host.startswith("www."):
+        host = host[4:]
+    if parts.port and parts.port not in (80, 443):
+        host = f"{host}:{parts.port}"
+    query = sorted(
+        (key, value) for key, value in parse_qsl(parts.query, keep_blank_values=True)
+        if not key.lower().startswith("utm_") and key.lower() not in TRACKING_PARAMS
+    )
+    path = parts.path.rstrip("/") or "/"
+    return urlunsplit(("https" if parts.scheme in ("http", "https") else parts.scheme, host, path, urlencode(query), ""))
+
+
+def normalize_text(text):
+    return " ".join(text.lower().split())
+
+
+def text_hash(text):
+    return hashlib.sha256(normalize_text(text).encode("utf-8")).hexdigest()
+
+
+def simhash(text):
+    """64-bit SimHash fingerprint over word 3-shingles, or None for texts too short to compare."""
+    words = re.findall(r"\w+", text.lower())
+    if len(words) < NEAR_DUPLICATE_MIN_WORDS:
+        return None
+    shingles = {" ".join(words[i:i + 3]) for i in range(len(words) - 2)}
+    hashes = np.array(
+        [int.from_bytes(hashlib.blake2b(s.encode("utf-8"), digest_size=8).digest(), "little") for s in shingles],
+        dtype=np.uint64,
+    )
+    bits = np.unpackbits(hashes.view(np.uint8), bitorder="little").reshape(-1, 64)
+    fingerprint = np.packbits(bits.sum(axis=0) * 2 > len(hashes), bitorder="little")
+    return int.from_bytes(fingerprint.tobytes(), "little")
+
+
+def to_signed(value):
+    """SQLite integers are signed 64-bit."""
+    return value - (1 << 64) if value >= (1 << 63) else value
+
+
+def bands(fingerprint):
+    return [(fingerprint >> (16 * i)) & 0xFFFF for i in range(SIMHASH_BANDS)]
+
+
+class AssessmentCache:
+    """Persistent SQLite cache of assessment results.
+
+    Entries are keyed by the normalized text hash and the monitor-set version
+    they were computed against, and are also reachable by canonical URL (to
+    skip the fetch) and by SimHash band (to catch lightly edited reposts).
+    Each entry records whether its critical verdicts were alerted on.
+    """
+
+    def __init__(self, path=ASSESSMENT_CACHE_PATH, ttl=ASSESSMENT_CACHE_TTL, max_entries=ASSESSMENT_CACHE_MAX_ENTRIES):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.counters = Counter()
+        self.lock = threading.Lock()
+        self.puts = 0
+        self.path = path
+        self.db = self._connect()
+        self.db.execute("PRAGMA journal_mode=WAL")
+        band_columns = "".join(f", band{i} INTEGER" for i in range(SIMHASH_BANDS))
+        self.db.execute(
+            "CREATE TABLE IF NOT EXISTS assessments ("
+            "text_hash TEXT NOT NULL, version TEXT NOT NULL, url TEXT, simhash INTEGER"
+            f"{band_columns}, result TEXT NOT NULL, created REAL NOT NULL, alerted INTEGER NOT NULL DEFAULT 0, "
+            "PRIMARY KEY (text_hash, version))"
+        )
+        if "alerted" not in {column[1] for column in self.db.execute("PRAGMA table_info(assessments)")}:
+            self.db.execute("ALTER TABLE assessments ADD COLUMN alerted INTEGER NOT NULL DEFAULT 0")
+        self.db.execute("CREATE INDEX IF NOT EXISTS assessments_url ON assessments (url, version)")
+        self.db.execute("CREATE INDEX IF NOT EXISTS assessments_created ON assessments (created)")
+        for i in range(SIMHASH_BANDS):
+            self.db.execute(f"CREATE INDEX IF NOT EXISTS assessments_band{i} ON assessments (band{i}, version)")
+
+    def _connect(self):
+        db = sqlite3.connect(self.path, check_same_thread=False, isolation_level=None)
+        db.execute("PRAGMA synchronous=NORMAL")
+        return db
+
+    def after_fork(self):
+        """Open a connection of our own in a forked child."""
+        self.lock = threading.Lock()
+        self.db = self._connect()
+
+    def _hit(self, kind, row):
+        entry, result, created, alerted = row
+        self.counters[f"hit_{kind}"] += 1
+        result = json.loads(result)
+        result["cache"] = {"hit": kind, "age_s": round(time.time() - created, 1), "alerted": bool(alerted)}
+        result["cache_id"] = entry
+        return result
+
+    def _miss(self):
+        self.counters["miss"] += 1
+        return None
+
+    def get_url(self, url, version):
+        """Look up a result by canonical URL, before the article is fetched."""
+        with self.lock:
+            row = self.db.execute(
+                "SELECT rowid, result, created, alerted FROM assessments WHERE url = ? AND version = ? AND created > ? "
+                "ORDER BY created DESC LIMIT 1",
+                (canonical_url(url), version, time.time() - self.ttl),
+            ).fetchone()
+        if row:
+            return self._hit("url", row)
+        self.counters["miss_url"] += 1
+        return None
+
+    def get_text(self, text, version):
+        """Look up a result by exact normalized text, then by near-duplicate SimHash."""
+        cutoff = time.time() - self.ttl
+        with self.lock:
+            row = self.db.execute(
+                "SELECT rowid, result, created, alerted FROM assessments WHERE text_hash = ? AND version = ? AND created > ?",
+                (text_hash(text), version, cutoff),
+            ).fetchone()
+            if row:
+                return self._hit("text", row)
+            fingerprint = simhash(text)
+            if fingerprint is None:
+                return self._miss()
+            where = " OR ".join(f"band{i} = ?" for i in range(SIMHASH_BANDS))
+            candidates = self.db.execute(
+                f"SELECT simhash, rowid, result, created, alerted FROM assessments WHERE ({where}) AND version = ? AND created > ?",
+                (*bands(fingerprint), version, cutoff),
+            ).fetchall()
+        for candidate, *row in candidates:
+            if ((candidate % (1 << 64)) ^ fingerprint).bit_count() <= NEAR_DUPLICATE_DISTANCE:
+                return self._hit("near_duplicate", row)
+        return self._miss()
+
+    def put(self, text, version, result, url=None):
+        """Store a result and return its entry id, for claim_alert()."""
+        fingerprint = simhash(text)
+        band_values = bands(fingerprint) if fingerprint is not None else [None] * SIMHASH_BANDS
+        with self.lock:
+            entry = self.db.execute(
+                f"INSERT OR REPLACE INTO assessments VALUES (?, ?, ?, ?{', ?' * SIMHASH_BANDS}, ?, ?, 0)",
+                (
+                    text_hash(text), version, canonical_url(url) if url else None,
+                    to_signed(fingerprint) if fingerprint is not None else None,
+                    *band_values, json.dumps(result, default=str), time.time(),
+                ),
+            ).lastrowid
+            self.puts += 1
+            if self.puts % PRUNE_EVERY == 0:
+                self._prune()
+        return entry
+
+    def claim_alert(self, entry) -> bool:
+        """Mark an entry's verdicts as alerted; False if they already were, so only one caller alerts."""
+        with self.lock:
+            return self.db.execute("UPDATE assessments SET alerted = 1 WHERE rowid = ? AND alerted = 0", (entry,)).rowcount == 1
+
+    def release_alert(self, entry):
+        """Undo claim_alert() after the alert could not be queued, so a later hit tries again."""
+        with self.lock:
+            self.db.execute("UPDATE assessments SET alerted = 0 WHERE rowid = ?", (entry,))
+
+    def _prune(self):
+        """Drop expired entries, then the oldest ones beyond max_entries."""
+        expired = self.db.execute("DELETE FROM assessments WHERE created <= ?", (time.time() - self.ttl,)).rowcount
+        overflow = self.db.execute("SELECT COUNT(*) FROM assessments").fetchone()[0] - self.max_entries
+        if overflow > 0:
+            self.db.execute(
+                "DELETE FROM assessments WHERE rowid IN (SELECT rowid FROM assessments ORDER BY created LIMIT ?)",
+                (overflow,),
+            )
+        logging.info(f"Pruned assessment cache: {expired} expired, {max(overflow, 0)} over capacity")
+
+    def stats(self):
+        hits = sum(count for key, count in self.counters.items() if key.startswith("hit_"))
+        return {**self.counters, "hits": hits, "misses": self.counters["miss"]}
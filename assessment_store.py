@@ -0,0 +1,287 @@
+import json
+import logging
+import queue
+import sqlite3
+import threading
+import time
+from os import environ
+from urllib.parse import urlsplit
+
+from metrics import errors, stage_latency
+
+ASSESSMENT_STORE_PATH = environ.get("ASSESSMENT_STORE_PATH", "assessments.db")
+# Assessments written per transaction, and the longest a queued one waits for its batch to fill
+ASSESSMENT_STORE_BATCH = int(environ.get("ASSESSMENT_STORE_BATCH", "500"))
+ASSESSMENT_STORE_FLUSH_INTERVAL = float(environ.get("ASSESSMENT_STORE_FLUSH_INTERVAL", "1"))
+ASSESSMENT_STORE_QUEUE_SIZE = int(environ.get("ASSESSMENT_STORE_QUEUE_SIZE", "10000"))
+# Days of history kept; 0 keeps everything
+ASSESSMENT_STORE_RETENTION_DAYS = float(environ.get("ASSESSMENT_STORE_RETENTION_DAYS", "90"))
+PRUNE_EVERY = 100
+BUCKETS = {"minute": 60, "hour": 3600, "day": 86400}
+GROUPS = {"monitor": "v.monitor", "company": "v.company", "risk": "v.risk"}
+
+SCHEMA = [
+    "CREATE TABLE IF NOT EXISTS assessments ("
+    "id INTEGER PRIMARY KEY, ts REAL NOT NULL, article TEXT, source TEXT, monitor_version INTEGER, mode TEXT, "
+    "status TEXT NOT NULL, passed INTEGER, cached INTEGER NOT NULL, escalated INTEGER, "
+    "latency_ms REAL, cost_usd REAL, timings TEXT, feed TEXT)",
+    "CREATE TABLE IF NOT EXISTS verdicts ("
+    "assessment_id INTEGER NOT NULL, ts REAL NOT NULL, monitor TEXT NOT NULL, company TEXT, risk TEXT, reason TEXT)",
+    "CREATE INDEX IF NOT EXISTS assessments_ts ON assessments (ts)",
+    "CREATE INDEX IF NOT EXISTS verdicts_assessment ON verdicts (assessment_id)",
+    "CREATE INDEX IF NOT EXISTS verdicts_ts ON verdicts (ts)",
+    # The trailing columns make these covering indexes for the aggregations below
+    "CREATE INDEX IF NOT EXISTS verdicts_monitor ON verdicts (monitor, ts, risk)",
+    "CREATE INDEX IF NOT EXISTS verdicts_company ON verdicts (company, ts, risk)",
+    "CREATE INDEX IF NOT EXISTS verdicts_risk ON verdicts (risk, ts, monitor, company)",
+]
+
+
+def source_of(url):
+    return (urlsplit(url).hostname or "").lower().removeprefix("www.") or None
+
+
+def assessment_row(result):
+    """The assessments columns after id, ts, article and source for one result."""
+    cascade = result.get("cascade") or {}
+    timings = {**(result.get("timings") or {}), **(result.get("fetch") or {})}
+    status = result.get("status") or ("error" if "error" in result else "ok")
+    passed = (result.get("gate") or {}).get("passed")
+    return (
+        result.get("monitor_version"), result.get("mode"), status,
+        None if passed is None else int(passed), int(bool(result.get("cache"))),
+        None if cascade.get("escalated") is None else int(cascade["escalated"]),
+        result.get("latency_ms"),
+        sum(tier.get("cost_usd", 0) for tier in (cascade.get("tiers") or {}).values()) or None,
+        json.dumps(timings) if timings else None,
+    )
+
+
+class AssessmentStore:
+    """History of every assessment and its per-monitor verdicts in SQLite, for dashboards and trends.
+
+    The request path only enqueues results. A writer thread collects them
+    into batches and writes each batch in one WAL transaction, so a slow
+    disk or a long query never delays a response. Queries read on their
+    own connections and are not blocked by the writer.
+    """
+
+    def __init__(self, path=ASSESSMENT_STORE_PATH, companies=None, batch_size=ASSESSMENT_STORE_BATCH,
+                 interval=ASSESSMENT_STORE_FLUSH_INTERVAL, queue_size=ASSESSMENT_STORE_QUEUE_SIZE,
+                 retention_days=ASSESSMENT_STORE_RETENTION_DAYS):
+        self.path = path
+        # Called with a monitor-set version, returns {monitor name in lower case: company}
+        self.companies = companies
+        self.batch_size = batch_size
+        self.interval = interval
+        self.retention = retention_days * 86400
+        self.queue = queue.Queue(maxsize=queue_size)
+        self.local = threading.local()
+        self.company_map = (None, {})
+        self.stats = {"written": 0, "dropped": 0, "batches": 0}
+        self.flushed = threading.Condition()
+        self.db = self._connect()
+        for statement in SCHEMA:
+            self.db.execute(statement)
+        if "feed" not in {column[1] for column in self.db.execute("PRAGMA table_info(assessments)")}:
+            self.db.execute("ALTER TABLE assessments ADD COLUMN feed TEXT")
+        self.start()
+
+    def start(self):
+        self.thread = threading.Thread(target=self._run, name="assessment-store", daemon=True)
+        self.thread.start()
+
+    def after_fork(self):
+        """Restart the writer in a forked child; SQLite connections must not be shared across a fork."""
+        self.queue = queue.Queue(maxsize=self.queue.maxsize)
+        self.local = threading.local()
+        self.flushed = threading.Condition()
+        self.stats = {"written": 0, "dropped": 0, "batches": 0}
+        self.db = self._connect()
+        self.start()
+
+    def _connect(self):
+        db = sqlite3.connect(self.path, check_same_thread=False, isolation_level=None)
+        db.execute("PRAGMA journal_mode=WAL")
+        db.execute("PRAGMA synchronous=NORMAL")
+        db.execute("PRAGMA busy_timeout=5000")
+        return db
+
+    def _reader(self):
+        if getattr(self.local, "db", None) is None:
+            self.local.db = self._connect()
+            self.local.db.row_factory = sqlite3.Row
+        return self.local.db
+
+    def record(self, result, article=None, source=None, feed=None) -> bool:
+        """Queue a result (a dict or its JSON) without blocking; returns False if the queue is full.
+
+        feed is the URL of the feed a polled article was found in.
+        """
+        try:
+            self.queue.put_nowait((time.time(), result, article, source, feed))
+            return True
+        except queue.Full:
+            logging.error(f"Assessment store queue full, dropping assessment of {article}")
+            errors.inc(stage="store_dropped")
+            self.stats["dropped"] += 1
+            return False
+
+    def flush(self, timeout=None):
+        """Wait until everything queued so far is written."""
+        with self.flushed:
+            return self.flushed.wait_for(lambda: self.queue.unfinished_tasks == 0, timeout)
+
+    def _run(self):
+        while True:
+            batch = [self.queue.get()]
+            deadline = time.monotonic() + self.interval
+            while len(batch) < self.batch_size and (remaining := deadline - time.monotonic()) > 0:
+                try:
+                    batch.append(self.queue.get(timeout=remaining))
+                except queue.Empty:
+                    break
+            try:
+                self._write(batch)
+            except Exception as e:
+                logging.error(f"Failed to store {len(batch)} assessments: {e}")
+                errors.inc(stage="store")
+            for _ in batch:
+                self.queue.task_done()
+            with self.flushed:
+                self.flushed.notify_all()
+
+    def _company_of(self, version):
+        if self.companies is None:
+            return {}
+        if self.company_map[0] != version:
+            self.company_map = (version, self.companies(version))
+        return self.company_map[1]
+
+    def _write(self, batch):
+        start = time.perf_counter()
+        verdicts = []
+        self.db.execute("BEGIN")
+        try:
+            for ts, result, article, source, feed in batch:
+                if isinstance(result, (str, bytes)):
+                    result = json.loads(result)
+                if not source and article and "://" in article:
+                    source = source_of(article)
+                cursor = self.db.execute(
+                    "INSERT INTO assessments VALUES (NULL, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                    (ts, article, source, *assessment_row(result), feed),
+                )
+                company_of = self._company_of(result.get("monitor_version"))
+                for verdict in result.get("monitors") or []:
+                    monitor = str(verdict.get("monitor"))
+                    risk = verdict.get("risk")
+                    verdicts.append((
+                        cursor.lastrowid, ts, monitor, verdict.get("company") or company_of.get(monitor.lower()),
+                        str(risk).strip().lower() if risk is not None else None, verdict.get("reason"),
+                    ))
+            self.db.executemany("INSERT INTO verdicts VALUES (?, ?, ?, ?, ?, ?)", verdicts)
+            self.db.execute("COMMIT")
+        except Exception:
+            self.db.execute("ROLLBACK")
+            raise
+        self.stats["written"] += len(batch)
+        self.stats["batches"] += 1
+        stage_latency.observe(time.perf_counter() - start, stage="store")
+        if self.retention and self.stats["batches"] % PRUNE_EVERY == 0:
+            self._prune()
+
+    def _prune(self):
+        cutoff = time.time() - self.retention
+        removed = self.db.execute("DELETE FROM assessments WHERE ts < ?", (cutoff,)).rowcount
+        self.db.execute("DELETE FROM verdicts WHERE ts < ?", (cutoff,))
+        if removed:
+            logging.info(f"Pruned {removed} assessments older than {self.retention / 86400:g} days")
+
+    def assessments(self, since=None, until=None, source=None, status=None, limit=50, before=None):
+        """Newest assessments first, each with its verdicts, one page at a time.
+
+        Pages are keyed on the last id of the previous page (`before`)
+        rather than an offset, so deep pages cost the same as the first.
+        """
+        where, params = self._window(since, until, column="a.ts")
+        for column, value in (("a.source", source), ("a.status", status)):
+            if value is not None:
+                where.append(f"{column} = ?")
+                params.append(value)
+        if before is not None:
+            where.append("a.id < ?")
+            params.append(before)
+        db = self._reader()
+        rows = db.execute(
+            f"SELECT a.* FROM assessments a WHERE {' AND '.join(where) or '1'} ORDER BY a.id DESC LIMIT ?",
+            (*params, limit),
+        ).fetchall()
+        items = [{**row, "timings": json.loads(row["timings"]) if row["timings"] else {}, "verdicts": []} for row in map(dict, rows)]
+        if items:
+            by_id = {item["id"]: item for item in items}
+            for verdict in db.execute(
+                f"SELECT assessment_id, monitor, company, risk, reason FROM verdicts "
+                f"WHERE assessment_id IN ({', '.join('?' * len(by_id))})",
+                list(by_id),
+            ):
+                by_id[verdict["assessment_id"]]["verdicts"].append(
+                    {key: verdict[key] for key in ("monitor", "company", "risk", "reason")}
+                )
+        return {"items": items, "next": items[-1]["id"] if len(items) == limit else None}
+
+    def verdicts(self, monitor=None, company=None, risk=None, since=None, until=None, limit=50, before=None):
+        """Newest verdicts matching the filters, with their article, one page at a time.
+
+        `before` is the "ts:rowid" cursor returned as `next` by the previous page.
+        """
+        where, params = self._filters(monitor, company, risk, since, until)
+        if before is not None:
+            ts, _, rowid = str(before).partition(":")
+            where.append("(v.ts, v.rowid) < (?, ?)")
+            params += [float(ts), int(rowid)]
+        rows = self._reader().execute(
+            "SELECT v.rowid AS rowid, v.ts, v.monitor, v.company, v.risk, v.reason, v.assessment_id, "
+            "a.article, a.source, a.monitor_version FROM verdicts v JOIN assessments a ON a.id = v.assessment_id "
+            f"WHERE {' AND '.join(where) or '1'} ORDER BY v.ts DESC, v.rowid DESC LIMIT ?",
+            (*params, limit),
+        ).fetchall()
+        cursor = f"{rows[-1]['ts']!r}:{rows[-1]['rowid']}" if len(rows) == limit else None
+        items = [{key: row[key] for key in row.keys() if key != "rowid"} for row in rows]
+        return {"items": items, "next": cursor}
+
+    def aggregate(self, bucket="hour", group_by="monitor", monitor=None, company=None, risk=None, since=None, until=None):
+        """Verdict counts per time bucket and monitor, company or risk, e.g. critical hits per monitor per hour."""
+        if bucket not in BUCKETS:
+            raise ValueError(f"Unknown bucket {bucket!r}, expected one of {tuple(BUCKETS)}")
+        if group_by not in GROUPS:
+            raise ValueError(f"Unknown group_by {group_by!r}, expected one of {tuple(GROUPS)}")
+        where, params = self._filters(monitor, company, risk, since, until)
+        size = BUCKETS[bucket]
+        rows = self._reader().execute(
+            f"SELECT CAST(v.ts / {size} AS INTEGER) * {size} AS bucket, {GROUPS[group_by]} AS key, COUNT(*) AS count "
+            f"FROM verdicts v WHERE {' AND '.join(where) or '1'} GROUP BY bucket, key ORDER BY bucket, count DESC",
+            params,
+        ).fetchall()
+        return [dict(row) for row in rows]
+
+    def _filters(self, monitor, company, risk, since, until):
+        where, params = self._window(since, until, column="v.ts")
+        for column, value in (("v.monitor", monitor), ("v.company", company), ("v.risk", risk)):
+            if value is not None:
+                where.append(f"{column} = ?")
+                params.append(value.lower() if column == "v.risk" else value)
+        return where, params
+
+    def _window(self, since, until, column):
+        where, params = [], []
+        if since is not None:
+            where.append(f"{column} >= ?")
+            params.append(float(since))
+        if until is not None:
+            where.append(f"{column} < ?")
+            params.append(float(until))
+        return where, params
+
+    def status(self):
+        return {**self.stats, "queue_depth": self.queue.qsize()}
@@ -0,0 +1,48 @@
+import asyncio
+import os
+import threading
+
+
+class BackgroundLoop:
+    """Long-lived asyncio event loop running in a daemon thread.
+
+    Async LLM clients keep their HTTP connection pool on the loop they were
+    first used on, so coroutines from Flask handlers are submitted to this one
+    loop instead of starting a new loop per request.
+    """
+
+    def __init__(self, name="async-runtime"):
+        self.loop = asyncio.new_event_loop()
+        self.thread = threading.Thread(target=self.loop.run_forever, name=name, daemon=True)
+        self.thread.start()
+
+    def run(self, coro, timeout=None):
+        """Run a coroutine on the background loop and block until it finishes."""
+        return asyncio.run_coroutine_threadsafe(coro, self.loop).result(timeout)
+
+    def submit(self, coro):
+        """Schedule a coroutine on the background loop and return its concurrent future."""
+        return asyncio.run_coroutine_threadsafe(coro, self.loop)
+
+
+_runtime = None
+_runtime_lock = threading.Lock()
+
+
+def _reset_after_fork():
+    # The loop thread does not survive a fork; the child starts its own loop on first use
+    global _runtime, _runtime_lock
+    _runtime = None
+    _runtime_lock = threading.Lock()
+
+
+os.register_at_fork(after_in_child=_reset_after_fork)
+
+
+def get_runtime():
+    """Return the process-wide background loop, starting it on first use."""
+    global _runtime
+    with _runtime_lock:
+        if _runtime is None:
+            _runtime = BackgroundLoop()
+        return _runtime
@@ -0,0 +1,631 @@
+import argparse
+import asyncio
+import glob
+import json
+import logging
+import os
+import platform
+import random
+import resource
+import sys
+import tempfile
+import time
+import tracemalloc
+
+import numpy as np
+
+from cascade import tier_record
+from condense import split_passages
+from embeddings import get_embed_model
+from local_models import DEFAULT_RISK_KEYWORDS, StandInEmbedding, StandInLLM
+from monitor_index import MONITORS_CSV, MonitorIndex, read_monitors
+from observer import PRMonitorAgent, parse_verdicts
+from reference_corpus import ReferenceCorpus, ingest, read_html, read_pdf
+from usage import timed
+
+CORPUS = ["archive/pdfs/*", "archive/samsung_bbc.htm"]
+STAGES = ["parse", "embed", "gate", "condense", "retrieval", "llm", "total"]
+RISK_SENTENCES = [
+    "Regulators issued a warning after several {monitor} units caught fire while charging.",
+    "{company} faces a class action lawsuit over the {monitor} battery explosions.",
+    "A data breach at {company} exposed customer records linked to {monitor}.",
+]
+NEUTRAL_SENTENCES = [
+    "{company} announced a new colour option for {monitor} at its annual event.",
+    "Analysts expect steady sales of {monitor} through the holiday quarter.",
+]
+FILLER_SENTENCES = [
+    "The city council approved the new budget for road maintenance on Tuesday.",
+    "Local farmers reported a strong harvest after a mild and wet spring.",
+    "The museum reopened its modern art wing following a two-year renovation.",
+    "Commuters faced delays as the rail operator replaced signalling equipment.",
+]
+
+
+def load_corpus(patterns=CORPUS):
+    """Parse the archived articles, timing each parse."""
+    articles = []
+    for path in sorted({path for pattern in patterns for path in glob.glob(pattern)}):
+        start = time.perf_counter()
+        try:
+            text = read_pdf(path) if path.lower().endswith(".pdf") else read_html(path)
+        except Exception as e:
+            logging.warning(f"Skipping {path}: {e}")
+            continue
+        if text.strip():
+            articles.append({"name": os.path.basename(path), "text": text, "parse_ms": (time.perf_counter() - start) * 1000})
+    return articles
+
+
+def synthetic_articles(monitors, count, relevant_share=0.3, seed=7):
+    """Generate articles, a share of which mention a monitor (some of them risky), the rest filler.
+
+    Each article is labelled critical when it got a risk sentence and none otherwise.
+    """
+    rng = random.Random(seed)
+    articles = []
+    for i in range(count):
+        sentences = rng.sample(FILLER_SENTENCES, k=3)
+        label = "none"
+        if monitors and rng.random() < relevant_share:
+            row = rng.choice(monitors)
+            risky = rng.random() < 0.5
+            template = rng.choice(RISK_SENTENCES if risky else NEUTRAL_SENTENCES)
+            sentences.insert(rng.randrange(len(sentences) + 1), template.format(**row))
+            label = "critical" if risky else "none"
+        articles.append({"name": f"synthetic-{i}", "text": f"Headline {i}\n\n" + " ".join(sentences), "parse_ms": 0.0, "label": label})
+    return articles
+
+
+def load_labelled(path):
+    """Read a labelled replay set: JSON lines of {"text", "label": "critical" or "none"}, optionally with a "name"."""
+    articles = []
+    with open(path) as file:
+        for i, line in enumerate(file):
+            if line.strip():
+                item = json.loads(line)
+                articles.append({"name": item.get("name", f"labelled-{i}"), "text": item["text"], "parse_ms": 0.0, "label": item["label"]})
+    return articles
+
+
+def percentiles(values):
+    if not values:
+        return {"count": 0}
+    values = np.asarray(values, dtype=float)
+    return {
+        "count": int(len(values)),
+        "mean": round(float(values.mean()), 2),
+        "p50": round(float(np.percentile(values, 50)), 2),
+        "p90": round(float(np.percentile(values, 90)), 2),
+        "p99": round(float(np.percentile(values, 99)), 2),
+        "max": round(float(values.max()), 2),
+    }
+
+
+def build_agent(args, workdir):
+    embed_model = StandInEmbedding(latency=args.embed_latency)
+    # "config" uses the real models from ASSESSMENT_MODEL and TRIAGE_MODEL / TRIAGE_API_BASE
+    llm = None
+    if args.llm == "stand-in":
+        llm = StandInLLM(latency=args.llm_latency, token_latency=args.token_latency, model=args.llm_model)
+    triage_llm = False
+    if args.triage == "stand-in":
+        # Knowing fewer risk keywords than the full stand-in makes the triage model miss some risks
+        triage_llm = StandInLLM(latency=args.triage_latency, token_latency=args.token_latency, model=args.triage_model,
+                                risk_keywords=DEFAULT_RISK_KEYWORDS[:args.triage_keywords])
+    elif args.triage == "config":
+        triage_llm = None
+    monitors = MonitorIndex(csv_path=args.monitors, persist_dir=os.path.join(workdir, "monitor_index"), embed_model=embed_model)
+    references = ReferenceCorpus(args.references, embed_model_name=embed_model.model_name) if args.references else False
+    return PRMonitorAgent(mode=args.mode, llm=llm, monitors=monitors, use_cache=False, watch=0, triage_llm=triage_llm,
+                          references=references)
+
+
+async def run_level(agent, articles, concurrency, args):
+    """Replay every article through the batch path at one concurrency level."""
+    items = [{"article": article["text"]} for article in articles]
+    start = time.perf_counter()
+    results = await agent.acheck_batch(items, concurrency=concurrency, timeout=args.timeout, mode=args.mode)
+    wall = time.perf_counter() - start
+
+    stages = {stage: [] for stage in STAGES}
+    stages["parse"] = [article["parse_ms"] for article in articles if article["parse_ms"]]
+    turns, tokens, passed = [], [], 0
+    escalated, triaged, cost = 0, 0, {}
+    for result in results:
+        cascade = result.get("cascade") or {"tiers": {}}
+        if cascade.get("escalated") is not None:
+            triaged += 1
+            escalated += cascade["escalated"]
+        for tier, record in cascade["tiers"].items():
+            cost[tier] = cost.get(tier, 0.0) + record["cost_usd"]
+        for stage, value in result.get("timings", {}).items():
+            stages.setdefault(stage[:-3], []).append(value)
+        if "latency_ms" in result:
+            stages["total"].append(result["latency_ms"])
+        if result.get("gate", {}).get("passed"):
+            passed += 1
+        if "usage" in result:
+            turns.append(result["usage"].get("turns", 0))
+            tokens.append(result["usage"].get("total_tokens", 0))
+    return {
+        "concurrency": concurrency,
+        "items": len(items),
+        "wall_s": round(wall, 3),
+        "throughput_per_s": round(len(items) / wall, 2) if wall else None,
+        "status": {status: sum(1 for r in results if r["status"] == status) for status in ("ok", "error", "timeout")},
+        "gate_pass_rate": round(passed / len(results), 3) if results else None,
+        "stages_ms": {stage: percentiles(values) for stage, values in stages.items()},
+        "llm_turns": percentiles(turns),
+        "tokens": {**percentiles(tokens), "sum": int(sum(tokens))},
+        "escalation_rate": round(escalated / triaged, 3) if triaged else None,
+        "cost_usd": {tier: round(value, 4) for tier, value in cost.items()},
+    }
+
+
+def embedding_benchmark(backends, articles, single=50):
+    """Compare embedding backends on the corpus passages: load time, per-text latency and batch throughput."""
+    passages = [passage for article in articles for passage in split_passages(article["text"])]
+    results = {"passages": len(passages)}
+    for backend in backends:
+        try:
+            start = time.perf_counter()
+            model = get_embed_model(backend, cache_size=0)
+            load = time.perf_counter() - start
+            latencies = []
+            for passage in passages[:single]:
+                start = time.perf_counter()
+                model.get_text_embedding(passage)
+                latencies.append((time.perf_counter() - start) * 1000)
+            start = time.perf_counter()
+            model.get_text_embedding_batch(passages)
+            batch = time.perf_counter() - start
+            results[backend] = {
+                "model": model.model_name,
+                "load_s": round(load, 3),
+                "single_ms": percentiles(latencies),
+                "batch_s": round(batch, 3),
+                "batch_per_s": round(len(passages) / batch, 1) if batch else None,
+            }
+        except Exception as e:
+            logging.error(f"Embedding backend {backend} failed: {e}")
+            results[backend] = {"error": str(e)}
+        print(f"{backend:<22} {results[backend]}")
+    return results
+
+
+def router_benchmark(articles, count, companies=1000, seed=7):
+    """Route the corpus through an ArticleRouter over count synthetic monitor names drawn from its own words.
+
+    The regex alternation the relevance gate used before is timed on the same names for comparison.
+    """
+    import re
+    from router import ArticleRouter, words
+
+    rng = np.random.default_rng(seed)
+    vocabulary = sorted({word for article in articles for word in words(article["text"]) if len(word) > 3})
+    rows = [
+        {"monitor": " ".join(rng.choice(vocabulary, size=rng.integers(2, 5))), "company": f"Company {i % companies}"}
+        for i in range(count)
+    ]
+    aliases = [(" ".join(rng.choice(vocabulary, size=2)), f"Company {i}") for i in range(companies)]
+    results = {"patterns": count + companies * 2, "articles": len(articles),
+               "mean_chars": round(float(np.mean([len(article["text"]) for article in articles])))}
+    rss_before = current_rss_mb()
+    start = time.perf_counter()
+    router = ArticleRouter(rows, aliases)
+    results["build_s"] = round(time.perf_counter() - start, 2)
+    results["states"] = len(router.matcher)
+    results["rss_added_mb"] = round(current_rss_mb() - rss_before, 1)
+    # A monitor edit replaces one row; the view refresh updates the router instead of rebuilding it
+    start = time.perf_counter()
+    router.updated(rows[1:] + [{"monitor": "freshly added monitor", "company": "Company 1"}], aliases)
+    results["update_one_ms"] = round((time.perf_counter() - start) * 1000, 1)
+    latencies, routed = [], []
+    for article in articles:
+        start = time.perf_counter()
+        _, matched = router.route(article["text"])
+        latencies.append((time.perf_counter() - start) * 1000)
+        routed.append(len(matched))
+    results["route_ms"] = percentiles(latencies)
+    results["companies_per_article"] = round(float(np.mean(routed)), 1)
+
+    names = {name for row in rows for name in (row["monitor"], row["company"])}
+    start = time.perf_counter()
+    pattern = re.compile(rf"\b(?:{'|'.join(re.escape(name) for name in sorted(names, key=len, reverse=True))})\b", re.IGNORECASE)
+    results["regex_compile_s"] = round(time.perf_counter() - start, 2)
+    latencies = []
+    for article in articles[:20]:
+        start = time.perf_counter()
+        pattern.findall(article["text"])
+        latencies.append((time.perf_counter() - start) * 1000)
+    results["regex_ms"] = percentiles(latencies)
+    return results
+
+
+def agreement_benchmark(agent, articles, mode):
+    """Run both the triage and the full model on every article that passes the gate and compare them.
+
+    The full model calls an article risky when any verdict is critical; triage
+    flags it when it would escalate. A miss is a risky article that triage
+    would not have escalated, which the cascade reports as no risk. Labelled
+    articles are also scored against their label, counting gated ones as none.
+    """
+    view = agent.view
+    records = []
+    for article in articles:
+        text = article["text"]
+        record = {"label": article.get("label")}
+        embedding = view.gate.embed(text)
+        gate = view.gate.check(text, embedding=embedding)
+        if gate["passed"]:
+            condensed, _ = agent.condenser.condense(text, view.gate.matched_vectors(gate, embedding))
+            _, _, escalate, cascade = agent.triage(condensed, embedding, {}, view, gate["companies"])
+            timings = {}
+            if mode == "direct":
+                response_text, usage = agent.run_direct(condensed, embedding, timings, view, gate["companies"])
+            else:
+                with timed(timings, "llm"):
+                    response_text, usage = agent.run_agent(condensed, view, gate["companies"])
+            critical = any(verdict.get("risk") == "critical" for verdict in parse_verdicts(response_text))
+            record.update(escalated=escalate, critical=critical, triage=cascade["tiers"]["triage"],
+                          full=tier_record(agent.llm, usage, timings["llm_ms"]))
+        records.append(record)
+
+    assessed = [record for record in records if "critical" in record]
+    share = lambda count, total: round(count / total, 3) if total else None
+    results = {
+        "articles": len(records),
+        "assessed": len(assessed),
+        "escalation_rate": share(sum(r["escalated"] for r in assessed), len(assessed)),
+        "disagreement_rate": share(sum(r["escalated"] != r["critical"] for r in assessed), len(assessed)),
+        "missed_risks": sum(r["critical"] and not r["escalated"] for r in assessed),
+        "needless_escalations": sum(r["escalated"] and not r["critical"] for r in assessed),
+    }
+    for tier in ("triage", "full"):
+        results[tier] = {
+            "model": assessed[0][tier]["model"] if assessed else None,
+            "latency_ms": percentiles([r[tier]["latency_ms"] for r in assessed]),
+            "cost_usd": round(sum(r[tier]["cost_usd"] for r in assessed), 4),
+        }
+    cascade_cost = sum(r["triage"]["cost_usd"] + (r["full"]["cost_usd"] if r["escalated"] else 0) for r in assessed)
+    results["cascade"] = {
+        "latency_ms": percentiles([r["triage"]["latency_ms"] + (r["full"]["latency_ms"] if r["escalated"] else 0) for r in assessed]),
+        "cost_usd": round(cascade_cost, 4),
+    }
+
+    labelled = [record for record in records if record["label"] is not None]
+    if labelled:
+        truth = [record["label"] == "critical" for record in labelled]
+        full = [record.get("critical", False) for record in labelled]
+        cascade = [record.get("critical", False) and record.get("escalated", False) for record in labelled]
+        for name, predicted in (("full", full), ("cascade", cascade)):
+            results[f"{name}_vs_labels"] = {
+                "accuracy": share(sum(p == t for p, t in zip(predicted, truth)), len(truth)),
+                "recall": share(sum(p and t for p, t in zip(predicted, truth)), sum(truth)),
+                "precision": share(sum(p and t for p, t in zip(predicted, truth)), sum(predicted)),
+            }
+        results["labelled"] = len(labelled)
+    return results
+
+
+def current_rss_mb():
+    with open("/proc/self/status") as file:
+        for line in file:
+            if line.startswith("VmRSS:"):
+                return round(int(line.split()[1]) / 1024, 1)
+
+
+def ann_benchmark(count, dim=384, companies=1000, queries=200, seed=7):
+    """Fill an IVF monitor store with clustered synthetic vectors and time searches, adds and deletes.
+
+    Recall@10 is measured against exact search over the same vectors.
+    """
+    import gc
+    from monitor_store import IVFStore
+
+    rng = np.random.default_rng(seed)
+    centers = rng.standard_normal((max(1, count // 500), dim)).astype(np.float32)
+    results = {"monitors": count, "dim": dim, "raw_vectors_mb": round(count * dim * 4 / 2**20, 1)}
+    with tempfile.TemporaryDirectory() as workdir:
+        store = IVFStore(os.path.join(workdir, "ivf"))
+        start = time.perf_counter()
+        for offset in range(0, count, 65536):
+            n = min(65536, count - offset)
+            vectors = centers[rng.integers(len(centers), size=n)] + 0.5 * rng.standard_normal((n, dim)).astype(np.float32)
+            store.add([
+                {"ref_id": f"monitor:{i}", "node_id": f"monitor:{i}#0", "monitor": f"Monitor {i}",
+                 "company": f"Company {i % companies}", "row_hash": "", "embedding": vector}
+                for i, vector in zip(range(offset, offset + n), vectors)
+            ])
+        results["fill_s"] = round(time.perf_counter() - start, 1)
+        start = time.perf_counter()
+        store.train()
+        results["train_s"] = round(time.perf_counter() - start, 1)
+        del store
+        gc.collect()
+
+        rss_before = current_rss_mb()
+        store = IVFStore(os.path.join(workdir, "ivf"))
+        results["open_s"] = round(time.perf_counter() - start - results["train_s"], 2)
+        picks = rng.integers(store.count, size=queries)
+        targets = store.get_vectors(store.ids[picks]) + 0.3 * rng.standard_normal((queries, dim)).astype(np.float32) / np.sqrt(dim)
+        targets /= np.linalg.norm(targets, axis=1, keepdims=True)
+        for label, company in [("unfiltered", None), ("company", "Company 42")]:
+            latencies, recalls = [], []
+            for i, query in enumerate(targets):
+                start = time.perf_counter()
+                found, _ = store.search(query, 10, companies=None if company is None else [company])
+                latencies.append((time.perf_counter() - start) * 1000)
+                if i < 50:
+                    members = np.arange(store.count) if company is None else np.flatnonzero(store.company[:store.count] == store.companies[company.lower()])
+                    exact = store.ids[members[np.argsort(-(store.vectors[members] @ query))[:10]]]
+                    recalls.append(len(set(found) & set(exact)) / 10)
+            results[label] = {"latency_ms": percentiles(latencies), "recall_at_10": round(float(np.mean(recalls)), 3)}
+        results["rss_after_queries_mb"] = current_rss_mb()
+        results["rss_added_by_store_mb"] = round(results["rss_after_queries_mb"] - rss_before, 1)
+
+        extra = [{"ref_id": f"extra:{i}", "node_id": f"extra:{i}#0", "monitor": f"Extra {i}", "company": "Company 1",
+                  "row_hash": "", "embedding": vector} for i, vector in enumerate(rng.standard_normal((1000, dim)))]
+        start = time.perf_counter()
+        store.add(extra)
+        results["add_1000_ms"] = round((time.perf_counter() - start) * 1000, 1)
+        start = time.perf_counter()
+        store.delete([item["ref_id"] for item in extra])
+        results["delete_1000_ms"] = round((time.perf_counter() - start) * 1000, 1)
+    return results
+
+
+def store_benchmark(count, monitors=2000, companies=200, days=30, seed=7):
+    """Fill an assessment store with count synthetic assessments over `days` and time writes and queries.
+
+    Rows are written in writer-thread batches with spread-out timestamps;
+    the enqueue cost a request pays is timed separately on the live queue.
+    """
+    from assessment_store import ASSESSMENT_STORE_BATCH, AssessmentStore
+
+    rng = np.random.default_rng(seed)
+    risks = np.array(["none", "low", "medium", "high", "critical"])
+    now = time.time()
+    results = {"assessments": count, "monitors": monitors, "days": days}
+    with tempfile.TemporaryDirectory() as workdir:
+        path = os.path.join(workdir, "assessments.db")
+        store = AssessmentStore(path, companies=lambda version: {f"monitor {i}": f"Company {i % companies}" for i in range(monitors)})
+        sample = {"monitors": [{"monitor": "Monitor 1", "risk": "critical", "reason": "synthetic"}], "gate": {"passed": True},
+                  "mode": "direct", "monitor_version": 1, "timings": {"embed": 1.0, "llm": 200.0}, "latency_ms": 210.0}
+        latencies = []
+        for _ in range(2000):
+            start = time.perf_counter()
+            store.record(sample, article="https://example.com/article")
+            latencies.append((time.perf_counter() - start) * 1e6)
+        results["enqueue_us"] = percentiles(latencies)
+        store.flush()
+
+        elapsed, verdicts = 0.0, 0
+        for offset in range(0, count, ASSESSMENT_STORE_BATCH):
+            batch = []
+            for i in range(offset, min(offset + ASSESSMENT_STORE_BATCH, count)):
+                picked = rng.integers(monitors, size=rng.integers(0, 4))
+                verdicts += len(picked)
+                result = {**sample, "monitors": [
+                    {"monitor": f"Monitor {m}", "risk": str(risks[np.searchsorted([0.6, 0.8, 0.92, 0.98], rng.random(), side="right")]),
+                     "reason": "synthetic"} for m in picked
+                ]}
+                batch.append((now - days * 86400 * (1 - i / count), result, f"https://site{i % 50}.example/{i}", None))
+            start = time.perf_counter()
+            store._write(batch)
+            elapsed += time.perf_counter() - start
+        results["verdicts"] = verdicts
+        results["write_per_s"] = round(count / elapsed)
+        results["db_mb"] = round(sum(os.path.getsize(os.path.join(workdir, name)) for name in os.listdir(workdir)) / 2**20, 1)
+
+        queries = {
+            "critical_per_monitor_per_hour_24h": lambda: store.aggregate("hour", "monitor", risk="critical", since=now - 86400),
+            "critical_per_company_per_day_30d": lambda: store.aggregate("day", "company", risk="critical", since=now - days * 86400),
+            "risk_per_hour_one_monitor_7d": lambda: store.aggregate("hour", "risk", monitor="Monitor 42", since=now - 7 * 86400),
+            "verdicts_page_one_company": lambda: store.verdicts(company="Company 7", limit=50),
+            "verdicts_page_critical": lambda: store.verdicts(risk="critical", limit=50),
+            "assessments_page": lambda: store.assessments(since=now - 86400, limit=50),
+        }
+        for name, query in queries.items():
+            latencies = []
+            for _ in range(20):
+                start = time.perf_counter()
+                query()
+                latencies.append((time.perf_counter() - start) * 1000)
+            results[name] = percentiles(latencies)
+        page, start = store.verdicts(company="Company 7", limit=50), time.perf_counter()
+        for _ in range(100):
+            page = store.verdicts(company="Company 7", limit=50, before=page["next"])
+        results["verdicts_page_101_ms"] = round((time.perf_counter() - start) * 1000 / 100, 2)
+    return results
+
+
+def ingest_benchmark(workers_levels, copies, seed=7):
+    """Ingest `copies` copies of the archive corpus into a fresh reference corpus at each worker count.
+
+    Each copy gets a trailing comment so its hash differs, as distinct
+    documents would. Embeddings use the hashing backend, so the numbers
+    measure parsing, chunking and persistence rather than an embedding API.
+    A second run over the last corpus times the unchanged-file skip, and
+    prior-coverage searches are timed against it.
+    """
+    from embeddings import get_embed_model
+
+    paths = sorted({path for pattern in CORPUS for path in glob.glob(pattern)})
+    results = {"cpus": os.cpu_count(), "levels": []}
+    with tempfile.TemporaryDirectory() as workdir:
+        source = os.path.join(workdir, "documents")
+        os.makedirs(source)
+        for copy in range(copies):
+            for path in paths:
+                name, extension = os.path.splitext(os.path.basename(path))
+                with open(path, "rb") as file:
+                    data = file.read()
+                marker = f"\n%% copy {copy}\n" if extension.lower() == ".pdf" else f"\n<!-- copy {copy} -->\n"
+                with open(os.path.join(source, f"{name} {copy}{extension}"), "wb") as file:
+                    file.write(data + marker.encode())
+        results["documents"] = len(os.listdir(source))
+        for workers in workers_levels:
+            corpus_dir = os.path.join(workdir, f"corpus-{workers}")
+            stats = ingest([source], corpus_dir=corpus_dir, embed_model=get_embed_model("hashing"), workers=workers)
+            results["levels"].append(stats)
+            print(f"{workers} workers: {stats['docs_per_s']} docs/s ({stats['elapsed_s']}s, parse {stats['parse_s']}s, embed {stats['embed_s']}s)")
+        start = time.perf_counter()
+        rerun = ingest([source], corpus_dir=corpus_dir, embed_model=get_embed_model("hashing"), workers=workers_levels[-1])
+        results["unchanged_rerun_s"] = round(time.perf_counter() - start, 2)
+        results["unchanged_skipped"] = rerun["skipped"]
+
+        embed_model = get_embed_model("hashing")
+        corpus = ReferenceCorpus(corpus_dir, embed_model_name=embed_model.model_name)
+        articles = load_corpus()
+        queries = [embed_model.get_text_embedding(article["text"]) for article in articles]
+        latencies, found = [], []
+        for _ in range(20):
+            for query, article in zip(queries, articles):
+                start = time.perf_counter()
+                found.append(len(corpus.search(query, article["text"])))
+                latencies.append((time.perf_counter() - start) * 1000)
+        results["corpus_chunks"] = len(corpus.chunks)
+        results["search_ms"] = percentiles(latencies)
+        results["references_per_article"] = round(float(np.mean(found)), 2)
+    return results
+
+
+def compare(current, baseline, tolerance):
+    """Print per-level deltas against a previous run; returns False on a regression beyond tolerance."""
+    ok = True
+    previous = {level["concurrency"]: level for level in baseline["levels"]}
+    for level in current["levels"]:
+        before = previous.get(level["concurrency"])
+        if not before:
+            continue
+        for key, now, then, higher_is_better in [
+            ("throughput_per_s", level["throughput_per_s"], before["throughput_per_s"], True),
+            ("total p50 ms", level["stages_ms"]["total"].get("p50"), before["stages_ms"]["total"].get("p50"), False),
+            ("total p99 ms", level["stages_ms"]["total"].get("p99"), before["stages_ms"]["total"].get("p99"), False),
+        ]:
+            if not now or not then:
+                continue
+            change = (now - then) / then
+            regressed = change < -tolerance if higher_is_better else change > tolerance
+            ok &= not regressed
+            print(f"concurrency {level['concurrency']:>3} {key:<17} {then:>10} -> {now:>10} ({change:+.1%}){'  REGRESSION' if regressed else ''}")
+    return ok
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Offline replay benchmark for PRMonitorAgent with local LLM/embedding stand-ins.")
+    parser.add_argument("--mode", default="agent", choices=["agent", "direct"])
+    parser.add_argument("--monitors", default=MONITORS_CSV)
+    parser.add_argument("--synthetic", type=int, default=50, help="Synthetic articles added to the archive corpus.")
+    parser.add_argument("--no-corpus", action="store_true", help="Only replay synthetic articles.")
+    parser.add_argument("--concurrency", default="1,4,16", help="Comma-separated concurrency levels.")
+    parser.add_argument("--llm-latency", type=float, default=0.2, help="Seconds per stand-in LLM call.")
+    parser.add_argument("--token-latency", type=float, default=0.0, help="Extra seconds per completion token.")
+    parser.add_argument("--embed-latency", type=float, default=0.02, help="Seconds per stand-in embedding call.")
+    parser.add_argument("--timeout", type=float, default=120)
+    parser.add_argument("--output", default="bench_results.json")
+    parser.add_argument("--compare", help="Previous results file to compare against.")
+    parser.add_argument("--ann", type=int, help="Benchmark the IVF monitor store with this many synthetic monitors instead of replaying.")
+    parser.add_argument("--ann-dim", type=int, default=384)
+    parser.add_argument("--llm", default="stand-in", choices=["stand-in", "config"], help="Full model: the stand-in, or ASSESSMENT_MODEL.")
+    parser.add_argument("--llm-model", default="gpt-4", help="Model name the stand-in LLM reports, for cost estimates.")
+    parser.add_argument("--triage", default="off", choices=["off", "stand-in", "config"], help="Triage tier: none, a stand-in, or TRIAGE_MODEL.")
+    parser.add_argument("--triage-model", default="gpt-4o-mini", help="Model name the stand-in triage LLM reports.")
+    parser.add_argument("--triage-latency", type=float, default=0.05, help="Seconds per stand-in triage call.")
+    parser.add_argument("--triage-keywords", type=int, default=3, help="Risk keywords the stand-in triage model knows.")
+    parser.add_argument("--labels", help="Labelled replay set (JSON lines of text and label) replayed instead of the corpus.")
+    parser.add_argument("--agreement", action="store_true", help="Measure how often triage disagrees with the full model instead of timing levels.")
+    parser.add_argument("--router", type=int, help="Benchmark entity routing over this many synthetic monitor names instead of replaying.")
+    parser.add_argument("--store", type=int, help="Benchmark the assessment store with this many synthetic assessments instead of replaying.")
+    parser.add_argument("--ingest", help="Comma-separated worker counts to benchmark reference corpus ingestion with instead of replaying.")
+    parser.add_argument("--ingest-copies", type=int, default=20, help="Copies of the archive corpus ingested with --ingest.")
+    parser.add_argument("--references", help="Reference corpus directory the agent draws prior coverage from; off by default.")
+    parser.add_argument("--embed-backends", help="Comma-separated embedding backends to compare instead of replaying, e.g. hashing,onnx,openai.")
+    parser.add_argument("--tolerance", type=float, default=0.1, help="Allowed relative regression with --compare.")
+    args = parser.parse_args()
+
+    if args.ann:
+        results = ann_benchmark(args.ann, dim=args.ann_dim)
+        with open(args.output, "w") as file:
+            json.dump({"meta": {"timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"), "args": vars(args)}, "ann": results}, file, indent=2)
+        print(json.dumps(results, indent=2))
+        return
+
+    if args.ingest:
+        results = ingest_benchmark([int(level) for level in args.ingest.split(",")], args.ingest_copies)
+        with open(args.output, "w") as file:
+            json.dump({"meta": {"timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"), "args": vars(args)}, "ingest": results}, file, indent=2)
+        print(json.dumps({key: value for key, value in results.items() if key != "levels"}, indent=2))
+        return
+    if args.store:
+        results = store_benchmark(args.store)
+        with open(args.output, "w") as file:
+            json.dump({"meta": {"timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"), "args": vars(args)}, "store": results}, file, indent=2)
+        print(json.dumps(results, indent=2))
+        return
+
+    if args.labels:
+        articles = load_labelled(args.labels)
+    else:
+        articles = [] if args.no_corpus else load_corpus()
+        articles += synthetic_articles(read_monitors(args.monitors), args.synthetic)
+    if args.embed_backends:
+        results = embedding_benchmark(args.embed_backends.split(","), articles)
+        with open(args.output, "w") as file:
+            json.dump({"meta": {"timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"), "args": vars(args)}, "embeddings": results}, file, indent=2)
+        print(f"Results written to {args.output}")
+        return
+    if args.router:
+        results = router_benchmark(articles, args.router)
+        with open(args.output, "w") as file:
+            json.dump({"meta": {"timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"), "args": vars(args)}, "router": results}, file, indent=2)
+        print(json.dumps(results, indent=2))
+        return
+    if args.agreement:
+        if args.triage == "off":
+            parser.error("--agreement needs a triage model, see --triage")
+        with tempfile.TemporaryDirectory() as workdir:
+            results = agreement_benchmark(build_agent(args, workdir), articles, args.mode)
+        with open(args.output, "w") as file:
+            json.dump({"meta": {"timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"), "args": vars(args)}, "agreement": results}, file, indent=2)
+        print(json.dumps(results, indent=2))
+        return
+    tracemalloc.start()
+    with tempfile.TemporaryDirectory() as workdir:
+        start = time.perf_counter()
+        agent = build_agent(args, workdir)
+        startup = time.perf_counter() - start
+        levels = [asyncio.run(run_level(agent, articles, int(c), args)) for c in args.concurrency.split(",")]
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    results = {
+        "meta": {
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "python": platform.python_version(),
+            "args": vars(args),
+        },
+        "corpus": {"articles": len(articles), "chars": sum(len(a["text"]) for a in articles)},
+        "startup_s": round(startup, 3),
+        "levels": levels,
+        "memory": {
+            "tracemalloc_peak_mb": round(peak / 2**20, 1),
+            "max_rss_mb": round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1),
+        },
+    }
+    with open(args.output, "w") as file:
+        json.dump(results, file, indent=2)
+    for level in levels:
+        print(f"concurrency {level['concurrency']:>3}: {level['throughput_per_s']} articles/s, total p50 {level['stages_ms']['total'].get('p50')} ms")
+    print(f"Results written to {args.output}")
+
+    if args.compare:
+        with open(args.compare) as file:
+            if not compare(results, json.load(file), args.tolerance):
+                sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
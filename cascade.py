@@ -0,0 +1,64 @@
+import logging
+from os import environ
+
+# Model that classifies articles on its own unless a triage model is configured, and after escalation
+ASSESSMENT_MODEL = environ.get("ASSESSMENT_MODEL", "gpt-4")
+# Small model that sees every article first; empty disables the cascade
+TRIAGE_MODEL = environ.get("TRIAGE_MODEL", "")
+# OpenAI-compatible endpoint serving TRIAGE_MODEL, e.g. a local vLLM or llama.cpp server; empty uses OpenAI
+TRIAGE_API_BASE = environ.get("TRIAGE_API_BASE", "")
+TRIAGE_API_KEY = environ.get("TRIAGE_API_KEY", "")
+TRIAGE_CONTEXT_WINDOW = int(environ.get("TRIAGE_CONTEXT_WINDOW", "8192"))
+# USD per million prompt and completion tokens; add or override as "model=prompt/completion,..." in MODEL_PRICES
+PRICES = {"gpt-4": (30.0, 60.0), "gpt-4o": (2.5, 10.0), "gpt-4o-mini": (0.15, 0.6), "gpt-3.5-turbo": (0.5, 1.5)}
+
+
+def model_prices(spec):
+    prices = dict(PRICES)
+    for item in filter(None, (part.strip() for part in spec.split(","))):
+        model, _, price = item.partition("=")
+        prompt, _, completion = price.partition("/")
+        prices[model.strip()] = (float(prompt), float(completion or prompt))
+    return prices
+
+
+MODEL_PRICES = model_prices(environ.get("MODEL_PRICES", ""))
+
+
+def llm_cost(model, usage):
+    """Estimated USD cost of a token usage dict; 0 for models without a known price."""
+    prompt, completion = MODEL_PRICES.get(model, (0.0, 0.0))
+    return (usage.get("prompt_tokens", 0) * prompt + usage.get("completion_tokens", 0) * completion) / 1e6
+
+
+def model_name(llm):
+    return getattr(llm, "model", None) or llm.metadata.model_name
+
+
+def build_triage_llm(model=TRIAGE_MODEL, api_base=TRIAGE_API_BASE):
+    """The configured triage LLM, or None when the cascade is disabled."""
+    if not model:
+        return None
+    if api_base:
+        from llama_index.llms.openai_like import OpenAILike
+
+        logging.info(f"Triage model {model} at {api_base}")
+        return OpenAILike(model=model, api_base=api_base, api_key=TRIAGE_API_KEY or "none", is_chat_model=True,
+                          context_window=TRIAGE_CONTEXT_WINDOW)
+    from llama_index.llms.openai import OpenAI
+
+    return OpenAI(model=model)
+
+
+def needs_escalation(verdicts):
+    """Whether the full model should see an article, given the triage verdicts.
+
+    Anything but a clean answer of no risk for every monitor escalates,
+    including a reply that could not be parsed.
+    """
+    return not verdicts or any(str(verdict.get("risk", "")).strip().lower() != "none" for verdict in verdicts)
+
+
+def tier_record(llm, usage, latency_ms):
+    model = model_name(llm)
+    return {"model": model, "latency_ms": latency_ms, "usage": usage, "cost_usd": round(llm_cost(model, usage), 6)}
@@ -0,0 +1,108 @@
+import re
+from os import environ
+
+import numpy as np
+from llama_index.core.utils import get_tokenizer
+
+from relevance import normalize_rows
+
+# Max tokens of article text sent to the LLM; 0 sends the full article
+CONDENSE_TOKEN_BUDGET = int(environ.get("CONDENSE_TOKEN_BUDGET", "1500"))
+# Opening passages (headline and lead) that are always kept
+CONDENSE_LEAD_PASSAGES = int(environ.get("CONDENSE_LEAD_PASSAGES", "2"))
+PASSAGE_MAX_CHARS = 800
+GAP_MARKER = "\n[...]\n"
+
+
+def count_tokens(text):
+    return len(get_tokenizer()(text))
+
+
+def split_passages(text, max_chars=PASSAGE_MAX_CHARS):
+    """Split an article into paragraph-sized passages, breaking long paragraphs at sentence ends."""
+    passages = []
+    for paragraph in re.split(r"\n\s*\n|\n", text):
+        paragraph = paragraph.strip()
+        if not paragraph:
+            continue
+        if len(paragraph) <= max_chars:
+            passages.append(paragraph)
+            continue
+        current = ""
+        for sentence in re.split(r"(?<=[.!?])\s+", paragraph):
+            if current and len(current) + len(sentence) + 1 > max_chars:
+                passages.append(current)
+                current = sentence
+            else:
+                current = f"{current} {sentence}".strip()
+        if current:
+            passages.append(current)
+    return passages
+
+
+class Condenser:
+    """Trims an article to the passages most similar to the monitors it matched.
+
+    The headline and lead are always kept; remaining passages are ranked by
+    their best cosine similarity to any matched monitor and added until the
+    token budget is spent, then emitted in their original order.
+    """
+
+    def __init__(self, embed_model, budget=CONDENSE_TOKEN_BUDGET, lead=CONDENSE_LEAD_PASSAGES):
+        self.embed_model = embed_model
+        self.budget = budget
+        self.lead = lead
+
+    def _plan(self, article_text):
+        passages = split_passages(article_text)
+        tokens = [count_tokens(passage) for passage in passages]
+        return passages, tokens, sum(tokens)
+
+    def _select(self, passages, tokens, original, passage_embeddings, monitor_vectors):
+        lead = min(self.lead, len(passages))
+        keep = set(range(lead))
+        used = sum(tokens[i] for i in keep)
+        rest = list(range(lead, len(passages)))
+        if rest and len(monitor_vectors):
+            similarity = normalize_rows(np.asarray(passage_embeddings, dtype=np.float32)) @ normalize_rows(monitor_vectors).T
+            best = similarity.max(axis=1)
+            rest.sort(key=lambda i: -best[i - lead])
+        for i in rest:
+            if used + tokens[i] <= self.budget:
+                keep.add(i)
+                used += tokens[i]
+        pieces, previous = [], -1
+        for i in sorted(keep):
+            if pieces and i != previous + 1:
+                pieces.append(GAP_MARKER)
+            elif pieces:
+                pieces.append("\n")
+            pieces.append(passages[i])
+            previous = i
+        condensed = "".join(pieces)
+        return condensed, {
+            "original_tokens": original,
+            "condensed_tokens": count_tokens(condensed),
+            "passages_kept": len(keep),
+            "passages_total": len(passages),
+        }
+
+    def _unchanged(self, article_text, original):
+        return article_text, {"original_tokens": original, "condensed_tokens": original}
+
+    def condense(self, article_text, monitor_vectors):
+        """Return the condensed article and a report of token counts before and after."""
+        passages, tokens, original = self._plan(article_text)
+        if not self.budget or original <= self.budget:
+            return self._unchanged(article_text, original)
+        lead = min(self.lead, len(passages))
+        embeddings = self.embed_model.get_text_embedding_batch(passages[lead:]) if len(passages) > lead else []
+        return self._select(passages, tokens, original, embeddings, monitor_vectors)
+
+    async def acondense(self, article_text, monitor_vectors):
+        passages, tokens, original = self._plan(article_text)
+        if not self.budget or original <= self.budget:
+            return self._unchanged(article_text, original)
+        lead = min(self.lead, len(passages))
+        embeddings = await self.embed_model.aget_text_embedding_batch(passages[lead:]) if len(passages) > lead else []
+        return self._select(passages, tokens, original, embeddings, monitor_vectors)
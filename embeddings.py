@@ -0,0 +1,194 @@
+import asyncio
+import hashlib
+import re
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from os import environ
+from typing import Any, Callable, List
+
+import numpy as np
+from llama_index.core.base.embeddings.base import BaseEmbedding
+from llama_index.core.bridge.pydantic import PrivateAttr
+
+# "openai" (remote, the default), "sentence-transformers" or "onnx" (local CPU models), or "hashing" (no model at all).
+# Scores differ between models, so RELEVANCE_THRESHOLD usually needs retuning after switching.
+EMBED_BACKEND = environ.get("EMBED_BACKEND", "openai")
+EMBED_BACKENDS = ("openai", "sentence-transformers", "onnx", "hashing")
+# Model name for openai / sentence-transformers / onnx; empty uses each backend's default
+EMBED_MODEL_NAME = environ.get("EMBED_MODEL_NAME", "")
+DEFAULT_LOCAL_MODEL = "sentence-transformers/all-MiniLM-L6-v2"
+EMBED_BATCH_SIZE = int(environ.get("EMBED_BATCH_SIZE", "32"))
+# Batches embedded at once; local models share the CPU, so keep this near the core count
+EMBED_WORKERS = int(environ.get("EMBED_WORKERS", "4"))
+# Embeddings kept in memory, keyed by a hash of the text
+EMBED_CACHE_SIZE = int(environ.get("EMBED_CACHE_SIZE", "4096"))
+HASHING_DIM = int(environ.get("EMBED_HASHING_DIM", "256"))
+
+
+def hashing_vector(text, dim):
+    """Signed feature-hashing vector over words and word bigrams, L2-normalized."""
+    words = re.findall(r"\w+", text.lower())
+    vector = np.zeros(dim, dtype=np.float32)
+    for feature in words + [f"{a} {b}" for a, b in zip(words, words[1:])]:
+        digest = int.from_bytes(hashlib.blake2b(feature.encode("utf-8"), digest_size=8).digest(), "little")
+        vector[digest % dim] += 1.0 if digest >> 63 else -1.0
+    norm = np.linalg.norm(vector)
+    return (vector / norm if norm else vector).tolist()
+
+
+def text_key(text):
+    return hashlib.blake2b(text.encode("utf-8"), digest_size=16).digest()
+
+
+class BatchedEmbedding(BaseEmbedding):
+    """Embedding model around an encode(texts) function, with batching, a thread pool and a cache.
+
+    Texts already in the cache are not embedded again; the rest are
+    de-duplicated, split into batches of batch_size and encoded on at most
+    `workers` threads. Queries and documents are embedded the same way.
+    """
+
+    batch_size: int = EMBED_BATCH_SIZE
+    _encode: Callable[[List[str]], List[List[float]]] = PrivateAttr()
+    _executor: ThreadPoolExecutor = PrivateAttr()
+    _cache: OrderedDict = PrivateAttr()
+    _cache_size: int = PrivateAttr()
+    _lock: threading.Lock = PrivateAttr()
+    _stats: dict = PrivateAttr()
+
+    def __init__(self, encode, model_name, batch_size=EMBED_BATCH_SIZE, workers=EMBED_WORKERS, cache_size=EMBED_CACHE_SIZE, **kwargs: Any):
+        # BaseEmbedding hands over large chunks; batching happens in _get_text_embeddings
+        super().__init__(model_name=model_name, batch_size=batch_size, embed_batch_size=2048, **kwargs)
+        self._encode = encode
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="embed")
+        self._cache = OrderedDict()
+        self._cache_size = cache_size
+        self._lock = threading.Lock()
+        self._stats = {"hits": 0, "misses": 0, "batches": 0}
+
+    @classmethod
+    def class_name(cls) -> str:
+        return "BatchedEmbedding"
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {**self._stats, "cached": len(self._cache)}
+
+    def after_fork(self):
+        """Fresh worker threads, lock and API clients in a forked child; the cache is kept."""
+        self._executor = ThreadPoolExecutor(max_workers=self._executor._max_workers, thread_name_prefix="embed")
+        self._lock = threading.Lock()
+        reset_clients(getattr(self._encode, "__self__", None))
+
+    def _lookup(self, texts):
+        """Cached embeddings by position, and the distinct texts that still need embedding."""
+        found, missing = {}, {}
+        with self._lock:
+            for i, text in enumerate(texts):
+                key = text_key(text)
+                if key in self._cache:
+                    self._cache.move_to_end(key)
+                    found[i] = self._cache[key]
+                else:
+                    missing.setdefault(text, key)
+            self._stats["hits"] += len(found)
+            self._stats["misses"] += len(missing)
+        return found, missing
+
+    def _store(self, missing, vectors):
+        embedded = {}
+        with self._lock:
+            for (text, key), vector in zip(missing.items(), vectors):
+                vector = np.asarray(vector, dtype=np.float32)
+                embedded[text] = vector
+                if self._cache_size:
+                    self._cache[key] = vector
+                    self._cache.move_to_end(key)
+            while len(self._cache) > self._cache_size:
+                self._cache.popitem(last=False)
+        return embedded
+
+    def _batches(self, texts):
+        batches = [texts[i:i + self.batch_size] for i in range(0, len(texts), self.batch_size)]
+        with self._lock:
+            self._stats["batches"] += len(batches)
+        return batches
+
+    def _combine(self, texts, found, embedded):
+        return [(found[i] if i in found else embedded[text]).tolist() for i, text in enumerate(texts)]
+
+    def _get_text_embeddings(self, texts: List[str]) -> List[List[float]]:
+        found, missing = self._lookup(texts)
+        embedded = {}
+        if missing:
+            batches = self._batches(list(missing))
+            if len(batches) == 1:
+                results = [self._encode(batches[0])]
+            else:
+                results = list(self._executor.map(self._encode, batches))
+            embedded = self._store(missing, [vector for result in results for vector in result])
+        return self._combine(texts, found, embedded)
+
+    async def _aget_text_embeddings(self, texts: List[str]) -> List[List[float]]:
+        found, missing = self._lookup(texts)
+        embedded = {}
+        if missing:
+            loop = asyncio.get_running_loop()
+            results = await asyncio.gather(*(
+                loop.run_in_executor(self._executor, self._encode, batch) for batch in self._batches(list(missing))
+            ))
+            embedded = self._store(missing, [vector for result in results for vector in result])
+        return self._combine(texts, found, embedded)
+
+    def _get_text_embedding(self, text: str) -> List[float]:
+        return self._get_text_embeddings([text])[0]
+
+    def _get_query_embedding(self, query: str) -> List[float]:
+        return self._get_text_embeddings([query])[0]
+
+    async def _aget_text_embedding(self, text: str) -> List[float]:
+        return (await self._aget_text_embeddings([text]))[0]
+
+    async def _aget_query_embedding(self, query: str) -> List[float]:
+        return (await self._aget_text_embeddings([query]))[0]
+
+
+def reset_clients(model):
+    """Drop the HTTP clients an OpenAI LLM or embedding model caches, so a forked child opens its own connections."""
+    for name in ("_client", "_aclient"):
+        if getattr(model, name, None) is not None:
+            setattr(model, name, None)
+
+
+def sentence_transformer_encoder(model_name, backend="torch"):
+    from sentence_transformers import SentenceTransformer
+
+    model = SentenceTransformer(model_name, device="cpu", backend=backend)
+
+    def encode(texts):
+        return model.encode(texts, batch_size=len(texts), normalize_embeddings=True, convert_to_numpy=True)
+
+    return encode
+
+
+def openai_encoder(model_name):
+    from llama_index.embeddings.openai import OpenAIEmbedding
+
+    model = OpenAIEmbedding(model=model_name) if model_name else OpenAIEmbedding()
+    return model._get_text_embeddings, model.model_name
+
+
+def get_embed_model(backend=EMBED_BACKEND, model_name=EMBED_MODEL_NAME, **kwargs):
+    """Build the configured embedding backend, wrapped with batching and the embedding cache."""
+    if backend == "openai":
+        encode, model_name = openai_encoder(model_name)
+    elif backend in ("sentence-transformers", "onnx"):
+        model_name = model_name or DEFAULT_LOCAL_MODEL
+        encode = sentence_transformer_encoder(model_name, backend="onnx" if backend == "onnx" else "torch")
+    elif backend == "hashing":
+        model_name = str(HASHING_DIM)
+        encode = lambda texts: [hashing_vector(text, HASHING_DIM) for text in texts]
+    else:
+        raise ValueError(f"Unknown embedding backend {backend!r}, expected one of {EMBED_BACKENDS}")
+    return BatchedEmbedding(encode, model_name=f"{backend}:{model_name}", **kwargs)
@@ -0,0 +1,133 @@
+import asyncio
+import logging
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from os import environ
+
+import requests
+from newspaper import Article
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+from metrics import errors, stage_latency
+
+FETCH_CONNECT_TIMEOUT = float(environ.get("FETCH_CONNECT_TIMEOUT", "5"))
+FETCH_READ_TIMEOUT = float(environ.get("FETCH_READ_TIMEOUT", "15"))
+FETCH_MAX_BYTES = int(environ.get("FETCH_MAX_BYTES", str(5 * 1024 * 1024)))
+FETCH_WORKERS = int(environ.get("FETCH_WORKERS", "16"))
+# Pooled keep-alive connections per host, and hosts whose pools are kept
+FETCH_POOL_SIZE = int(environ.get("FETCH_POOL_SIZE", "8"))
+FETCH_POOL_HOSTS = int(environ.get("FETCH_POOL_HOSTS", "256"))
+# newspaper's keyword/summary extraction is slow and nothing downstream uses it
+FETCH_NLP = environ.get("FETCH_NLP", "0") == "1"
+USER_AGENT = environ.get("FETCH_USER_AGENT", "Mozilla/5.0 (compatible; ai-risk-monitor/1.0)")
+
+
+class FetchError(Exception):
+    pass
+
+
+class ArticleFetcher:
+    """Downloads articles over a pooled HTTP session and parses them in memory.
+
+    Downloads are streamed with connect/read timeouts and abort once the body
+    exceeds max_bytes. Fetch and parse are timed separately, and async callers
+    fetch on a bounded thread pool.
+    """
+
+    def __init__(self, workers=FETCH_WORKERS, max_bytes=FETCH_MAX_BYTES, nlp=FETCH_NLP):
+        self.max_bytes = max_bytes
+        self.nlp = nlp
+        self.timeout = (FETCH_CONNECT_TIMEOUT, FETCH_READ_TIMEOUT)
+        self.session = requests.Session()
+        self.session.headers["User-Agent"] = USER_AGENT
+        adapter = HTTPAdapter(
+            pool_connections=FETCH_POOL_HOSTS,
+            pool_maxsize=FETCH_POOL_SIZE,
+            max_retries=Retry(total=2, backoff_factor=0.3, status_forcelist=(502, 503, 504), allowed_methods=["GET"]),
+        )
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="fetch")
+
+    def download(self, url):
+        """Download a page, returning (html, final_url)."""
+        with self.session.get(url, timeout=self.timeout, stream=True) as response:
+            response.raise_for_status()
+            declared = int(response.headers.get("Content-Length") or 0)
+            if declared > self.max_bytes:
+                raise FetchError(f"{url} is {declared} bytes, over the {self.max_bytes} byte limit")
+            body = bytearray()
+            for chunk in response.iter_content(chunk_size=64 * 1024):
+                body += chunk
+                if len(body) > self.max_bytes:
+                    raise FetchError(f"{url} exceeded the {self.max_bytes} byte limit")
+            # requests assumes ISO-8859-1 when no charset is declared; news sites are overwhelmingly UTF-8
+            has_charset = "charset" in response.headers.get("Content-Type", "").lower()
+            encoding = response.encoding if has_charset and response.encoding else "utf-8"
+            return bytes(body).decode(encoding, errors="replace"), response.url
+
+    def parse(self, url, html, nlp=None):
+        """Parse downloaded HTML with newspaper3k without touching the network or disk."""
+        article = Article(url)
+        article.download(input_html=html)
+        article.parse()
+        if nlp is None:
+            nlp = self.nlp
+        if nlp:
+            article.nlp()
+        return article
+
+    def fetch(self, url, nlp=None) -> dict:
+        """Download and parse one article, reporting fetch and parse timings separately."""
+        start = time.perf_counter()
+        try:
+            html, final_url = self.download(url)
+            fetched = time.perf_counter()
+            article = self.parse(final_url, html, nlp=nlp)
+        except Exception:
+            errors.inc(stage="fetch")
+            raise
+        parsed = time.perf_counter()
+        stage_latency.observe(fetched - start, stage="fetch")
+        stage_latency.observe(parsed - fetched, stage="parse")
+        logging.info(f"Article title: {article.title}")
+        return {
+            "url": url,
+            "final_url": final_url,
+            "title": article.title,
+            "text": article.text,
+            "timings": {
+                "fetch_ms": round((fetched - start) * 1000, 1),
+                "parse_ms": round((parsed - fetched) * 1000, 1),
+                "html_chars": len(html),
+            },
+        }
+
+    async def afetch(self, url, nlp=None) -> dict:
+        return await asyncio.get_running_loop().run_in_executor(self.executor, self.fetch, url, nlp)
+
+
+_fetcher = None
+_fetcher_lock = threading.Lock()
+
+
+def _reset_after_fork():
+    # Pooled connections and pool threads belong to the parent; a forked child opens its own
+    global _fetcher, _fetcher_lock
+    _fetcher = None
+    _fetcher_lock = threading.Lock()
+
+
+os.register_at_fork(after_in_child=_reset_after_fork)
+
+
+def get_fetcher():
+    """Return the process-wide fetcher, so every caller shares one connection pool."""
+    global _fetcher
+    with _fetcher_lock:
+        if _fetcher is None:
+            _fetcher = ArticleFetcher()
+        return _fetcher
@@ -0,0 +1,142 @@
+import json
+import logging
+import multiprocessing
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from os import environ
+
+from metrics import errors
+
+JOB_WORKERS = int(environ.get("JOB_WORKERS", "4"))
+# "thread" shares the server's agent; "process" builds one agent per worker process
+JOB_WORKER_TYPE = environ.get("JOB_WORKER_TYPE", "thread")
+# Jobs allowed to wait for a worker before submissions are rejected
+JOB_QUEUE_SIZE = int(environ.get("JOB_QUEUE_SIZE", "100"))
+JOB_HISTORY = int(environ.get("JOB_HISTORY", "1000"))
+
+
+class QueueFull(Exception):
+    pass
+
+
+def run_job(agent, kind, payload) -> dict:
+    """Run one assessment job on an agent and return the parsed result."""
+    options = {"threshold": payload.get("threshold"), "mode": payload.get("mode")}
+    if kind == "url":
+        return json.loads(agent.check_article_url(payload["url"], **options))
+    return json.loads(agent.check_article(payload["article"], **options))
+
+
+_process_agent = None
+
+
+def init_process_worker():
+    global _process_agent
+    from observer import PRMonitorAgent
+    _process_agent = PRMonitorAgent()
+
+
+def run_process_job(kind, payload) -> dict:
+    return run_job(_process_agent, kind, payload)
+
+
+class JobManager:
+    """Bounded pool of assessment workers behind a job id API.
+
+    At most workers + queue_size jobs are accepted at once. Further
+    submissions raise QueueFull, so callers can shed load instead of
+    piling up threads. Thread workers call get_agent for the shared agent
+    when a job starts, so jobs can be accepted while it is still loading.
+    """
+
+    def __init__(self, get_agent=None, workers=JOB_WORKERS, worker_type=JOB_WORKER_TYPE, queue_size=JOB_QUEUE_SIZE, on_done=None):
+        if worker_type not in ("thread", "process"):
+            raise ValueError(f"Unknown job worker type {worker_type!r}, expected 'thread' or 'process'")
+        self.get_agent = get_agent
+        self.worker_type = worker_type
+        self.workers = workers
+        self.capacity = workers + queue_size
+        self.on_done = on_done
+        self._open()
+
+    def _open(self):
+        if self.worker_type == "process":
+            self.executor = ProcessPoolExecutor(
+                max_workers=self.workers,
+                mp_context=multiprocessing.get_context("spawn"),
+                initializer=init_process_worker,
+            )
+            self.handler = run_process_job
+        else:
+            self.executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="job")
+            self.handler = lambda kind, payload: run_job(self.get_agent(), kind, payload)
+        self.slots = threading.BoundedSemaphore(self.capacity)
+        self.jobs = OrderedDict()
+        self.futures = {}
+        self.lock = threading.Lock()
+
+    def after_fork(self):
+        """Start a forked child with its own empty pool; jobs queued in the parent stay with the parent."""
+        self._open()
+
+    def submit(self, kind, payload) -> dict:
+        """Queue an 'article' or 'url' job, raising QueueFull when at capacity."""
+        if not self.slots.acquire(blocking=False):
+            raise QueueFull(f"{self.capacity} jobs already pending")
+        job = {"id": uuid.uuid4().hex, "kind": kind, "status": "queued", "submitted_at": time.time()}
+        with self.lock:
+            self.jobs[job["id"]] = job
+            self._evict()
+        try:
+            future = self.executor.submit(self.handler, kind, payload)
+        except Exception:
+            self.slots.release()
+            with self.lock:
+                self.jobs.pop(job["id"], None)
+            raise
+        with self.lock:
+            self.futures[job["id"]] = future
+        future.add_done_callback(lambda future: self._finish(job, payload, future))
+        return dict(job)
+
+    def _finish(self, job, payload, future):
+        try:
+            result = future.result()
+            status = "failed" if "error" in result else "done"
+        except Exception as e:
+            logging.error(f"Job {job['id']} failed: {e}")
+            errors.inc(stage="job")
+            result, status = {"error": str(e)}, "failed"
+        with self.lock:
+            job.update(status=status, result=result, finished_at=time.time())
+            self.futures.pop(job["id"], None)
+        self.slots.release()
+        if self.on_done is not None and job["status"] == "done":
+            try:
+                self.on_done(job, payload)
+            except Exception as e:
+                logging.error(f"Job {job['id']} completion hook failed: {e}")
+
+    def _evict(self):
+        """Forget the oldest finished jobs beyond JOB_HISTORY."""
+        finished = [job_id for job_id, job in self.jobs.items() if "finished_at" in job]
+        for job_id in finished[:max(0, len(self.jobs) - JOB_HISTORY)]:
+            del self.jobs[job_id]
+
+    def get(self, job_id):
+        with self.lock:
+            job = self.jobs.get(job_id)
+            if job is None:
+                return None
+            future = self.futures.get(job_id)
+            if future is not None and future.running():
+                return {**job, "status": "running"}
+            return dict(job)
+
+    def depth(self) -> dict:
+        with self.lock:
+            pending = sum(1 for job in self.jobs.values() if "finished_at" not in job)
+        return {"pending": pending, "capacity": self.capacity, "workers": self.workers, "worker_type": self.worker_type}
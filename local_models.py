@@ -0,0 +1,158 @@
+import asyncio
+import json
+import re
+import time
+from typing import Any, Dict, List, Sequence
+
+from llama_index.core.base.embeddings.base import BaseEmbedding
+from llama_index.core.base.llms.types import (
+    ChatMessage,
+    ChatResponse,
+    ChatResponseGen,
+    CompletionResponse,
+    CompletionResponseGen,
+    LLMMetadata,
+    MessageRole,
+)
+from llama_index.core.bridge.pydantic import Field
+from llama_index.core.llms.callbacks import llm_chat_callback, llm_completion_callback
+from llama_index.core.llms.custom import CustomLLM
+
+from embeddings import hashing_vector
+
+DEFAULT_RISK_KEYWORDS = ["explod", "recall", "fire", "lawsuit", "breach", "outage", "scandal", "injur", "ban", "warning"]
+
+
+def approx_tokens(text):
+    return max(1, len(text) // 4)
+
+
+class StandInLLM(CustomLLM):
+    """Deterministic LLM that answers the prompts PRMonitorAgent sends, with configurable latency.
+
+    It plays every part the real model plays: direct-mode verdict JSON,
+    query engine synthesis over retrieved monitors, and a two-step ReAct
+    exchange (one user_monitors call, then a final answer). A verdict is
+    critical when the article mentions the monitor and any risk keyword.
+    Substrings in `responses` map to canned replies that override all of this.
+    """
+
+    latency: float = Field(default=0.2, description="Seconds per call.")
+    token_latency: float = Field(default=0.0, description="Extra seconds per completion token.")
+    responses: Dict[str, str] = Field(default_factory=dict)
+    risk_keywords: List[str] = Field(default_factory=lambda: list(DEFAULT_RISK_KEYWORDS))
+    context_window: int = 8192
+    model: str = Field(default="stand-in", description="Model name reported in metadata, e.g. to price its tokens.")
+
+    @property
+    def metadata(self) -> LLMMetadata:
+        return LLMMetadata(context_window=self.context_window, num_output=512, model_name=self.model, is_chat_model=True)
+
+    def verdict(self, monitor, article):
+        article = article.lower()
+        mentioned = any(word in article for word in monitor.lower().split())
+        risky = mentioned and any(keyword in article for keyword in self.risk_keywords)
+        reason = "Article reports a negative incident involving the monitor." if risky else "No negative impact found."
+        return {"monitor": monitor, "risk": "critical" if risky else "none", "reason": reason}
+
+    def respond(self, messages: Sequence[ChatMessage]) -> str:
+        prompt = "\n".join(message.content or "" for message in messages)
+        last = messages[-1].content or ""
+        for key, response in self.responses.items():
+            if key in prompt:
+                return response
+        article = prompt.split("Article: '", 1)[-1]
+        if "Our users have set up the following monitors" in last:
+            monitors = re.findall(r"^- (.+?) \(company: ", last, re.MULTILINE)
+            return json.dumps({"monitors": [self.verdict(monitor, article) for monitor in monitors]})
+        if "Context information is below" in prompt:
+            return "Relevant monitors: " + "; ".join(re.findall(r"Monitor: (.+)", prompt))
+        if last.startswith("Observation:"):
+            found = last.split("Relevant monitors:", 1)[-1]
+            monitors = [monitor.strip() for monitor in found.split(";") if monitor.strip()]
+            verdicts = [self.verdict(monitor, article) for monitor in monitors]
+            return f"Thought: I can answer without using any more tools.\nAnswer: {json.dumps(verdicts)}"
+        query = json.dumps({"input": f"Which monitors relate to: {article[:300]}"})
+        return f"Thought: I need to check the user monitors.\nAction: user_monitors\nAction Input: {query}"
+
+    def _response(self, messages):
+        text = self.respond(messages)
+        prompt_tokens = sum(approx_tokens(message.content or "") for message in messages)
+        completion_tokens = approx_tokens(text)
+        usage = {"prompt_tokens": prompt_tokens, "completion_tokens": completion_tokens, "total_tokens": prompt_tokens + completion_tokens}
+        return text, {"usage": usage}, self.latency + self.token_latency * completion_tokens
+
+    @llm_chat_callback()
+    def chat(self, messages: Sequence[ChatMessage], **kwargs: Any) -> ChatResponse:
+        text, raw, delay = self._response(messages)
+        time.sleep(delay)
+        return ChatResponse(message=ChatMessage(role=MessageRole.ASSISTANT, content=text), raw=raw)
+
+    @llm_chat_callback()
+    async def achat(self, messages: Sequence[ChatMessage], **kwargs: Any) -> ChatResponse:
+        text, raw, delay = self._response(messages)
+        await asyncio.sleep(delay)
+        return ChatResponse(message=ChatMessage(role=MessageRole.ASSISTANT, content=text), raw=raw)
+
+    @llm_chat_callback()
+    def stream_chat(self, messages: Sequence[ChatMessage], **kwargs: Any) -> ChatResponseGen:
+        text, raw, _ = self._response(messages)
+        chunks = re.findall(r"\S*\s*", text)
+
+        def gen():
+            time.sleep(self.latency)
+            content = ""
+            for chunk in chunks:
+                time.sleep(self.token_latency * approx_tokens(chunk))
+                content += chunk
+                yield ChatResponse(message=ChatMessage(role=MessageRole.ASSISTANT, content=content), delta=chunk, raw=raw)
+
+        return gen()
+
+    @llm_completion_callback()
+    def complete(self, prompt: str, formatted: bool = False, **kwargs: Any) -> CompletionResponse:
+        response = self.chat([ChatMessage(role=MessageRole.USER, content=prompt)])
+        return CompletionResponse(text=response.message.content, raw=response.raw)
+
+    @llm_completion_callback()
+    async def acomplete(self, prompt: str, formatted: bool = False, **kwargs: Any) -> CompletionResponse:
+        response = await self.achat([ChatMessage(role=MessageRole.USER, content=prompt)])
+        return CompletionResponse(text=response.message.content, raw=response.raw)
+
+    @llm_completion_callback()
+    def stream_complete(self, prompt: str, formatted: bool = False, **kwargs: Any) -> CompletionResponseGen:
+        def gen():
+            for response in self.stream_chat([ChatMessage(role=MessageRole.USER, content=prompt)]):
+                yield CompletionResponse(text=response.message.content, delta=response.delta, raw=response.raw)
+
+        return gen()
+
+
+class StandInEmbedding(BaseEmbedding):
+    """Hashing-vectorizer embedding with configurable per-call latency."""
+
+    dim: int = 256
+    latency: float = Field(default=0.0, description="Seconds per embedding call (a batch counts as one call).")
+
+    def __init__(self, **kwargs: Any):
+        super().__init__(model_name="stand-in-hashing", **kwargs)
+
+    def _get_query_embedding(self, query: str) -> List[float]:
+        time.sleep(self.latency)
+        return hashing_vector(query, self.dim)
+
+    def _get_text_embedding(self, text: str) -> List[float]:
+        time.sleep(self.latency)
+        return hashing_vector(text, self.dim)
+
+    def _get_text_embeddings(self, texts: List[str]) -> List[List[float]]:
+        time.sleep(self.latency)
+        return [hashing_vector(text, self.dim) for text in texts]
+
+    async def _aget_query_embedding(self, query: str) -> List[float]:
+        await asyncio.sleep(self.latency)
+        return hashing_vector(query, self.dim)
+
+    async def _aget_text_embedding(self, text: str) -> List[float]:
+        await asyncio.sleep(self.latency)
+        return hashing_vector(text, self.dim)
@@ -0,0 +1,143 @@
+import bisect
+import logging
+import threading
+from os import environ
+
+# "phoenix" exports LlamaIndex traces over OTLP with phoenix.otel; anything else disables tracing
+TRACING = environ.get("TRACING", "")
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120)
+TURN_BUCKETS = (1, 2, 3, 4, 5, 6, 8, 10)
+
+
+def format_labels(labels):
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{key}="{value}"' for key, value in labels) + "}"
+
+
+class Counter:
+    def __init__(self, name, help_text):
+        self.name = name
+        self.help_text = help_text
+        self.values = {}
+        self.lock = threading.Lock()
+
+    def inc(self, amount=1, **labels):
+        key = tuple(sorted(labels.items()))
+        with self.lock:
+            self.values[key] = self.values.get(key, 0) + amount
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} counter"]
+        with self.lock:
+            lines += [f"{self.name}{format_labels(key)} {value}" for key, value in sorted(self.values.items())]
+        return lines
+
+
+class Histogram:
+    def __init__(self, name, help_text, buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.help_text = help_text
+        self.buckets = buckets
+        self.series = {}
+        self.lock = threading.Lock()
+
+    def observe(self, value, **labels):
+        key = tuple(sorted(labels.items()))
+        index = bisect.bisect_left(self.buckets, value)
+        with self.lock:
+            counts, total = self.series.get(key, ([0] * (len(self.buckets) + 1), 0.0))
+            counts[index] += 1
+            self.series[key] = (counts, total + value)
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} histogram"]
+        with self.lock:
+            series = sorted((key, list(counts), total) for key, (counts, total) in self.series.items())
+        for key, counts, total in series:
+            cumulative = 0
+            for bound, count in zip([*self.buckets, "+Inf"], counts):
+                cumulative += count
+                lines.append(f"{self.name}_bucket{format_labels(key + (('le', bound),))} {cumulative}")
+            lines.append(f"{self.name}_sum{format_labels(key)} {total}")
+            lines.append(f"{self.name}_count{format_labels(key)} {cumulative}")
+        return lines
+
+
+class Collected:
+    """Metric whose samples are read from a callback at scrape time, e.g. a queue depth."""
+
+    def __init__(self, name, help_text, kind, collect):
+        self.name = name
+        self.help_text = help_text
+        self.kind = kind
+        self.collect = collect
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} {self.kind}"]
+        try:
+            samples = self.collect()
+        except Exception as e:
+            logging.warning(f"Collecting {self.name} failed: {e}")
+            return lines
+        return lines + [f"{self.name}{format_labels(tuple(sorted(labels.items())))} {value}" for labels, value in samples]
+
+
+stage_latency = Histogram("monitor_stage_latency_seconds", "Latency of each pipeline stage.")
+llm_turn_latency = Histogram("monitor_llm_turn_latency_seconds", "Latency of each individual LLM call.")
+agent_turns = Histogram("monitor_agent_turns", "LLM turns used per assessment.", buckets=TURN_BUCKETS)
+llm_tokens = Counter("monitor_llm_tokens_total", "LLM tokens used, by kind.")
+assessments = Counter("monitor_assessments_total", "Assessments run, by mode and outcome.")
+errors = Counter("monitor_errors_total", "Errors, by pipeline stage.")
+tier_latency = Histogram("monitor_tier_latency_seconds", "LLM time per assessment at each cascade tier.")
+tier_cost = Counter("monitor_llm_cost_usd_total", "Estimated LLM spend, by cascade tier.")
+triage = Counter("monitor_triage_total", "Triage decisions, by outcome.")
+registry = [stage_latency, llm_turn_latency, agent_turns, llm_tokens, assessments, errors, tier_latency, tier_cost, triage]
+
+
+def register_collector(name, help_text, kind, collect):
+    """Add a metric read at scrape time; collect returns [(labels dict, value), ...]."""
+    registry.append(Collected(name, help_text, kind, collect))
+
+
+def render():
+    """All metrics in the Prometheus text exposition format."""
+    return "\n".join(line for metric in registry for line in metric.render()) + "\n"
+
+
+def observe_assessment(result):
+    """Record the stage timings, turns and tokens of a finished assessment."""
+    for stage, value in result.get("timings", {}).items():
+        stage_latency.observe(value / 1000, stage=stage.removesuffix("_ms"))
+    usage = result.get("usage")
+    outcome = "gated" if usage is None else "assessed"
+    assessments.inc(mode=result.get("mode", "unknown"), outcome=outcome)
+    if usage:
+        agent_turns.observe(usage.get("turns", 0), mode=result.get("mode", "unknown"))
+    cascade = result.get("cascade") or {"tiers": {"full": {"usage": usage}} if usage else {}}
+    for tier, record in cascade["tiers"].items():
+        llm_tokens.inc(record["usage"].get("prompt_tokens", 0), kind="prompt", tier=tier)
+        llm_tokens.inc(record["usage"].get("completion_tokens", 0), kind="completion", tier=tier)
+        if "latency_ms" in record:
+            tier_latency.observe(record["latency_ms"] / 1000, tier=tier)
+            tier_cost.inc(record["cost_usd"], tier=tier)
+    if cascade.get("escalated") is not None:
+        triage.inc(outcome="escalated" if cascade["escalated"] else "resolved")
+
+
+def setup_tracing(mode=TRACING):
+    """Export LlamaIndex traces when enabled by config; returns whether tracing is on.
+
+    Spans go through a batch processor so tracing stays cheap under load;
+    use the standard OTEL_TRACES_SAMPLER / OTEL_TRACES_SAMPLER_ARG variables
+    to sample a fraction of requests.
+    """
+    if mode != "phoenix":
+        return False
+    from openinference.instrumentation.llama_index import LlamaIndexInstrumentor
+    from phoenix.otel import register
+
+    tracer_provider = register(batch=True)
+    LlamaIndexInstrumentor().instrument(tracer_provider=tracer_provider)
+    logging.info("LlamaIndex tracing enabled")
+    return True
@@ -0,0 +1,519 @@
+import csv
+import fcntl
+import hashlib
+import json
+import logging
+import os
+import tempfile
+import threading
+from contextlib import contextmanager
+
+import numpy as np
+from llama_index.core import (
+    Settings,
+    StorageContext,
+    VectorStoreIndex,
+    load_index_from_storage,
+)
+from llama_index.core.data_structs import IndexDict
+from llama_index.core.schema import MetadataMode, NodeRelationship, RelatedNodeInfo, TextNode
+from llama_index.core.storage.docstore import SimpleDocumentStore
+from llama_index.core.vector_stores import SimpleVectorStore
+from llama_index.core.vector_stores.simple import SimpleVectorStoreData
+
+from relevance import MatrixSearch, normalize_rows
+
+MONITORS_CSV = os.environ.get("MONITORS_CSV", "monitors/monitors.csv")
+MONITOR_INDEX_DIR = os.environ.get("MONITOR_INDEX_DIR", "monitor_data")
+# "simple" keeps monitors in LlamaIndex's in-memory vector store; "ivf" uses the
+# memory-mapped ANN store in monitor_store.py, for catalogs of many thousands of monitors
+MONITOR_STORE = os.environ.get("MONITOR_STORE", "simple")
+IVF_DIR = "ivf"
+# Rows embedded per call when filling the ivf store
+SYNC_BATCH = 4096
+HASHES_FILE = "monitor_hashes.json"
+# Unit-normalized monitor embeddings, memory-mapped so worker processes share the pages,
+# and the rows file naming the matrix of each monitor set version
+VECTORS_FILE = "monitor_vectors-{version}.npy"
+ROWS_FILE = "monitor_rows.json"
+LOCK_FILE = ".lock"
+# Monotonic monitor-set version, bumped by every sync or update that changes a row
+VERSION_FILE = "monitor_version.json"
+# Changes appended since the index was last written in full; loading replays them on top of it
+JOURNAL_FILE = "monitor_journal.jsonl"
+# Journaled rows after which the index is rewritten in the background, and the largest change journaled
+MONITOR_JOURNAL_MAX = int(os.environ.get("MONITOR_JOURNAL_MAX", "500"))
+# Seconds between checks of monitors.csv for edits; 0 disables watching
+MONITOR_WATCH_INTERVAL = float(os.environ.get("MONITOR_WATCH_INTERVAL", "2"))
+
+
+def read_monitors(path=MONITORS_CSV):
+    """Read monitors.csv into a list of {'monitor', 'company'} rows."""
+    rows = []
+    with open(path, newline="") as file:
+        for row in csv.DictReader(file, skipinitialspace=True):
+            row = {(key or "").strip(): (value or "").strip() for key, value in row.items()}
+            if row.get("monitor"):
+                rows.append({"monitor": row["monitor"], "company": row.get("company", "")})
+    return rows
+
+
+def write_monitors(rows, path=MONITORS_CSV):
+    """Atomically replace monitors.csv with rows."""
+    directory = os.path.dirname(path) or "."
+    with tempfile.NamedTemporaryFile("w", newline="", dir=directory, suffix=".tmp", delete=False) as file:
+        writer = csv.DictWriter(file, fieldnames=["monitor", "company"])
+        writer.writeheader()
+        writer.writerows({"monitor": row["monitor"], "company": row["company"]} for row in rows)
+    os.replace(file.name, path)
+
+
+def monitor_id(monitor):
+    """Stable ref doc id for a monitor row, keyed by its name."""
+    return "monitor:" + monitor.strip().lower()
+
+
+def row_hash(row, embed_model_name=""):
+    """Content hash of a monitors.csv row, and of the model that embeds it when given."""
+    fields = {"monitor": row["monitor"], "company": row["company"]}
+    if embed_model_name:
+        fields["embed_model"] = embed_model_name
+    payload = json.dumps(fields, sort_keys=True)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+def monitor_node(row, embedding=None):
+    """Build the index node for a single monitors.csv row."""
+    ref_id = monitor_id(row["monitor"])
+    return TextNode(
+        id_=f"{ref_id}#{row_hash(row)[:16]}",
+        text=f"Monitor: {row['monitor']}\nCompany: {row['company']}",
+        metadata={"monitor": row["monitor"], "company": row["company"]},
+        excluded_embed_metadata_keys=["monitor", "company"],
+        excluded_llm_metadata_keys=["monitor", "company"],
+        relationships={NodeRelationship.SOURCE: RelatedNodeInfo(node_id=ref_id)},
+        embedding=embedding,
+    )
+
+
+def monitor_set_digest(hashes):
+    """Order-independent digest of the row hashes, so one change updates it without rehashing every row."""
+    digest = 0
+    for value in hashes.values():
+        digest ^= int(value, 16)
+    return digest
+
+
+class MonitorIndex:
+    """Monitor vector index persisted to disk and synced with monitors.csv row by row.
+
+    Each row is stored as its own ref doc together with a content hash, so a
+    restart only embeds rows that were added or changed since the last sync.
+    Writes hold a thread lock and a file lock on the persist directory, so
+    when several worker processes start together one of them embeds and the
+    rest load its result. Readers never use the index being written: they
+    take a snapshot(), which later writes do not change.
+
+    Small changes to the simple store are appended to a journal instead of
+    rewriting the whole index, and snapshots share the unchanged nodes and
+    gate vectors with the previous one, so an edit neither rewrites nor
+    copies every monitor.
+    """
+
+    def __init__(self, csv_path=MONITORS_CSV, persist_dir=MONITOR_INDEX_DIR, embed_model=None, store=MONITOR_STORE):
+        if store not in ("simple", "ivf"):
+            raise ValueError(f"Unknown monitor store {store!r}, expected 'simple' or 'ivf'")
+        self.csv_path = csv_path
+        self.persist_dir = persist_dir
+        self.embed_model_override = embed_model
+        self.store_type = store
+        self.store = None
+        self.hashes = {}
+        self.digest = 0
+        self.version = 0
+        self.journal_rows = 0
+        self.compactor = None
+        self.write_lock = threading.RLock()
+        self.index = self._load()
+
+    def after_fork(self):
+        """Fresh locks and database handles in a forked child, which keeps the loaded index and shares its vectors."""
+        self.write_lock = threading.RLock()
+        self.compactor = None
+        if self.store is not None:
+            self.store.after_fork()
+
+    def _load(self):
+        self.version = self._disk_version()
+        # (node ids, rows, matrix) behind the last gate search, and the last snapshot
+        self.matrix_cache = ([], [], np.zeros((0, 0), dtype=np.float32))
+        self.last_snapshot = None
+        index = self._load_index()
+        self.digest = monitor_set_digest(self.hashes)
+        return index
+
+    @property
+    def content_hash(self):
+        """Digest of every monitor row and the model that embedded it."""
+        return f"{self.digest:064x}"[:16]
+
+    def _load_index(self):
+        if self.store_type == "ivf":
+            from monitor_store import IVFStore, MonitorVectorStore
+
+            self.store = IVFStore(self._path(IVF_DIR))
+            self.hashes = self.store.hashes()
+            logging.info(f"Opened IVF monitor store in {self.store.path} ({len(self.hashes)} monitors)")
+            return VectorStoreIndex.from_vector_store(MonitorVectorStore(self.store), embed_model=self.embed_model_override)
+        hashes_path = self._path(HASHES_FILE)
+        if os.path.exists(hashes_path):
+            try:
+                storage_context = StorageContext.from_defaults(persist_dir=self.persist_dir)
+                index = load_index_from_storage(storage_context, embed_model=self.embed_model_override)
+                with open(hashes_path) as file:
+                    self.hashes = json.load(file)
+                self._replay(index)
+                logging.info(f"Loaded monitor index from {self.persist_dir} ({len(self.hashes)} monitors)")
+                return index
+            except Exception as e:
+                logging.warning(f"Could not load monitor index from {self.persist_dir}, rebuilding: {e}")
+        self.hashes = {}
+        index = VectorStoreIndex(nodes=[], embed_model=self.embed_model_override)
+        self._replay(index)
+        return index
+
+    def _replay(self, index):
+        """Apply the journaled changes to a freshly loaded index."""
+        self.journal_rows = 0
+        try:
+            file = open(self._path(JOURNAL_FILE))
+        except FileNotFoundError:
+            return
+        with file:
+            for line in file:
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    # A torn last write: rows after it are re-applied from monitors.csv by the next sync,
+                    # and the next change rewrites the index so nothing is appended after the damage
+                    logging.warning(f"Ignoring a damaged entry in {self._path(JOURNAL_FILE)}")
+                    self.journal_rows = MONITOR_JOURNAL_MAX
+                    return
+                upserts = entry["upserts"]
+                for ref_id in entry["removals"] + [upsert["ref_id"] for upsert in upserts]:
+                    if index.docstore.get_ref_doc_info(ref_id) is not None:
+                        index.delete_ref_doc(ref_id, delete_from_docstore=True)
+                    self.hashes.pop(ref_id, None)
+                index.insert_nodes([monitor_node(upsert["row"], upsert["embedding"]) for upsert in upserts])
+                self.hashes.update((upsert["ref_id"], upsert["hash"]) for upsert in upserts)
+                self.journal_rows += len(entry["removals"]) + len(upserts)
+
+    @property
+    def embed_model(self):
+        return self.embed_model_override or Settings.embed_model
+
+    def _path(self, name):
+        return os.path.join(self.persist_dir, name)
+
+    def _disk_version(self):
+        try:
+            with open(self._path(VERSION_FILE)) as file:
+                return int(json.load(file)["version"])
+        except (OSError, ValueError, KeyError):
+            return 0
+
+    def _store_vectors(self):
+        """Monitor rows and unit-normalized embeddings read from the vector store.
+
+        Rows of nodes that are still indexed are reused from the previous call, so only changed monitors are read.
+        """
+        embeddings = self.index.vector_store.data.embedding_dict
+        node_ids, rows, matrix = self.matrix_cache
+        kept = [i for i, node_id in enumerate(node_ids) if node_id in embeddings]
+        known = set(node_ids)
+        added = [node_id for node_id in embeddings if node_id not in known]
+        if len(kept) == len(node_ids) and not added:
+            return rows, matrix
+        new_rows = [
+            {"monitor": node.metadata["monitor"], "company": node.metadata["company"]}
+            for node in self.index.docstore.get_nodes(added)
+        ]
+        new = normalize_rows(np.array([embeddings[node_id] for node_id in added], dtype=np.float32)) if added else None
+        if kept and added:
+            matrix = np.concatenate([matrix[kept], new])
+        elif added:
+            matrix = new
+        else:
+            matrix = matrix[kept] if kept else np.zeros((0, 0), dtype=np.float32)
+        rows = [rows[i] for i in kept] + new_rows
+        self.matrix_cache = ([node_ids[i] for i in kept] + added, rows, matrix)
+        return rows, matrix
+
+    def vectors(self):
+        """Return the indexed monitor rows and their unit-normalized embeddings as a float32 matrix.
+
+        The persisted matrix is memory-mapped read-only when it is present.
+        """
+        try:
+            with open(self._path(ROWS_FILE)) as file:
+                saved = json.load(file)
+            if saved["version"] == self.version:
+                matrix = np.load(self._path(saved["vectors"]), mmap_mode="r")
+                if "node_ids" in saved:
+                    self.matrix_cache = (saved["node_ids"], saved["rows"], matrix)
+                return saved["rows"], matrix
+        except (OSError, ValueError, KeyError):
+            pass
+        return self._store_vectors()
+
+    def searcher(self):
+        """Nearest-monitor search for the relevance gate: the IVF store, or exact search over vectors()."""
+        if self.store is not None:
+            return self.store
+        rows, matrix = self.vectors()
+        return MatrixSearch(rows, matrix, normalized=True)
+
+    def snapshot(self):
+        """Return (version, content hash, index, search) for readers, unaffected by later syncs and updates.
+
+        The IVF store is shared: each search reads one published generation of
+        it and returns rowids that stay valid when it is retrained. The simple
+        store is copied into a new in-memory index.
+        """
+        with self.write_lock:
+            if self.last_snapshot is not None and self.last_snapshot[0] == self.version:
+                return self.last_snapshot
+            if self.store is not None:
+                from monitor_store import MonitorVectorStore
+
+                index = VectorStoreIndex.from_vector_store(MonitorVectorStore(self.store), embed_model=self.embed_model_override)
+            else:
+                index = self._copy_index()
+            self.last_snapshot = (self.version, self.content_hash, index, self.searcher())
+            return self.last_snapshot
+
+    def _copy_index(self):
+        """A new in-memory index over the same nodes and embeddings.
+
+        The stores' dicts are copied rather than the nodes in them: writes replace
+        or remove entries and never change one in place, except the node id lists
+        of ref docs, which are copied too.
+        """
+        data = self.index.vector_store.data
+        vector_store = SimpleVectorStore(data=SimpleVectorStoreData(
+            embedding_dict=dict(data.embedding_dict),
+            text_id_to_ref_doc_id=dict(data.text_id_to_ref_doc_id),
+            metadata_dict=dict(data.metadata_dict),
+        ))
+        docstore = SimpleDocumentStore.from_dict({
+            collection: {
+                key: {field: list(value) if isinstance(value, list) else value for field, value in entry.items()}
+                for key, entry in entries.items()
+            } if collection.endswith("ref_doc_info") else dict(entries)
+            for collection, entries in self.index.docstore.to_dict().items()
+        })
+        index_struct = IndexDict(index_id=self.index.index_struct.index_id, nodes_dict=dict(self.index.index_struct.nodes_dict))
+        return VectorStoreIndex(
+            index_struct=index_struct,
+            storage_context=StorageContext.from_defaults(docstore=docstore, vector_store=vector_store),
+            embed_model=self.embed_model_override,
+        )
+
+    @contextmanager
+    def _locked(self):
+        """Hold the write locks, first reloading the index if another process changed it."""
+        os.makedirs(self.persist_dir, exist_ok=True)
+        with self.write_lock, open(self._path(LOCK_FILE), "w") as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            if self._disk_version() != self.version or self.store is not None and self.store.is_stale():
+                # Another process changed the monitors while this one was loading or waiting for the lock
+                self.index = self._load()
+            yield
+
+    def rows(self):
+        return read_monitors(self.csv_path)
+
+    def sync(self):
+        """Apply monitors.csv to the index, embedding only added or changed rows."""
+        with self._locked():
+            return self._apply({monitor_id(row["monitor"]): row for row in read_monitors(self.csv_path)})
+
+    def update(self, upserts=(), removals=()):
+        """Create, change or delete monitors by name, then apply just those rows to the index.
+
+        monitors.csv is rewritten so it stays the source of truth. Raises
+        KeyError for removals that do not exist.
+        """
+        with self._locked():
+            rows = {monitor_id(row["monitor"]): row for row in read_monitors(self.csv_path)}
+            changed = set()
+            for name in removals:
+                ref_id = monitor_id(name)
+                if ref_id not in rows:
+                    raise KeyError(name)
+                del rows[ref_id]
+                changed.add(ref_id)
+            for row in upserts:
+                ref_id = monitor_id(row["monitor"])
+                rows[ref_id] = {"monitor": row["monitor"].strip(), "company": (row.get("company") or "").strip()}
+                changed.add(ref_id)
+            write_monitors(rows.values(), self.csv_path)
+            return self._apply(rows, only=changed)
+
+    def _apply(self, rows, only=None):
+        """Bring the index in line with rows, looking only at the ids in only when given."""
+        model = self.embed_model.model_name
+        hashes = dict(self.hashes)
+        # Switching embedding models changes every hash, so all rows are re-embedded
+        for ref_id in (set(rows) | set(self.hashes)) if only is None else only:
+            if ref_id in rows:
+                hashes[ref_id] = row_hash(rows[ref_id], model)
+            else:
+                hashes.pop(ref_id, None)
+        ids = hashes.keys() | self.hashes.keys() if only is None else only
+        stale = [ref_id for ref_id in ids if ref_id in self.hashes and hashes.get(ref_id) != self.hashes[ref_id]]
+        fresh = [ref_id for ref_id in ids if ref_id in hashes and self.hashes.get(ref_id) != hashes[ref_id]]
+
+        entry = None
+        if self.store is not None:
+            self._apply_to_store(rows, hashes, stale, fresh)
+        else:
+            # Fresh ids are cleared too, in case an interrupted persist left them behind.
+            for ref_id in set(stale) | set(fresh):
+                if self.index.docstore.get_ref_doc_info(ref_id) is not None:
+                    self.index.delete_ref_doc(ref_id, delete_from_docstore=True)
+            nodes = [monitor_node(rows[ref_id]) for ref_id in fresh]
+            if nodes:
+                self.index.insert_nodes(nodes)
+            if len(stale) + len(fresh) <= MONITOR_JOURNAL_MAX:
+                embeddings = self.index.vector_store.data.embedding_dict
+                entry = {
+                    "version": self.version + 1,
+                    "removals": [ref_id for ref_id in stale if ref_id not in fresh],
+                    "upserts": [
+                        {"ref_id": ref_id, "row": rows[ref_id], "hash": hashes[ref_id], "embedding": embeddings[node.node_id]}
+                        for ref_id, node in zip(fresh, nodes)
+                    ],
+                }
+        for ref_id in set(stale) | set(fresh):
+            self.digest ^= int(self.hashes.get(ref_id, "0"), 16) ^ int(hashes.get(ref_id, "0"), 16)
+        self.hashes = hashes
+
+        changes = {
+            "added": len([ref_id for ref_id in fresh if ref_id not in stale]),
+            "updated": len([ref_id for ref_id in fresh if ref_id in stale]),
+            "removed": len([ref_id for ref_id in stale if ref_id not in hashes]),
+        }
+        if stale or fresh:
+            self.version += 1
+            self.persist(entry)
+        logging.info(f"Applied {self.csv_path} to the monitor index: {changes}, version {self.version}")
+        return {**changes, "version": self.version}
+
+    def _apply_to_store(self, rows, hashes, stale, fresh):
+        self.store.delete(set(stale) - set(fresh))
+        for i in range(0, len(fresh), SYNC_BATCH):
+            batch = fresh[i:i + SYNC_BATCH]
+            nodes = [monitor_node(rows[ref_id]) for ref_id in batch]
+            embeddings = self.embed_model.get_text_embedding_batch(
+                [node.get_content(metadata_mode=MetadataMode.EMBED) for node in nodes]
+            )
+            self.store.add([
+                {**rows[ref_id], "ref_id": ref_id, "node_id": node.node_id, "row_hash": hashes[ref_id], "embedding": embedding}
+                for ref_id, node, embedding in zip(batch, nodes, embeddings)
+            ])
+        self.store.maybe_train()
+
+    def persist(self, entry=None):
+        """Write the index, the row hashes and then the version to the persist directory.
+
+        A journal entry is appended instead of rewriting the simple store, which
+        is compacted in the background once the journal holds MONITOR_JOURNAL_MAX rows.
+        """
+        if self.store is not None:
+            # Row hashes live in the store's SQLite table
+            self.store.persist()
+        elif entry is not None and self.journal_rows < MONITOR_JOURNAL_MAX:
+            with open(self._path(JOURNAL_FILE), "a") as file:
+                file.write(json.dumps(entry) + "\n")
+            self.journal_rows += len(entry["removals"]) + len(entry["upserts"])
+            if self.journal_rows >= MONITOR_JOURNAL_MAX and (self.compactor is None or not self.compactor.is_alive()):
+                self.compactor = threading.Thread(target=self.compact, name="monitor-compactor", daemon=True)
+                self.compactor.start()
+        else:
+            self.index.storage_context.persist(persist_dir=self.persist_dir)
+            rows, matrix = self._store_vectors()
+            vectors_file = VECTORS_FILE.format(version=self.version)
+            np.save(self._path(vectors_file), matrix)
+            with open(self._path(ROWS_FILE + ".tmp"), "w") as file:
+                json.dump({"version": self.version, "vectors": vectors_file, "rows": rows, "node_ids": self.matrix_cache[0]}, file)
+            os.replace(self._path(ROWS_FILE + ".tmp"), self._path(ROWS_FILE))
+            for name in os.listdir(self.persist_dir):
+                if name.startswith("monitor_vectors-") and name != vectors_file:
+                    os.remove(self._path(name))
+            # Hashes are written after the index, so after an interrupted persist they
+            # under-report what the index holds and the next sync re-applies those rows.
+            with open(self._path(HASHES_FILE), "w") as file:
+                json.dump(self.hashes, file)
+            # Replaying entries the index already holds is harmless, so the journal goes last
+            if os.path.exists(self._path(JOURNAL_FILE)):
+                os.remove(self._path(JOURNAL_FILE))
+            self.journal_rows = 0
+        with open(self._path(VERSION_FILE + ".tmp"), "w") as file:
+            json.dump({"version": self.version}, file)
+        os.replace(self._path(VERSION_FILE + ".tmp"), self._path(VERSION_FILE))
+
+
+    def compact(self):
+        """Rewrite the simple store in full and empty the journal."""
+        with self._locked():
+            if self.store is None and self.journal_rows:
+                self.persist()
+                logging.info(f"Compacted the monitor index journal at version {self.version}")
+
+
+class MonitorWatcher:
+    """Polls monitors.csv and calls on_change whenever its modification time or size changes."""
+
+    def __init__(self, path, on_change, interval=MONITOR_WATCH_INTERVAL):
+        self.path = path
+        self.on_change = on_change
+        self.interval = interval
+        self.last = self._stat()
+        self.stopped = threading.Event()
+        self.thread = threading.Thread(target=self._run, name="monitor-watcher", daemon=True)
+
+    def _stat(self):
+        try:
+            stat = os.stat(self.path)
+            return stat.st_mtime_ns, stat.st_size
+        except OSError:
+            return None
+
+    def mark_seen(self):
+        """Skip the current state of the file, e.g. after writing it ourselves."""
+        self.last = self._stat()
+
+    def start(self):
+        self.thread.start()
+        return self
+
+    def after_fork(self):
+        """Watch from a forked child too; the parent's thread did not survive the fork."""
+        self.stopped = threading.Event()
+        self.thread = threading.Thread(target=self._run, name="monitor-watcher", daemon=True)
+        return self.start()
+
+    def stop(self):
+        self.stopped.set()
+
+    def _run(self):
+        while not self.stopped.wait(self.interval):
+            current = self._stat()
+            if current is None or current == self.last:
+                continue
+            self.last = current
+            try:
+                self.on_change()
+            except Exception as e:
+                logging.error(f"Reloading {self.path} failed: {e}")
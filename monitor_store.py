@@ -0,0 +1,437 @@
+import json
+import logging
+import math
+import os
+import sqlite3
+import threading
+from collections import namedtuple
+from os import environ
+from typing import Any, List
+
+import numpy as np
+from llama_index.core.bridge.pydantic import PrivateAttr
+from llama_index.core.schema import BaseNode
+from llama_index.core.vector_stores.types import (
+    BasePydanticVectorStore,
+    FilterOperator,
+    VectorStoreQuery,
+    VectorStoreQueryResult,
+)
+
+from monitor_index import monitor_node
+from relevance import normalize_rows
+
+# Inverted lists built by train(); 0 picks sqrt(monitors)
+ANN_NLIST = int(environ.get("ANN_NLIST", "0"))
+# Lists scanned per query; higher trades latency for recall
+ANN_NPROBE = int(environ.get("ANN_NPROBE", "8"))
+# Stores with fewer monitors than this are searched exactly and not trained
+ANN_MIN_TRAIN = int(environ.get("ANN_MIN_TRAIN", "10000"))
+# Company-filtered queries scan those companies' monitors exactly when they have at most this many
+ANN_FILTER_EXACT = int(environ.get("ANN_FILTER_EXACT", "10000"))
+ANN_TRAIN_SAMPLE = 65536
+CHUNK = 65536
+META_FILE = "meta.json"
+# ids maps each slot to its row's SQLite rowid, which stays the same when train() moves the slot (the store is never VACUUMed)
+ARRAYS = {"vectors": np.float32, "alive": np.uint8, "company": np.int32, "lists": np.int32, "ids": np.int64}
+
+# Everything a search reads, published as one unit so a search never mixes two layouts
+Generation = namedtuple("Generation", ["count", "trained", "centroids", "offsets", *ARRAYS])
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS monitors (
+    ref_id TEXT PRIMARY KEY,
+    slot INTEGER NOT NULL UNIQUE,
+    node_id TEXT,
+    monitor TEXT,
+    company TEXT,
+    row_hash TEXT
+);
+CREATE INDEX IF NOT EXISTS monitors_monitor ON monitors(lower(monitor));
+CREATE INDEX IF NOT EXISTS monitors_company ON monitors(lower(company));
+CREATE TABLE IF NOT EXISTS companies (name TEXT PRIMARY KEY, code INTEGER NOT NULL);
+"""
+
+
+def top_k(slots, scores, k):
+    """The k best (slot, score) pairs, best first."""
+    if len(scores) > k:
+        best = np.argpartition(-scores, k - 1)[:k]
+        slots, scores = slots[best], scores[best]
+    order = np.argsort(-scores, kind="stable")
+    return slots[order], scores[order]
+
+
+def nearest(vectors, centroids):
+    """Index of the closest centroid for each row, in chunks to bound memory."""
+    return np.concatenate([
+        np.argmax(vectors[i:i + CHUNK] @ centroids.T, axis=1) for i in range(0, len(vectors), CHUNK)
+    ]).astype(np.int32) if len(vectors) else np.zeros(0, dtype=np.int32)
+
+
+class IVFStore:
+    """Monitor vectors in memory-mapped float32 files behind an inverted-file (IVF) index.
+
+    Each monitor owns a slot in vectors.f32 and a row in SQLite holding its
+    name, company and content hash. train() clusters the live vectors and
+    rewrites the files so that every inverted list is one contiguous slice.
+    Later adds are appended and assigned to their nearest list; deletes clear
+    the slot's alive flag until the next train(). Queries probe the ANN_NPROBE
+    closest lists, so only those slices are read.
+
+    Writers serialize on a lock and publish a new Generation after each
+    change. A search reads the generation current when it starts and returns
+    SQLite rowids rather than slots, so rows(), get_vectors() and find() work
+    on the same ids even if train() renumbers the slots in between.
+    """
+
+    def __init__(self, path, dim=None):
+        self.path = path
+        os.makedirs(path, exist_ok=True)
+        self.lock = threading.RLock()
+        self.db_lock = threading.Lock()
+        self.db = sqlite3.connect(os.path.join(path, "monitors.db"), check_same_thread=False)
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.executescript(SCHEMA)
+        meta = self._read_meta()
+        self.dim = meta.get("dim") or dim
+        self.count = meta.get("count", 0)
+        self.capacity = meta.get("capacity", 0)
+        self.trained = meta.get("trained", 0)
+        self.centroids, self.offsets = None, None
+        if self.trained:
+            self.centroids = np.load(self._file("centroids.npy"))
+            self.offsets = np.load(self._file("offsets.npy"))
+        self._open_arrays()
+        self.companies = dict(self._query("SELECT name, code FROM companies"))
+        self._recover()
+        # Rowids are assigned here rather than by SQLite, which reuses the largest one after it is deleted
+        self.next_id = (self._query("SELECT max(rowid) FROM monitors")[0][0] or 0) + 1
+        self._publish()
+
+    def after_fork(self):
+        """Fresh locks and SQLite connection in a forked child; the memory-mapped arrays stay shared."""
+        self.lock = threading.RLock()
+        self.db_lock = threading.Lock()
+        self.db = sqlite3.connect(os.path.join(self.path, "monitors.db"), check_same_thread=False)
+
+    def _file(self, name):
+        return os.path.join(self.path, name)
+
+    def _query(self, sql, params=()):
+        with self.db_lock:
+            return self.db.execute(sql, params).fetchall()
+
+    def _read_meta(self):
+        try:
+            with open(self._file(META_FILE)) as file:
+                return json.load(file)
+        except (OSError, ValueError):
+            return {}
+
+    def _open_arrays(self, suffix=""):
+        for name, dtype in ARRAYS.items():
+            shape = (self.capacity, self.dim or 0) if name == "vectors" else (self.capacity,)
+            path = self._file(name + suffix)
+            size = int(np.prod(shape)) * np.dtype(dtype).itemsize
+            with open(path, "ab") as file:
+                if file.tell() < size:
+                    file.truncate(size)
+            array = np.memmap(path, dtype=dtype, mode="r+", shape=shape) if size else np.zeros(shape, dtype=dtype)
+            setattr(self, name, array)
+
+    def _recover(self):
+        """Drop rows whose vectors were never persisted and rebuild the alive flags and rowids from SQLite."""
+        with self.db_lock, self.db:
+            self.db.execute("DELETE FROM monitors WHERE slot >= ?", (self.count,))
+            found = np.array(self.db.execute("SELECT slot, rowid FROM monitors").fetchall(), dtype=np.int64).reshape(-1, 2)
+        self.alive[:self.count] = 0
+        self.alive[found[:, 0]] = 1
+        self.ids[found[:, 0]] = found[:, 1]
+
+    def _publish(self):
+        """Make the current arrays and counts visible to searches; called by writers holding the locks."""
+        self.generation = Generation(self.count, self.trained, self.centroids, self.offsets,
+                                     *(getattr(self, name) for name in ARRAYS))
+
+    def __len__(self):
+        return int(self.alive[:self.count].sum())
+
+    def is_stale(self):
+        """Whether another process persisted changes since this store was opened."""
+        meta = self._read_meta()
+        return (meta.get("count", 0), meta.get("trained", 0)) != (self.count, self.trained)
+
+    def hashes(self) -> dict:
+        return dict(self._query("SELECT ref_id, row_hash FROM monitors"))
+
+    def _company_code(self, company):
+        key = company.strip().lower()
+        if key not in self.companies:
+            code = len(self.companies)
+            with self.db_lock, self.db:
+                self.db.execute("INSERT INTO companies VALUES (?, ?)", (key, code))
+            self.companies[key] = code
+        return self.companies[key]
+
+    def _grow(self, needed):
+        if needed <= self.capacity:
+            return
+        self.capacity = max(1024, self.capacity * 2, needed)
+        self._open_arrays()
+
+    def add(self, items):
+        """Add monitors given as dicts with ref_id, node_id, monitor, company, row_hash and embedding.
+
+        Existing rows with the same ref_id are replaced.
+        """
+        if not items:
+            return
+        with self.lock:
+            self.delete([item["ref_id"] for item in items])
+            matrix = normalize_rows(np.asarray([item["embedding"] for item in items], dtype=np.float32))
+            if self.dim is None:
+                self.dim = matrix.shape[1]
+            if matrix.shape[1] != self.dim:
+                raise ValueError(f"Embedding dimension {matrix.shape[1]} does not match the store's {self.dim}")
+            start, end = self.count, self.count + len(items)
+            self._grow(end)
+            self.vectors[start:end] = matrix
+            self.company[start:end] = [self._company_code(item["company"]) for item in items]
+            self.lists[start:end] = nearest(matrix, self.centroids) if self.centroids is not None else -1
+            self.alive[start:end] = 1
+            with self.db_lock, self.db:
+                rowids = range(self.next_id, self.next_id + len(items))
+                self.db.executemany(
+                    "INSERT INTO monitors (rowid, ref_id, slot, node_id, monitor, company, row_hash) VALUES (?, ?, ?, ?, ?, ?, ?)",
+                    [(rowid, item["ref_id"], slot, item["node_id"], item["monitor"], item["company"], item["row_hash"])
+                     for rowid, slot, item in zip(rowids, range(start, end), items)],
+                )
+                self.ids[start:end] = rowids
+                self.next_id += len(items)
+                self.count = end
+                self._publish()
+
+    def delete(self, ref_ids):
+        ref_ids = list(ref_ids)
+        if not ref_ids:
+            return
+        with self.lock:
+            slots = []
+            with self.db_lock, self.db:
+                for i in range(0, len(ref_ids), 500):
+                    batch = ref_ids[i:i + 500]
+                    placeholders = ",".join("?" * len(batch))
+                    slots += [row[0] for row in self.db.execute(f"SELECT slot FROM monitors WHERE ref_id IN ({placeholders})", batch)]
+                    self.db.execute(f"DELETE FROM monitors WHERE ref_id IN ({placeholders})", batch)
+            self.alive[slots] = 0
+
+    def _exact(self, generation, query, k, slots):
+        if not len(slots):
+            return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.float32)
+        slots, scores = top_k(slots, generation.vectors[slots] @ query, k)
+        return generation.ids[slots], scores
+
+    def search(self, query, k, companies=None):
+        """Approximate top-k (rowids, cosine scores) for a unit-normalized query vector, optionally within some companies."""
+        generation = self.generation
+        count, trained = generation.count, generation.trained
+        query = np.asarray(query, dtype=np.float32)
+        alive = generation.alive[:count].astype(bool)
+        codes = None
+        if companies is not None:
+            codes = [self.companies[key] for key in (company.strip().lower() for company in companies) if key in self.companies]
+            if not codes:
+                return self._exact(generation, query, k, [])
+            members = np.flatnonzero(np.isin(generation.company[:count], codes) & alive)
+            if len(members) <= ANN_FILTER_EXACT or not trained:
+                return self._exact(generation, query, k, members)
+        if not trained:
+            return self._exact(generation, query, k, np.flatnonzero(alive))
+
+        centroids, offsets = generation.centroids, generation.offsets
+        nprobe = min(ANN_NPROBE, len(centroids))
+        probes = np.argpartition(-(centroids @ query), nprobe - 1)[:nprobe]
+        slots, scores = [], []
+        for probe in probes:
+            start, end = offsets[probe], offsets[probe + 1]
+            if end > start:
+                slots.append(np.arange(start, end))
+                scores.append(generation.vectors[start:end] @ query)
+        tail = trained + np.flatnonzero(np.isin(generation.lists[trained:count], probes))
+        if len(tail):
+            slots.append(tail)
+            scores.append(generation.vectors[tail] @ query)
+        if not slots:
+            return self._exact(generation, query, k, [])
+        slots, scores = np.concatenate(slots), np.concatenate(scores)
+        keep = alive[slots] if codes is None else alive[slots] & np.isin(generation.company[slots], codes)
+        slots, scores = top_k(slots[keep], scores[keep], k)
+        return generation.ids[slots], scores
+
+    def rows(self, ids) -> list:
+        """Monitor rows for rowids, in the same order; None for monitors deleted meanwhile."""
+        ids = [int(i) for i in ids]
+        if not ids:
+            return []
+        placeholders = ",".join("?" * len(ids))
+        found = {
+            rowid: {"monitor": monitor, "company": company, "ref_id": ref_id, "node_id": node_id}
+            for rowid, monitor, company, ref_id, node_id in self._query(
+                f"SELECT rowid, monitor, company, ref_id, node_id FROM monitors WHERE rowid IN ({placeholders})", ids
+            )
+        }
+        return [found.get(i) for i in ids]
+
+    def get_vectors(self, ids):
+        """Unit-normalized vectors of the monitors with these rowids, skipping deleted ones."""
+        ids = [int(i) for i in ids]
+        placeholders = ",".join("?" * len(ids))
+        # Slots are only renumbered under db_lock, together with publishing the generation they belong to
+        with self.db_lock:
+            generation = self.generation
+            slots = dict(self.db.execute(f"SELECT rowid, slot FROM monitors WHERE rowid IN ({placeholders})", ids).fetchall()) if ids else {}
+        return np.asarray(generation.vectors[np.array([slots[i] for i in ids if i in slots], dtype=np.int64)])
+
+    def entities(self) -> list:
+        return [{"monitor": monitor, "company": company} for monitor, company in self._query("SELECT monitor, company FROM monitors")]
+
+    def find(self, names, limit) -> list:
+        """Rowids of monitors whose name or company is one of names (lower-cased)."""
+        names = list(names)
+        if not names:
+            return []
+        placeholders = ",".join("?" * len(names))
+        return [row[0] for row in self._query(
+            f"SELECT rowid FROM monitors WHERE lower(monitor) IN ({placeholders}) OR lower(company) IN ({placeholders}) LIMIT ?",
+            names + names + [limit],
+        )]
+
+    def maybe_train(self):
+        """Train once the store reaches ANN_MIN_TRAIN monitors, and again once the untrained tail outgrows the trained part."""
+        live = len(self)
+        if live >= ANN_MIN_TRAIN and self.count - self.trained > self.trained:
+            return self.train()
+        return False
+
+    def train(self, nlist=None, iterations=10, seed=0):
+        """Cluster the live vectors into inverted lists and compact the files in list order."""
+        with self.lock:
+            live = np.flatnonzero(self.alive[:self.count])
+            if not len(live):
+                return False
+            nlist = min(nlist or ANN_NLIST or max(1, int(math.sqrt(len(live)))), len(live))
+            rng = np.random.default_rng(seed)
+            sample = self.vectors[np.sort(rng.choice(live, min(len(live), max(ANN_TRAIN_SAMPLE, nlist * 40)), replace=False))]
+            centroids = sample[rng.choice(len(sample), nlist, replace=False)]
+            for _ in range(iterations):
+                assign = nearest(sample, centroids)
+                order = np.argsort(assign, kind="stable")
+                members, starts = np.unique(assign[order], return_index=True)
+                sums = np.add.reduceat(sample[order], starts, axis=0)
+                centroids = centroids.copy()
+                centroids[members] = normalize_rows(sums)
+            lists = np.concatenate([nearest(self.vectors[live[i:i + CHUNK]], centroids) for i in range(0, len(live), CHUNK)])
+            order = np.argsort(lists, kind="stable")
+            slots, lists = live[order], lists[order]
+            offsets = np.searchsorted(lists, np.arange(nlist + 1))
+            np.save(self._file("centroids.npy"), centroids)
+            np.save(self._file("offsets.npy"), offsets)
+            self._compact(slots, lists, centroids, offsets)
+            self.persist()
+            logging.info(f"Trained IVF index over {len(slots)} monitors with {nlist} lists")
+            return True
+
+    def _compact(self, slots, lists, centroids, offsets):
+        """Rewrite the arrays with slots[i] moved to position i, renumber the SQLite rows to match and publish the result.
+
+        Searches keep reading the previous generation, whose replaced files stay mapped, until the new one is published.
+        """
+        old = {name: getattr(self, name) for name in ARRAYS}
+        self.capacity = max(1024, len(slots))
+        self._open_arrays(suffix=".new")
+        for i in range(0, len(slots), CHUNK):
+            chunk = slots[i:i + CHUNK]
+            for name in ("vectors", "company", "ids"):
+                getattr(self, name)[i:i + len(chunk)] = old[name][chunk]
+        self.lists[:len(slots)] = lists
+        self.alive[:len(slots)] = 1
+        for name in ARRAYS:
+            getattr(self, name).flush()
+            os.replace(self._file(name + ".new"), self._file(name))
+        self._open_arrays()
+        with self.db_lock, self.db:
+            self.db.execute("CREATE TEMP TABLE remap (old INTEGER PRIMARY KEY, new INTEGER)")
+            self.db.executemany("INSERT INTO remap VALUES (?, ?)", ((int(old_slot), new) for new, old_slot in enumerate(slots)))
+            # Renumber through negative slots so no intermediate state collides with the unique index
+            self.db.execute("UPDATE monitors SET slot = -1 - (SELECT new FROM remap WHERE old = monitors.slot)")
+            self.db.execute("UPDATE monitors SET slot = -1 - slot")
+            self.db.execute("DROP TABLE remap")
+            self.count, self.trained = len(slots), len(slots)
+            self.centroids, self.offsets = centroids, offsets
+            self._publish()
+
+    def persist(self):
+        """Flush the vector files, then record how many slots they hold."""
+        with self.lock:
+            for name in ARRAYS:
+                array = getattr(self, name)
+                if isinstance(array, np.memmap):
+                    array.flush()
+            meta = {"dim": self.dim, "count": self.count, "capacity": self.capacity, "trained": self.trained}
+            with open(self._file(META_FILE + ".tmp"), "w") as file:
+                json.dump(meta, file)
+            os.replace(self._file(META_FILE + ".tmp"), self._file(META_FILE))
+
+
+class MonitorVectorStore(BasePydanticVectorStore):
+    """LlamaIndex vector store over an IVFStore, with EQ and IN filters on 'company'."""
+
+    stores_text: bool = True
+    _store: IVFStore = PrivateAttr()
+
+    def __init__(self, store: IVFStore, **kwargs: Any):
+        super().__init__(**kwargs)
+        self._store = store
+
+    @classmethod
+    def class_name(cls) -> str:
+        return "MonitorVectorStore"
+
+    @property
+    def client(self) -> IVFStore:
+        return self._store
+
+    def add(self, nodes: List[BaseNode], **add_kwargs: Any) -> List[str]:
+        self._store.add([
+            {
+                "ref_id": node.ref_doc_id or node.node_id,
+                "node_id": node.node_id,
+                "monitor": node.metadata["monitor"],
+                "company": node.metadata["company"],
+                "row_hash": node.metadata.get("row_hash", ""),
+                "embedding": node.get_embedding(),
+            }
+            for node in nodes
+        ])
+        return [node.node_id for node in nodes]
+
+    def delete(self, ref_doc_id: str, **delete_kwargs: Any) -> None:
+        self._store.delete([ref_doc_id])
+
+    def query(self, query: VectorStoreQuery, **kwargs: Any) -> VectorStoreQueryResult:
+        companies = None
+        for metadata_filter in (query.filters.filters if query.filters else []):
+            if metadata_filter.key != "company" or metadata_filter.operator not in (FilterOperator.EQ, FilterOperator.IN):
+                raise ValueError(f"Unsupported monitor filter {metadata_filter}")
+            values = metadata_filter.value if metadata_filter.operator == FilterOperator.IN else [metadata_filter.value]
+            companies = set(values) if companies is None else companies & set(values)
+        vector = np.asarray(query.query_embedding, dtype=np.float32)
+        slots, scores = self._store.search(vector / (np.linalg.norm(vector) or 1.0), query.similarity_top_k, companies=companies)
+        found = [(row, float(score)) for row, score in zip(self._store.rows(slots), scores) if row is not None]
+        nodes = [monitor_node(row) for row, _ in found]
+        return VectorStoreQueryResult(
+            nodes=nodes,
+            similarities=[score for _, score in found],
+            ids=[node.node_id for node in nodes],
+        )
@@ -1,22 +1,51 @@
+import asyncio
 import logging
+import threading
 import json
+import time
 from os import environ
 from dotenv import load_dotenv
-from llama_index.core import (
-    Document,
-    SimpleDirectoryReader,
-    VectorStoreIndex,
-)
+from llama_index.core import QueryBundle
+from llama_index.core.callbacks import CallbackManager
+from llama_index.core.llms import ChatMessage
+from llama_index.core.memory import ChatMemoryBuffer
+from llama_index.core.query_engine import RetrieverQueryEngine
+from llama_index.core.response_synthesizers import get_response_synthesizer
 from llama_index.core.tools import QueryEngineTool, ToolMetadata
+from llama_index.core.vector_stores import FilterOperator, MetadataFilter, MetadataFilters
 from llama_index.core.agent import ReActAgent
 from llama_index.llms.openai import OpenAI
 import requests
 import json
 
-from newspaper import Article
+import metrics
+from assessment_cache import AssessmentCache
+from cascade import ASSESSMENT_MODEL, build_triage_llm, model_name, needs_escalation, tier_record
+from condense import Condenser
+from embeddings import get_embed_model, reset_clients
+from fetcher import get_fetcher
+from monitor_index import MONITOR_WATCH_INTERVAL, MonitorIndex, MonitorWatcher
+from reference_corpus import ReferenceCorpus
+from relevance import RelevanceGate
+from router import read_aliases
+from streaming import VerdictStreamParser
+from usage import LLMTurnTimer, RequestTokenCounter, count_tokens, counter_usage, request_timings, timed, timed_stage, usage_from_raw
 # Load environment variables
 load_dotenv()
-OPENAI_API_KEY = environ["OPENAI_API_KEY"]
+OPENAI_API_KEY = environ.get("OPENAI_API_KEY")
+
+# "agent" runs the multi-turn ReAct loop, "direct" makes one LLM call over the top-k monitors
+ASSESSMENT_MODE = environ.get("ASSESSMENT_MODE", "agent")
+ASSESSMENT_MODES = ("agent", "direct")
+DIRECT_TOP_K = int(environ.get("DIRECT_TOP_K", "3"))
+# Token limit of each request's agent memory; defaults to 75% of the LLM context window
+AGENT_MEMORY_TOKENS = int(environ["AGENT_MEMORY_TOKENS"]) if environ.get("AGENT_MEMORY_TOKENS") else None
+# Defaults for /check_batch: articles assessed at once, and seconds allowed per article
+BATCH_CONCURRENCY = int(environ.get("BATCH_CONCURRENCY", "8"))
+BATCH_ITEM_TIMEOUT = float(environ.get("BATCH_ITEM_TIMEOUT", "120"))
+ASSESSMENT_CACHE = environ.get("ASSESSMENT_CACHE", "1") == "1"
+# Set to 1 to add earlier coverage from the reference corpus (see reference_corpus.py) to assessment prompts
+PRIOR_COVERAGE = environ.get("PRIOR_COVERAGE", "0") == "1"
 
 # Configure logging
 # logging.basicConfig(level=logging.INFO)
@@ -25,15 +54,13 @@ OPENAI_API_KEY = environ["OPENAI_API_KEY"]
 
 
 def fetch_article_content(url):
-    """Fetch and parse article content from a URL using newspaper3k"""
-    article = Article(url)
-    article.download()
-    article.parse()
-    article.nlp()
-    logging.info(f"Article title: {article.title}")
-    with open("temp_text.txt", "w") as file:
-        file.write(article.text)
-    return article.text
+    """Fetch an article with the shared pooled fetcher and return its text"""
+    return get_fetcher().fetch(url)["text"]
+
+def fetched_content(article) -> str:
+    """The text to assess for a fetched article, headline first so condensing keeps it"""
+    title = (article.get("title") or "").strip()
+    return f"{title}\n\n{article['text']}" if title else article["text"]
 
 def getPrompt(article_text: str) -> str:
     return (     
@@ -54,54 +81,521 @@ def getPrompt(article_text: str) -> str:
         f"  - 'reason' (why it was classified as medium-risk or high-risk)\n"
     )
 
+def priorCoverage(prior) -> str:
+    if not prior:
+        return ""
+    lines = "\n".join(f"- {reference['title']}: {reference['excerpt']}" for reference in prior)
+    return f"Earlier coverage that may concern the same incident, for context only (assess the article, not these):\n{lines}\n\n"
 
 
-class PRMonitorAgent:
-    def __init__(self):
-        self.llm = OpenAI(model="gpt-4")
-        self.index = self.load_index()
-        query_engine = self.index.as_query_engine(similarity_top_k=3, llm=self.llm)
-        query_engine_tools = [QueryEngineTool(query_engine=query_engine, metadata=ToolMetadata(name="user_monitors", description=("This tool contains the subjects that users have setup to monitor. "                 "Use a detailed plain text question as input to the tool.")
+def getAgentPrompt(article_text: str, prior=()) -> str:
+    return (
+        f"Look through the user monitors and check if the following article contains any information that negatively impacts the publicity and reputation of anything mentioned in the monitors tool. "
+        f"Respond with a JSON object containing a risk assessment (none, critical) [{json.dumps({'monitor': 'str', 'risk': 'str', 'reason': 'str'})}]. "
+        f"{priorCoverage(prior)}"
+        f"Article: '{article_text}'"
+    )
+
+
+def getDirectPrompt(article_text: str, monitors: list, prior=()) -> str:
+    monitor_lines = "\n".join(f"- {m['monitor']} (company: {m['company']})" for m in monitors)
+    return (
+        f"Our users have set up the following monitors:\n{monitor_lines}\n\n"
+        f"For each monitor, check if the following article contains any information that negatively impacts the publicity and reputation of the monitored subject. "
+        f"Respond only with a JSON object {{\"monitors\": [{json.dumps({'monitor': 'str', 'risk': 'str', 'reason': 'str'})}]}} "
+        f"containing one entry per monitor listed above, with risk set to none or critical.\n\n"
+        f"{priorCoverage(prior)}"
+        f"Article: '{article_text}'"
+    )
+
+
+def parse_verdicts(response_text: str) -> list:
+    """Extract the list of per-monitor verdicts from an LLM response."""
+    text = str(response_text).strip()
+    starts = [i for i in (text.find("["), text.find("{")) if i != -1]
+    if not starts:
+        return []
+    start = min(starts)
+    end = text.rfind("]" if text[start] == "[" else "}")
+    try:
+        data = json.loads(text[start:end + 1])
+    except json.JSONDecodeError:
+        logging.warning(f"Could not parse verdicts from response: {text[:200]}")
+        return []
+    if isinstance(data, dict):
+        data = data.get("monitors", [data])
+    return [verdict for verdict in data if isinstance(verdict, dict) and "monitor" in verdict]
+
+
+def build_assessment(response_text, gate, mode, usage, start) -> dict:
+    assessment = {
+        "monitors": parse_verdicts(response_text),
+        "gate": gate,
+        "mode": mode,
+        "usage": usage,
+        "latency_ms": round((time.perf_counter() - start) * 1000, 1),
+    }
+    if not assessment["monitors"]:
+        assessment["response"] = response_text
+    return assessment
+
+
+def company_filters(companies):
+    """Metadata filters limiting retrieval to the monitors of some companies, or None for all monitors."""
+    if not companies:
+        return None
+    return MetadataFilters(filters=[MetadataFilter(key="company", value=list(companies), operator=FilterOperator.IN)])
+
+
+class TimedQueryEngine(RetrieverQueryEngine):
+    """Query engine of the agent's monitors tool, adding its retrieval time to the request's 'retrieval_ms'."""
+
+    def retrieve(self, query_bundle):
+        with timed_stage("retrieval"):
+            return super().retrieve(query_bundle)
+
+    async def aretrieve(self, query_bundle):
+        with timed_stage("retrieval"):
+            return await super().aretrieve(query_bundle)
+
+
+def monitor_tools(index, llm, filters=None):
+    # index.as_query_engine() would replace the LLM's callback manager, and with it per-request token counting
+    query_engine = TimedQueryEngine(
+        retriever=index.as_retriever(similarity_top_k=3, filters=filters),
+        response_synthesizer=get_response_synthesizer(llm=llm, callback_manager=llm.callback_manager),
+        callback_manager=llm.callback_manager,
+    )
+    return [QueryEngineTool(query_engine=query_engine, metadata=ToolMetadata(name="user_monitors", description=("This tool contains the subjects that users have setup to monitor. "                 "Use a detailed plain text question as input to the tool.")
 ))]
-        self.agent =  ReActAgent.from_tools(
-            tools=query_engine_tools,
+
+
+class MonitorView:
+    """The index, relevance gate, retriever and agent tools of one monitor-set version.
+
+    Requests take the current view once and use it throughout, so a monitor
+    update swaps in a new view without disturbing assessments in flight.
+    """
+
+    def __init__(self, monitors, llm, threshold=None, previous=None):
+        self.version, self.content_hash, self.index, search = monitors.snapshot()
+        self.llm = llm
+        router = previous.gate.router if previous is not None else None
+        self.gate = RelevanceGate(search, embed_model=monitors.embed_model, aliases=read_aliases(), router=router)
+        if threshold is not None:
+            self.gate.threshold = threshold
+        self.retriever = self.index.as_retriever(similarity_top_k=DIRECT_TOP_K)
+        self.tools = monitor_tools(self.index, llm)
+
+    def retriever_for(self, companies):
+        """Retriever over the shards of the companies an article was routed to, or over all monitors."""
+        if not companies:
+            return self.retriever
+        return self.index.as_retriever(similarity_top_k=DIRECT_TOP_K, filters=company_filters(companies))
+
+    def tools_for(self, companies):
+        if not companies:
+            return self.tools
+        return monitor_tools(self.index, self.llm, company_filters(companies))
+
+
+class PRMonitorAgent:
+    def __init__(self, mode=ASSESSMENT_MODE, llm=None, embed_model=None, monitors=None, use_cache=ASSESSMENT_CACHE, watch=MONITOR_WATCH_INTERVAL,
+                 triage_llm=None, references=None):
+        self.mode = mode
+        self.llm = llm or OpenAI(model=ASSESSMENT_MODEL)
+        self.llm.callback_manager = CallbackManager([RequestTokenCounter(), LLMTurnTimer()])
+        # None takes the triage model from TRIAGE_MODEL, False disables the cascade
+        self.triage_llm = build_triage_llm() if triage_llm is None else triage_llm or None
+        if self.triage_llm is not None:
+            self.triage_llm.callback_manager = self.llm.callback_manager
+        self.monitors = monitors or MonitorIndex(embed_model=embed_model or get_embed_model())
+        self.view_lock = threading.Lock()
+        self.load_index()
+        self.view = MonitorView(self.monitors, self.llm)
+        self.condenser = Condenser(self.monitors.embed_model)
+        self.cache = AssessmentCache() if use_cache else None
+        # None opens the corpus in REFERENCE_CORPUS_DIR when PRIOR_COVERAGE is on, False disables prior coverage
+        if references is None:
+            references = ReferenceCorpus(embed_model_name=self.monitors.embed_model.model_name) if PRIOR_COVERAGE else None
+        self.references = references or None
+        self.fetcher = get_fetcher()
+        self.watcher = MonitorWatcher(self.monitors.csv_path, self.reload_monitors, interval=watch).start() if watch else None
+
+    def after_fork(self):
+        """Reopen per-process resources in a forked child that keeps this agent and its loaded monitor index."""
+        self.view_lock = threading.Lock()
+        self.monitors.after_fork()
+        if hasattr(self.monitors.embed_model, "after_fork"):
+            self.monitors.embed_model.after_fork()
+        for llm in (self.llm, self.triage_llm):
+            reset_clients(llm)
+        if self.cache is not None:
+            self.cache.after_fork()
+        if self.references is not None:
+            self.references.after_fork()
+        self.fetcher = get_fetcher()
+        if self.watcher is not None:
+            self.watcher.after_fork()
+
+    @property
+    def gate(self):
+        return self.view.gate
+
+    def new_agent(self, view=None, companies=()):
+        """Create a ReAct agent with its own bounded memory around the shared LLM and tools."""
+        return ReActAgent.from_tools(
+            tools=(view or self.view).tools_for(companies),
             llm=self.llm,
+            memory=ChatMemoryBuffer.from_defaults(token_limit=AGENT_MEMORY_TOKENS, llm=self.llm),
             verbose=True,
             max_turns=10,
         )
 
     def load_index(self):
-        """Load documents from the monitors directory and create a new index."""
-        reader = SimpleDirectoryReader(input_dir="monitors")
-        documents = reader.load_data()
-        return VectorStoreIndex.from_documents(documents)
+        """Load the persisted monitor index, re-embedding only changed monitors.csv rows."""
+        self.monitors.sync()
+        return self.monitors.index
+
+    def refresh_view(self):
+        """Swap in a view of the current monitor set if its version moved on."""
+        with self.view_lock:
+            if self.monitors.version != self.view.version:
+                self.view = MonitorView(self.monitors, self.llm, threshold=self.view.gate.threshold, previous=self.view)
+                logging.info(f"Serving monitor set version {self.view.version}")
+        return self.view
+
+    def reload_monitors(self):
+        """Apply edits to monitors.csv made outside the API; called by the file watcher."""
+        changes = self.monitors.sync()
+        self.refresh_view()
+        return changes
+
+    def update_monitors(self, upserts=(), removals=()):
+        """Create, change or delete monitors and serve them from the next request on."""
+        changes = self.monitors.update(upserts=upserts, removals=removals)
+        if self.watcher is not None:
+            # Our own write to monitors.csv is already applied
+            self.watcher.mark_seen()
+        self.refresh_view()
+        return changes
+
+    def resolve_mode(self, mode):
+        mode = mode or self.mode
+        if mode not in ASSESSMENT_MODES:
+            raise ValueError(f"Unknown assessment mode {mode!r}, expected one of {ASSESSMENT_MODES}")
+        return mode
+
+    def cache_version(self, mode, threshold, view=None):
+        """Cache key part covering everything besides the article that shapes a result."""
+        view = view or self.view
+        threshold = view.gate.threshold if threshold is None else float(threshold)
+        triage = model_name(self.triage_llm) if self.triage_llm is not None else ""
+        references = self.references.version if self.references is not None else ""
+        return f"{view.version}:{view.content_hash}/{mode}/{threshold}/{triage}/{references}"
+
+    def cached_assess(self, article_content, url=None, threshold=None, mode=None) -> dict:
+        """Return a cached result for this article or a near-duplicate, assessing it on a miss."""
+        if self.cache is None:
+            return self.assess(article_content, threshold=threshold, mode=mode)
+        view = self.view
+        version = self.cache_version(self.resolve_mode(mode), threshold, view)
+        cached = self.cache.get_text(article_content, version)
+        if cached is not None:
+            return cached
+        result = self.assess(article_content, threshold=threshold, mode=mode, view=view)
+        result["cache_id"] = self.cache.put(article_content, version, result, url=url)
+        return result
+
+    async def acached_assess(self, article_content, url=None, threshold=None, mode=None) -> dict:
+        if self.cache is None:
+            return await self.aassess(article_content, threshold=threshold, mode=mode)
+        view = self.view
+        version = self.cache_version(self.resolve_mode(mode), threshold, view)
+        cached = self.cache.get_text(article_content, version)
+        if cached is not None:
+            return cached
+        result = await self.aassess(article_content, threshold=threshold, mode=mode, view=view)
+        result["cache_id"] = self.cache.put(article_content, version, result, url=url)
+        return result
+
+    def cached_url(self, url, threshold=None, mode=None):
+        """Cached result for a URL, checked before the article is fetched."""
+        if self.cache is None:
+            return None
+        return self.cache.get_url(url, self.cache_version(self.resolve_mode(mode), threshold))
+
+    def assess(self, article_content, threshold=None, mode=None, view=None) -> dict:
+        """Run the relevance gate and only hand articles that pass it to the LLM."""
+        mode = self.resolve_mode(mode)
+        view = view or self.view
+        start = time.perf_counter()
+        timings = {}
+        with timed(timings, "embed"):
+            embedding = view.gate.embed(article_content)
+        with timed(timings, "gate"):
+            gate = view.gate.check(article_content, threshold=threshold, embedding=embedding)
+        if not gate["passed"]:
+            result = {"monitors": [], "message": "No relevant monitors", "gate": gate, "mode": mode, "timings": timings,
+                      "monitor_version": view.version, "latency_ms": round((time.perf_counter() - start) * 1000, 1)}
+            metrics.observe_assessment(result)
+            return result
+        # Prior coverage is searched while the article is condensed
+        search = self.references.submit(embedding, article_content) if self.references is not None else None
+        with timed(timings, "condense"):
+            monitor_vectors = view.gate.matched_vectors(gate, embedding, threshold=threshold)
+            condensed, condensation = self.condenser.condense(article_content, monitor_vectors)
+        prior = self.references.collect(search, timings) if search is not None else []
+        response_text, usage, cascade = self.classify(condensed, embedding, timings, view, gate["companies"], mode, prior)
+        result = {**build_assessment(response_text, gate, mode, usage, start), "condensation": condensation, "timings": timings,
+                  "monitor_version": view.version, "cascade": cascade, "references": prior}
+        metrics.observe_assessment(result)
+        return result
+
+    async def aassess(self, article_content, threshold=None, mode=None, view=None) -> dict:
+        """Async version of assess, using the async embedding, retrieval and LLM APIs."""
+        mode = self.resolve_mode(mode)
+        view = view or self.view
+        start = time.perf_counter()
+        timings = {}
+        with timed(timings, "embed"):
+            embedding = await view.gate.aembed(article_content)
+        with timed(timings, "gate"):
+            gate = view.gate.check(article_content, threshold=threshold, embedding=embedding)
+        if not gate["passed"]:
+            result = {"monitors": [], "message": "No relevant monitors", "gate": gate, "mode": mode, "timings": timings,
+                      "monitor_version": view.version, "latency_ms": round((time.perf_counter() - start) * 1000, 1)}
+            metrics.observe_assessment(result)
+            return result
+        search = self.references.submit(embedding, article_content) if self.references is not None else None
+        with timed(timings, "condense"):
+            monitor_vectors = view.gate.matched_vectors(gate, embedding, threshold=threshold)
+            condensed, condensation = await self.condenser.acondense(article_content, monitor_vectors)
+        prior = await self.references.acollect(search, timings) if search is not None else []
+        response_text, usage, cascade = await self.aclassify(condensed, embedding, timings, view, gate["companies"], mode, prior)
+        result = {**build_assessment(response_text, gate, mode, usage, start), "condensation": condensation, "timings": timings,
+                  "monitor_version": view.version, "cascade": cascade, "references": prior}
+        metrics.observe_assessment(result)
+        return result
+
+    def triage(self, article_content, embedding, timings, view, companies, prior=()):
+        """Classify with the triage model in one call; returns (response, usage, escalate, cascade info)."""
+        with timed(timings, "triage"):
+            response_text, usage = self.run_direct(article_content, embedding, {}, view, companies, llm=self.triage_llm, prior=prior)
+        escalate = needs_escalation(parse_verdicts(response_text))
+        cascade = {"escalated": escalate, "tiers": {"triage": tier_record(self.triage_llm, usage, timings["triage_ms"])}}
+        return response_text, usage, escalate, cascade
+
+    async def atriage(self, article_content, embedding, timings, view, companies, prior=()):
+        with timed(timings, "triage"):
+            response_text, usage = await self.arun_direct(article_content, embedding, {}, view, companies, llm=self.triage_llm, prior=prior)
+        escalate = needs_escalation(parse_verdicts(response_text))
+        cascade = {"escalated": escalate, "tiers": {"triage": tier_record(self.triage_llm, usage, timings["triage_ms"])}}
+        return response_text, usage, escalate, cascade
+
+    def classify(self, article_content, embedding, timings, view, companies, mode, prior=()):
+        """Classify with the triage model when configured, escalating to the full model unless it finds no risk.
+
+        Returns (response, usage of the final tier, cascade info with every tier's model, latency and cost).
+        """
+        cascade = {"escalated": None, "tiers": {}}
+        if self.triage_llm is not None:
+            response_text, usage, escalate, cascade = self.triage(article_content, embedding, timings, view, companies, prior)
+            if not escalate:
+                return response_text, usage, cascade
+        if mode == "direct":
+            response_text, usage = self.run_direct(article_content, embedding, timings, view, companies, prior=prior)
+        else:
+            with timed(timings, "llm"):
+                response_text, usage = self.run_agent(article_content, view, companies, prior, timings)
+        cascade["tiers"]["full"] = tier_record(self.llm, usage, timings["llm_ms"])
+        return response_text, usage, cascade
+
+    async def aclassify(self, article_content, embedding, timings, view, companies, mode, prior=()):
+        cascade = {"escalated": None, "tiers": {}}
+        if self.triage_llm is not None:
+            response_text, usage, escalate, cascade = await self.atriage(article_content, embedding, timings, view, companies, prior)
+            if not escalate:
+                return response_text, usage, cascade
+        if mode == "direct":
+            response_text, usage = await self.arun_direct(article_content, embedding, timings, view, companies, prior=prior)
+        else:
+            with timed(timings, "llm"):
+                response_text, usage = await self.arun_agent(article_content, view, companies, prior, timings)
+        cascade["tiers"]["full"] = tier_record(self.llm, usage, timings["llm_ms"])
+        return response_text, usage, cascade
 
-    def check_article_url(self, url) -> str:
+    def run_agent(self, article_content, view=None, companies=(), prior=(), timings=None):
+        """Let a fresh ReAct agent query the monitors tool and classify the article.
+
+        The tool's retrieval time is recorded in timings as 'retrieval_ms', and is part of the caller's 'llm_ms'.
+        """
+        with count_tokens() as counter, request_timings(timings):
+            result = self.new_agent(view, companies).chat(message=getAgentPrompt(article_content, prior))
+        return result.response, counter_usage(counter)
+
+    async def arun_agent(self, article_content, view=None, companies=(), prior=(), timings=None):
+        with count_tokens() as counter, request_timings(timings):
+            result = await self.new_agent(view, companies).achat(message=getAgentPrompt(article_content, prior))
+        return result.response, counter_usage(counter)
+
+    def direct_messages(self, article_content, nodes, prior=()):
+        monitors = [{"monitor": n.node.metadata["monitor"], "company": n.node.metadata["company"]} for n in nodes]
+        return [ChatMessage(role="user", content=getDirectPrompt(article_content, monitors, prior))]
+
+    def run_direct(self, article_content, embedding, timings, view=None, companies=(), llm=None, prior=()):
+        """Retrieve the top-k monitors and classify the article against them in one LLM call."""
+        with timed(timings, "retrieval"):
+            nodes = (view or self.view).retriever_for(companies).retrieve(QueryBundle(query_str=article_content, embedding=embedding))
+        with timed(timings, "llm"):
+            response = (llm or self.llm).chat(self.direct_messages(article_content, nodes, prior))
+        return response.message.content, {"turns": 1, **usage_from_raw(response.raw)}
+
+    async def arun_direct(self, article_content, embedding, timings, view=None, companies=(), llm=None, prior=()):
+        with timed(timings, "retrieval"):
+            nodes = await (view or self.view).retriever_for(companies).aretrieve(QueryBundle(query_str=article_content, embedding=embedding))
+        with timed(timings, "llm"):
+            response = await (llm or self.llm).achat(self.direct_messages(article_content, nodes, prior))
+        return response.message.content, {"turns": 1, **usage_from_raw(response.raw)}
+
+    async def acheck_item(self, item, threshold=None, mode=None) -> dict:
+        """Assess one batch item, given as {'article': text} or {'url': url}."""
+        url = item.get("url")
+        if url:
+            cached = self.cached_url(url, threshold=threshold, mode=mode)
+            if cached is not None:
+                return cached
+            article = await self.fetcher.afetch(url)
+            result = await self.acached_assess(fetched_content(article), url=url, threshold=threshold, mode=mode)
+            return {**result, "fetch": article["timings"]}
+        if not item.get("article"):
+            raise ValueError("Batch items need an 'article' or a 'url'")
+        return await self.acached_assess(item["article"], threshold=threshold, mode=mode)
+
+    async def acheck_batch(self, items, concurrency=BATCH_CONCURRENCY, timeout=BATCH_ITEM_TIMEOUT, threshold=None, mode=None) -> list:
+        """Assess many articles concurrently, returning one result per item even when some fail."""
+        semaphore = asyncio.Semaphore(concurrency)
+
+        async def run(index, item):
+            async with semaphore:
+                try:
+                    result = await asyncio.wait_for(self.acheck_item(item, threshold=threshold, mode=mode), timeout)
+                    return {"index": index, "status": "ok", **result}
+                except asyncio.TimeoutError:
+                    logging.error(f"Batch item {index} timed out after {timeout}s")
+                    metrics.errors.inc(stage="timeout")
+                    return {"index": index, "status": "timeout", "error": f"timed out after {timeout}s"}
+                except Exception as e:
+                    logging.error(f"Error while monitoring batch item {index}: {e}")
+                    metrics.errors.inc(stage="assess")
+                    return {"index": index, "status": "error", "error": str(e)}
+
+        return await asyncio.gather(*(run(index, item) for index, item in enumerate(items)))
+
+    def stream_assess(self, article_content, url=None, threshold=None, mode=None):
+        """Assess an article, yielding (event, data) pairs as soon as each verdict is parsed."""
+        mode = self.resolve_mode(mode)
+        view = self.view
+        start = time.perf_counter()
+        elapsed = lambda: round((time.perf_counter() - start) * 1000, 1)
+        version = self.cache_version(mode, threshold, view) if self.cache else None
+        cached = self.cache.get_text(article_content, version) if self.cache else None
+        if cached is not None:
+            for verdict in cached.get("monitors", []):
+                yield "verdict", {**verdict, "cached": True}
+            yield "done", cached
+            return
+
+        embedding = view.gate.embed(article_content)
+        gate = view.gate.check(article_content, threshold=threshold, embedding=embedding)
+        yield "gate", gate
+        if not gate["passed"]:
+            result = {"monitors": [], "message": "No relevant monitors", "gate": gate, "mode": mode}
+        else:
+            search = self.references.submit(embedding, article_content) if self.references is not None else None
+            monitor_vectors = view.gate.matched_vectors(gate, embedding, threshold=threshold)
+            condensed, condensation = self.condenser.condense(article_content, monitor_vectors)
+            timings = {}
+            prior = self.references.collect(search, timings) if search is not None else []
+            if prior:
+                yield "references", prior
+            parser = VerdictStreamParser()
+            streamed, parts, first_critical = [], [], None
+            cascade = {"escalated": None, "tiers": {}}
+            escalate = True
+            if self.triage_llm is not None:
+                # The triage answer is short, so it is not streamed; only escalations stream from the full model
+                triage_text, triage_usage, escalate, cascade = self.triage(condensed, embedding, timings, view, gate["companies"], prior)
+                yield "triage", {"escalated": escalate, "elapsed_ms": elapsed()}
+            llm_start = time.perf_counter()
+            with count_tokens() as counter:
+                if not escalate:
+                    chunks = [triage_text]
+                elif mode == "direct":
+                    nodes = view.retriever_for(gate["companies"]).retrieve(QueryBundle(query_str=condensed, embedding=embedding))
+                    chunks = (r.delta for r in self.llm.stream_chat(self.direct_messages(condensed, nodes, prior)))
+                else:
+                    chunks = self.new_agent(view, gate["companies"]).stream_chat(message=getAgentPrompt(condensed, prior)).response_gen
+                for chunk in chunks:
+                    parts.append(chunk or "")
+                    for verdict in parser.feed(chunk or ""):
+                        streamed.append(verdict)
+                        if first_critical is None and verdict.get("risk") == "critical":
+                            first_critical = elapsed()
+                        yield "verdict", {**verdict, "elapsed_ms": elapsed()}
+            if escalate:
+                cascade["tiers"]["full"] = tier_record(self.llm, counter_usage(counter), round((time.perf_counter() - llm_start) * 1000, 1))
+            result = build_assessment("".join(parts), gate, mode, counter_usage(counter) if escalate else triage_usage, start)
+            # Verdicts the incremental parser could not pick out are still sent before the summary
+            for verdict in result["monitors"]:
+                if verdict not in streamed:
+                    if first_critical is None and verdict.get("risk") == "critical":
+                        first_critical = elapsed()
+                    yield "verdict", {**verdict, "elapsed_ms": elapsed()}
+            result.update(condensation=condensation, time_to_first_critical_ms=first_critical, cascade=cascade, references=prior)
+        result["monitor_version"] = view.version
+        metrics.observe_assessment(result)
+        if self.cache is not None:
+            result["cache_id"] = self.cache.put(article_content, version, result, url=url)
+        yield "done", result
+
+    def stream_check(self, item, threshold=None, mode=None):
+        """Stream the assessment of {'article': text} or {'url': url}, fetching URLs first."""
+        url = item.get("url")
+        if not url:
+            yield from self.stream_assess(item["article"], threshold=threshold, mode=mode)
+            return
+        cached = self.cached_url(url, threshold=threshold, mode=mode)
+        if cached is not None:
+            for verdict in cached.get("monitors", []):
+                yield "verdict", {**verdict, "cached": True}
+            yield "done", cached
+            return
+        article = self.fetcher.fetch(url)
+        yield "fetch", {"title": article["title"], **article["timings"]}
+        yield from self.stream_assess(fetched_content(article), url=url, threshold=threshold, mode=mode)
+
+    def check_article_url(self, url, threshold=None, mode=None) -> str:
         """Monitor articles from a given URL."""
         try:
-            article_content = fetch_article_content(url)
-            prompt = getPrompt(article_content)
-            # result = self.agent.chat(message=prompt)
-            result = self.agent.chat(
-                message=f"Look through the user monitors and check if the following article contains any information that negatively impacts the publicity and reputation of anything mentioned in the monitors tool. Respond with a JSON object containing a risk assessment (none, critical) [{json.dumps({'monitor': 'str', 'risk': 'str', 'reason': 'str'})}]. Article: '{article_content}'"
-            )
-            print(dir(result))
-            return json.dumps(result.response, default=str)  # Ensure serialization
+            cached = self.cached_url(url, threshold=threshold, mode=mode)
+            if cached is not None:
+                return json.dumps(cached, default=str)
+            article = self.fetcher.fetch(url)
+            result = self.cached_assess(fetched_content(article), url=url, threshold=threshold, mode=mode)
+            return json.dumps({**result, "fetch": article["timings"]}, default=str)
         except Exception as e:
             logging.error(f"Error while monitoring articles: {e}")
+            metrics.errors.inc(stage="assess")
             return json.dumps({"error": "error monitoring article"})
-        
-    def check_article(self, article_content):
+
+    def check_article(self, article_content, threshold=None, mode=None):
         """Monitor articles from a given API URL."""
         try:
-            
-            
-            result = self.agent.chat(
-                message=f"Look through the user monitors and check if the following article contains any information that negatively impacts the publicity and reputation of anything mentioned in the monitors tool. Respond with a JSON object containing a risk assessment (none, critical) [{json.dumps({'monitor': 'str', 'risk': 'str', 'reason': 'str'})}]. Article: '{article_content}'"
-            )
-            return json.dumps(result, default=str)  # Ensure serialization
+            return json.dumps(self.cached_assess(article_content, threshold=threshold, mode=mode), default=str)
         except Exception as e:
             logging.error(f"Error while monitoring articles: {e}")
+            metrics.errors.inc(stage="assess")
             return json.dumps({"error": str(e)})
 
 if __name__ == "__main__":
@@ -109,11 +603,7 @@ if __name__ == "__main__":
     import phoenix as px
     session = px.launch_app()
 
-    from openinference.instrumentation.llama_index import LlamaIndexInstrumentor
-    from phoenix.otel import register
-
-    tracer_provider = register()
-    LlamaIndexInstrumentor().instrument(tracer_provider=tracer_provider)
+    metrics.setup_tracing("phoenix")
 
     agent = PRMonitorAgent()
 
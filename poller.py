@@ -0,0 +1,270 @@
+import csv
+import fcntl
+import heapq
+import logging
+import random
+import sqlite3
+import threading
+import time
+import xml.etree.ElementTree as ET
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from email.utils import parsedate_to_datetime
+from os import environ
+from urllib.parse import urlsplit
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from assessment_cache import canonical_url
+from metrics import errors
+
+SOURCES_CSV = environ.get("SOURCES_CSV", "sources/sources.csv")
+POLLER_STATE_PATH = environ.get("POLLER_STATE_PATH", "poller_state.db")
+POLLER_WORKERS = int(environ.get("POLLER_WORKERS", "32"))
+# Concurrent requests per host, so one slow host cannot occupy every worker
+POLLER_PER_HOST = int(environ.get("POLLER_PER_HOST", "2"))
+POLLER_DEFAULT_INTERVAL = float(environ.get("POLLER_DEFAULT_INTERVAL", "300"))
+POLLER_JITTER = float(environ.get("POLLER_JITTER", "0.1"))
+POLLER_MAX_BACKOFF = float(environ.get("POLLER_MAX_BACKOFF", "3600"))
+POLLER_TIMEOUT = (float(environ.get("POLLER_CONNECT_TIMEOUT", "5")), float(environ.get("POLLER_READ_TIMEOUT", "15")))
+POLLER_MAX_BYTES = int(environ.get("POLLER_MAX_BYTES", str(10 * 1024 * 1024)))
+# Seconds between attempts to take over polling while another server process holds the lock
+POLLER_LOCK_RETRY = float(environ.get("POLLER_LOCK_RETRY", "10"))
+
+ATOM = "{http://www.w3.org/2005/Atom}"
+SITEMAP = "{http://www.sitemaps.org/schemas/sitemap/0.9}"
+
+
+def read_sources(path=SOURCES_CSV):
+    """Read sources.csv into a list of {'url', 'interval'} sources."""
+    sources = []
+    with open(path, newline="") as file:
+        for row in csv.DictReader(file, skipinitialspace=True):
+            row = {(key or "").strip(): (value or "").strip() for key, value in row.items()}
+            if row.get("url"):
+                sources.append({"url": row["url"], "interval": float(row.get("interval") or POLLER_DEFAULT_INTERVAL)})
+    return sources
+
+
+def parse_feed(body):
+    """Parse an RSS, Atom or sitemap document into (item urls, child sitemap urls)."""
+    root = ET.fromstring(body)
+    tag = root.tag.split("}")[-1]
+    if tag == "rss" or root.find("channel") is not None:
+        links = [(item.findtext("link") or item.findtext("guid") or "").strip() for item in root.iter("item")]
+        return [link for link in links if link], []
+    if root.tag == f"{ATOM}feed":
+        links = []
+        for entry in root.iter(f"{ATOM}entry"):
+            alternates = [l for l in entry.findall(f"{ATOM}link") if l.get("rel", "alternate") == "alternate"]
+            if alternates:
+                links.append(alternates[0].get("href"))
+        return [link for link in links if link], []
+    if tag == "urlset":
+        return [loc.text.strip() for loc in root.iter(f"{SITEMAP}loc") if loc.text], []
+    if tag == "sitemapindex":
+        return [], [loc.text.strip() for loc in root.iter(f"{SITEMAP}loc") if loc.text]
+    raise ValueError(f"Unrecognised feed document <{tag}>")
+
+
+class FeedPoller:
+    """Polls RSS/Atom feeds and sitemaps and hands new article URLs to a sink, called as sink(url, feed url).
+
+    Sources are kept in a heap ordered by their next poll time, with jitter
+    on every interval and exponential backoff on failures. Requests are
+    conditional (ETag / If-Modified-Since) and run on a bounded thread pool
+    with a per-host limit. Item URLs are only recorded in the persistent
+    seen-set once the sink accepts them, so rejected items are retried on
+    the next poll. When several server processes start a poller, only the
+    one holding a lock on the state file polls; the others take over if it
+    exits.
+    """
+
+    def __init__(self, sink, sources=None, state_path=POLLER_STATE_PATH, workers=POLLER_WORKERS):
+        self.sink = sink
+        self.sources = {source["url"]: source for source in (read_sources() if sources is None else sources)}
+        self.state_path = state_path
+        self.workers = workers
+        self.leader_lock = threading.Lock()
+        self.lock_file = None
+        self._open()
+
+    def _open(self):
+        self.executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="poller")
+        self.session = requests.Session()
+        self.session.mount("http://", HTTPAdapter(pool_connections=self.workers, pool_maxsize=POLLER_PER_HOST))
+        self.session.mount("https://", HTTPAdapter(pool_connections=self.workers, pool_maxsize=POLLER_PER_HOST))
+        self.host_slots = defaultdict(lambda: threading.BoundedSemaphore(POLLER_PER_HOST))
+        self.lock = threading.Lock()
+        self.wakeup = threading.Condition(self.lock)
+        self.heap = []
+        self.stopped = threading.Event()
+        self.db_lock = threading.Lock()
+        self.db = sqlite3.connect(self.state_path, check_same_thread=False, isolation_level=None)
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.execute(
+            "CREATE TABLE IF NOT EXISTS sources (url TEXT PRIMARY KEY, etag TEXT, last_modified TEXT, "
+            "failures INTEGER NOT NULL DEFAULT 0, last_polled REAL)"
+        )
+        self.db.execute("CREATE TABLE IF NOT EXISTS seen (item TEXT PRIMARY KEY, source TEXT, first_seen REAL)")
+        now = time.time()
+        for url in self.sources:
+            # Spread the first round of polls out instead of hitting every source at once
+            self._schedule(url, now + random.uniform(0, min(self.sources[url]["interval"], 30)))
+
+    def after_fork(self):
+        """Start over in a forked child: new threads, session and state connection, and a new bid for the lock."""
+        if self.lock_file is not None:
+            # Our copy of the parent's lock file; the parent released the lock in stop() before forking
+            self.lock_file.close()
+        self.leader_lock = threading.Lock()
+        self.lock_file = None
+        self._open()
+        self.start()
+
+    def _query(self, sql, params=()):
+        with self.db_lock:
+            return self.db.execute(sql, params).fetchall()
+
+    def _schedule(self, url, when):
+        with self.wakeup:
+            heapq.heappush(self.heap, (when, url))
+            self.wakeup.notify()
+
+    def _next_poll(self, url, failures):
+        interval = self.sources[url]["interval"]
+        if failures:
+            interval = min(interval * 2 ** failures, POLLER_MAX_BACKOFF)
+        return time.time() + interval * random.uniform(1 - POLLER_JITTER, 1 + POLLER_JITTER)
+
+    def start(self):
+        threading.Thread(target=self._run, name="feed-poller", daemon=True).start()
+
+    def stop(self):
+        self.stopped.set()
+        with self.wakeup:
+            self.wakeup.notify()
+        self._release()
+
+    def _lead(self) -> bool:
+        """Wait until this process holds the lock on the state file, so only one server process polls."""
+        while not self.stopped.is_set():
+            with self.leader_lock:
+                lock_file = open(self.state_path + ".lock", "a")
+                try:
+                    fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                    self.lock_file = lock_file
+                    return True
+                except BlockingIOError:
+                    lock_file.close()
+            self.stopped.wait(POLLER_LOCK_RETRY)
+        return False
+
+    def _release(self):
+        with self.leader_lock:
+            if self.lock_file is not None:
+                fcntl.flock(self.lock_file, fcntl.LOCK_UN)
+                self.lock_file.close()
+                self.lock_file = None
+
+    def _run(self):
+        if not self._lead():
+            return
+        logging.info(f"Polling {len(self.sources)} sources")
+        try:
+            while not self.stopped.is_set():
+                with self.wakeup:
+                    while not self.stopped.is_set() and (not self.heap or self.heap[0][0] > time.time()):
+                        self.wakeup.wait(timeout=self.heap[0][0] - time.time() if self.heap else None)
+                    if self.stopped.is_set():
+                        return
+                    _, url = heapq.heappop(self.heap)
+                slot = self.host_slots[urlsplit(url).hostname]
+                if not slot.acquire(blocking=False):
+                    # The host is busy with other sources; try again shortly rather than waiting on it
+                    self._schedule(url, time.time() + 1 + random.random())
+                    continue
+                self.executor.submit(self._poll_and_reschedule, url, slot)
+        finally:
+            self._release()
+
+    def _poll_and_reschedule(self, url, slot):
+        try:
+            self.poll_once(url)
+        finally:
+            slot.release()
+            failures = self._query("SELECT failures FROM sources WHERE url = ?", (url,))
+            self._schedule(url, self._next_poll(url, failures[0][0] if failures else 0))
+
+    def poll_once(self, url) -> list:
+        """Poll one source and return the new item URLs the sink accepted."""
+        state = self._query("SELECT etag, last_modified, failures FROM sources WHERE url = ?", (url,))
+        etag, last_modified, failures = state[0] if state else (None, None, 0)
+        headers = {}
+        if etag:
+            headers["If-None-Match"] = etag
+        if last_modified:
+            headers["If-Modified-Since"] = last_modified
+        try:
+            with self.session.get(url, headers=headers, timeout=POLLER_TIMEOUT, stream=True) as response:
+                if response.status_code == 304:
+                    self._save_state(url, etag, last_modified, 0)
+                    return []
+                response.raise_for_status()
+                body = response.raw.read(POLLER_MAX_BYTES + 1, decode_content=True)
+                if len(body) > POLLER_MAX_BYTES:
+                    raise ValueError(f"feed larger than {POLLER_MAX_BYTES} bytes")
+                items, sitemaps = parse_feed(body)
+                new_etag = response.headers.get("ETag")
+                new_last_modified = response.headers.get("Last-Modified")
+        except Exception as e:
+            logging.warning(f"Polling {url} failed: {e}")
+            errors.inc(stage="poll")
+            self._save_state(url, etag, last_modified, failures + 1)
+            return []
+        for sitemap in sitemaps:
+            if sitemap not in self.sources:
+                self.sources[sitemap] = {"url": sitemap, "interval": self.sources[url]["interval"]}
+                self._schedule(sitemap, time.time())
+        unseen = self._unseen(items)
+        accepted = [item for item in unseen if self._deliver(url, item)]
+        if len(accepted) < len(unseen):
+            # Keep the old validators so the next poll is not answered with a 304 and rejected items are retried
+            new_etag, new_last_modified = etag, last_modified
+        self._save_state(url, new_etag, valid_http_date(new_last_modified), 0)
+        if accepted:
+            logging.info(f"{url}: {len(accepted)} new items")
+        return accepted
+
+    def _unseen(self, items):
+        keys = {canonical_url(item): item for item in items}
+        if not keys:
+            return []
+        placeholders = ",".join("?" * len(keys))
+        seen = {row[0] for row in self._query(f"SELECT item FROM seen WHERE item IN ({placeholders})", list(keys))}
+        return [item for key, item in keys.items() if key not in seen]
+
+    def _deliver(self, source, item):
+        try:
+            if self.sink(item, source) is False:
+                return False
+        except Exception as e:
+            logging.warning(f"Sink rejected {item}: {e}")
+            return False
+        self._query("INSERT OR IGNORE INTO seen VALUES (?, ?, ?)", (canonical_url(item), source, time.time()))
+        return True
+
+    def _save_state(self, url, etag, last_modified, failures):
+        self._query(
+            "INSERT OR REPLACE INTO sources VALUES (?, ?, ?, ?, ?)",
+            (url, etag, last_modified, failures, time.time()),
+        )
+
+
+def valid_http_date(value):
+    """Only keep Last-Modified values we can send back as If-Modified-Since."""
+    try:
+        return value if value and parsedate_to_datetime(value) else None
+    except (TypeError, ValueError):
+        return None
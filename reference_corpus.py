@@ -0,0 +1,396 @@
+import argparse
+import asyncio
+import fnmatch
+import glob
+import hashlib
+import json
+import logging
+import multiprocessing
+import os
+import tempfile
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from concurrent.futures import TimeoutError as FutureTimeout
+from os import environ
+
+import numpy as np
+
+import metrics
+from condense import PASSAGE_MAX_CHARS, split_passages
+
+REFERENCE_DIR = environ.get("REFERENCE_DIR", "archive/pdfs")
+REFERENCE_CORPUS_DIR = environ.get("REFERENCE_CORPUS_DIR", "reference_data")
+REFERENCE_WORKERS = int(environ.get("REFERENCE_WORKERS", str(os.cpu_count() or 1)))
+# Chunks embedded per call during ingestion
+REFERENCE_EMBED_BATCH = int(environ.get("REFERENCE_EMBED_BATCH", "256"))
+# Documents ingested between manifest writes, so an interrupted run keeps most of its work
+REFERENCE_PERSIST_EVERY = int(environ.get("REFERENCE_PERSIST_EVERY", "50"))
+# Prior coverage added to each assessment: documents returned, and their minimum cosine similarity.
+# Scores differ between embedding models, so retune REFERENCE_MIN_SCORE with EMBED_BACKEND.
+REFERENCE_TOP_K = int(environ.get("REFERENCE_TOP_K", "3"))
+REFERENCE_MIN_SCORE = float(environ.get("REFERENCE_MIN_SCORE", "0.5"))
+# Milliseconds an assessment waits for prior coverage before going on without it
+REFERENCE_TIMEOUT_MS = float(environ.get("REFERENCE_TIMEOUT_MS", "50"))
+REFERENCE_EXCERPT_CHARS = 300
+REFERENCE_THREADS = 2
+MANIFEST_FILE = "manifest.json"
+EXTENSIONS = (".pdf", ".html", ".htm")
+
+
+def read_pdf(path):
+    from pypdf import PdfReader
+    return "\n".join(page.extract_text() or "" for page in PdfReader(path).pages)
+
+
+def read_html(path):
+    from newspaper import Article
+    with open(path, errors="replace") as file:
+        article = Article(f"file://{os.path.abspath(path)}")
+        article.download(input_html=file.read())
+        article.parse()
+        return f"{article.title}\n\n{article.text}"
+
+
+def parse_document(path):
+    """Parse one PDF or HTML file into (path, title, text, parse seconds); runs in a worker process."""
+    start = time.perf_counter()
+    try:
+        text = read_pdf(path) if path.lower().endswith(".pdf") else read_html(path)
+    except Exception as e:
+        logging.warning(f"Skipping {path}: {e}")
+        text = ""
+    # read_html puts the headline first; PDFs are titled by their file name
+    title = os.path.splitext(os.path.basename(path))[0] if path.lower().endswith(".pdf") else text.strip().split("\n", 1)[0][:200]
+    return path, title, text, time.perf_counter() - start
+
+
+def chunk_text(text, max_chars=PASSAGE_MAX_CHARS):
+    """Join consecutive passages into chunks of up to max_chars; PDF text has a line break on every visual line."""
+    chunks, current = [], ""
+    for passage in split_passages(text, max_chars):
+        if current and len(current) + len(passage) + 1 > max_chars:
+            chunks.append(current)
+            current = passage
+        else:
+            current = f"{current}\n{passage}" if current else passage
+    if current:
+        chunks.append(current)
+    return chunks
+
+
+def file_hash(path):
+    digest = hashlib.sha256()
+    with open(path, "rb") as file:
+        for block in iter(lambda: file.read(1 << 20), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def find_documents(paths):
+    """PDF and HTML files under the given files, directories and glob patterns."""
+    found = set()
+    for pattern in paths:
+        for path in glob.glob(pattern) or [pattern]:
+            if os.path.isdir(path):
+                found.update(
+                    os.path.join(root, name) for root, _, names in os.walk(path)
+                    for name in names if name.lower().endswith(EXTENSIONS)
+                )
+            elif os.path.isfile(path) and path.lower().endswith(EXTENSIONS):
+                found.add(path)
+    return sorted(found)
+
+
+def under(path, root):
+    """Whether path is root, lies inside the directory root, or matches root as a glob pattern."""
+    root = root.rstrip(os.sep) or os.sep
+    return path == root or path.startswith(root if root == os.sep else root + os.sep) or fnmatch.fnmatch(path, root)
+
+
+def remove_document_file(corpus_dir, entry):
+    if entry["file"]:
+        try:
+            os.remove(os.path.join(corpus_dir, entry["file"]))
+        except OSError:
+            pass
+
+
+def document_file(path):
+    return f"doc-{hashlib.sha256(os.path.abspath(path).encode('utf-8')).hexdigest()[:24]}.npz"
+
+
+def read_manifest(corpus_dir):
+    try:
+        with open(os.path.join(corpus_dir, MANIFEST_FILE)) as file:
+            return json.load(file)
+    except (OSError, ValueError):
+        return {"version": 0, "embed_model": None, "documents": {}}
+
+
+def write_manifest(corpus_dir, manifest):
+    """Atomically replace the manifest, bumping its version."""
+    manifest["version"] += 1
+    with tempfile.NamedTemporaryFile("w", dir=corpus_dir, suffix=".tmp", delete=False) as file:
+        json.dump(manifest, file)
+    os.replace(file.name, os.path.join(corpus_dir, MANIFEST_FILE))
+
+
+def ingest(paths, corpus_dir=REFERENCE_CORPUS_DIR, embed_model=None, workers=REFERENCE_WORKERS, batch_size=REFERENCE_EMBED_BATCH,
+           persist_every=REFERENCE_PERSIST_EVERY) -> dict:
+    """Parse, chunk and embed new or changed documents into the reference corpus.
+
+    Files whose content hash is already in the manifest are skipped without
+    parsing. Parsing runs on a process pool while the parent chunks the
+    parsed text and embeds chunks in batches that span documents; each
+    document's chunks and vectors are saved as soon as they are embedded,
+    and the manifest is rewritten every persist_every documents. Documents
+    under the given paths that no longer exist are dropped.
+    """
+    if embed_model is None:
+        from embeddings import get_embed_model
+        embed_model = get_embed_model()
+    os.makedirs(corpus_dir, exist_ok=True)
+    manifest = read_manifest(corpus_dir)
+    model_changed = bool(manifest["documents"]) and manifest["embed_model"] != embed_model.model_name
+    if model_changed:
+        logging.warning(f"Reference corpus was embedded with {manifest['embed_model']}, re-embedding with {embed_model.model_name}")
+        for entry in manifest["documents"].values():
+            remove_document_file(corpus_dir, entry)
+        manifest["documents"] = {}
+    manifest["embed_model"] = embed_model.model_name
+    documents = manifest["documents"]
+    start = time.perf_counter()
+    stats = {"documents": 0, "skipped": 0, "removed": 0, "empty": 0, "chunks": 0, "parse_s": 0.0, "embed_s": 0.0}
+
+    found = find_documents(paths)
+    roots = [os.path.abspath(path) for path in paths]
+    for path in [path for path in documents if not os.path.exists(path) and any(under(path, root) for root in roots)]:
+        remove_document_file(corpus_dir, documents.pop(path))
+        stats["removed"] += 1
+    hashes = {os.path.abspath(path): file_hash(path) for path in found}
+    todo = [path for path, digest in hashes.items() if documents.get(path, {}).get("hash") != digest]
+    stats["skipped"] = len(hashes) - len(todo)
+
+    pending, chunks, unsaved = [], [], 0
+
+    def embed_pending():
+        nonlocal pending, chunks, unsaved
+        if not chunks:
+            return
+        embed_start = time.perf_counter()
+        vectors = np.asarray(embed_model.get_text_embedding_batch(chunks), dtype=np.float32)
+        stats["embed_s"] += time.perf_counter() - embed_start
+        offset = 0
+        for path, title, passages in pending:
+            doc_vectors = vectors[offset:offset + len(passages)]
+            offset += len(passages)
+            name = document_file(path)
+            with tempfile.NamedTemporaryFile(dir=corpus_dir, suffix=".tmp", delete=False) as file:
+                np.savez(file, vectors=doc_vectors, chunks=np.array(passages))
+            os.replace(file.name, os.path.join(corpus_dir, name))
+            documents[path] = {"hash": hashes[path], "title": title, "chunks": len(passages), "file": name}
+            stats["documents"] += 1
+            stats["chunks"] += len(passages)
+            unsaved += 1
+        pending, chunks = [], []
+        if unsaved >= persist_every:
+            write_manifest(corpus_dir, manifest)
+            unsaved = 0
+
+    if todo:
+        workers = max(1, workers)
+        with ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("spawn")) as pool:
+            for path, title, text, parse_s in pool.map(parse_document, todo, chunksize=max(1, len(todo) // (workers * 8))):
+                stats["parse_s"] += parse_s
+                passages = chunk_text(text)
+                if not passages:
+                    # Recorded without a file, so unreadable documents are not parsed again until they change
+                    documents[path] = {"hash": hashes[path], "title": title, "chunks": 0, "file": None}
+                    stats["empty"] += 1
+                    continue
+                pending.append((path, title, passages))
+                chunks += passages
+                if len(chunks) >= batch_size:
+                    embed_pending()
+        embed_pending()
+    if todo or stats["removed"] or model_changed:
+        write_manifest(corpus_dir, manifest)
+    elapsed = time.perf_counter() - start
+    stats.update(
+        workers=workers, elapsed_s=round(elapsed, 2), parse_s=round(stats["parse_s"], 2), embed_s=round(stats["embed_s"], 2),
+        docs_per_s=round(stats["documents"] / elapsed, 2) if elapsed else None, version=manifest["version"],
+    )
+    logging.info(f"Ingested reference corpus into {corpus_dir}: {stats}")
+    return stats
+
+
+class ReferenceCorpus:
+    """Earlier coverage searched by article embedding, to give assessments the history of an incident.
+
+    All chunk vectors are held in one unit-normalized matrix and searched
+    exactly. Searches run on a small thread pool so callers can stop
+    waiting after REFERENCE_TIMEOUT_MS; the corpus is reloaded in the
+    background of a search when ingestion has written a new manifest.
+    """
+
+    def __init__(self, corpus_dir=REFERENCE_CORPUS_DIR, embed_model_name=None, top_k=REFERENCE_TOP_K, min_score=REFERENCE_MIN_SCORE,
+                 timeout_ms=REFERENCE_TIMEOUT_MS):
+        self.corpus_dir = corpus_dir
+        self.embed_model_name = embed_model_name
+        self.top_k = top_k
+        self.min_score = min_score
+        self.timeout = timeout_ms / 1000
+        self.version = 0
+        self.mtime = None
+        self.matrix = np.zeros((0, 0), dtype=np.float32)
+        self.chunk_docs = np.zeros(0, dtype=np.int32)
+        self.chunks, self.docs = [], []
+        self.reload_lock = threading.Lock()
+        self.executor = ThreadPoolExecutor(max_workers=REFERENCE_THREADS, thread_name_prefix="reference")
+        # Searches abandoned at the deadline still finish; beyond this many in flight, new ones are not started
+        self.in_flight = threading.BoundedSemaphore(REFERENCE_THREADS * 2)
+        self._reload()
+
+    def after_fork(self):
+        """Fresh search threads in a forked child, which keeps the loaded matrix."""
+        self.reload_lock = threading.Lock()
+        self.executor = ThreadPoolExecutor(max_workers=REFERENCE_THREADS, thread_name_prefix="reference")
+        self.in_flight = threading.BoundedSemaphore(REFERENCE_THREADS * 2)
+
+    def _manifest_mtime(self):
+        try:
+            return os.stat(os.path.join(self.corpus_dir, MANIFEST_FILE)).st_mtime_ns
+        except OSError:
+            return None
+
+    def _reload(self):
+        mtime = self._manifest_mtime()
+        if mtime == self.mtime:
+            return
+        manifest = read_manifest(self.corpus_dir)
+        if manifest["documents"] and self.embed_model_name and manifest["embed_model"] != self.embed_model_name:
+            logging.warning(f"Ignoring reference corpus embedded with {manifest['embed_model']}, assessments use {self.embed_model_name}")
+            self.mtime = mtime
+            return
+        vectors, chunk_docs, chunks, docs = [], [], [], []
+        for path, entry in manifest["documents"].items():
+            if not entry["file"]:
+                continue
+            try:
+                with np.load(os.path.join(self.corpus_dir, entry["file"])) as data:
+                    vectors.append(data["vectors"])
+                    chunks += data["chunks"].tolist()
+            except (OSError, KeyError, ValueError) as e:
+                logging.warning(f"Skipping reference document {path}: {e}")
+                continue
+            chunk_docs.append(np.full(len(vectors[-1]), len(docs), dtype=np.int32))
+            docs.append({"title": entry["title"], "path": path})
+        matrix = np.concatenate(vectors) if vectors else np.zeros((0, 0), dtype=np.float32)
+        norms = np.linalg.norm(matrix, axis=1, keepdims=True) if len(matrix) else None
+        # Swap everything in at once; searches in flight keep the arrays they started with
+        self.matrix, self.chunks, self.docs = (matrix / np.where(norms == 0, 1, norms) if norms is not None else matrix), chunks, docs
+        self.chunk_docs = np.concatenate(chunk_docs) if chunk_docs else np.zeros(0, dtype=np.int32)
+        self.version, self.mtime = manifest["version"], mtime
+        logging.info(f"Loaded reference corpus version {self.version}: {len(docs)} documents, {len(chunks)} chunks")
+
+    def _maybe_reload(self):
+        if self._manifest_mtime() != self.mtime and self.reload_lock.acquire(blocking=False):
+            try:
+                self._reload()
+            finally:
+                self.reload_lock.release()
+
+    def search(self, embedding, article_text=None, k=None):
+        """Best-matching chunk of each of the k most similar documents, above min_score.
+
+        Documents containing a matched chunk of article_text word for word
+        are the article itself, not prior coverage of it, and are skipped.
+        """
+        self._maybe_reload()
+        matrix, chunk_docs, chunks, docs = self.matrix, self.chunk_docs, self.chunks, self.docs
+        if not len(matrix):
+            return []
+        query = np.asarray(embedding, dtype=np.float32)
+        if query.shape[0] != matrix.shape[1]:
+            return []
+        scores = matrix @ (query / (np.linalg.norm(query) or 1.0))
+        article = " ".join(article_text.split()) if article_text else None
+        k = k or self.top_k
+        references, seen = [], set()
+        # More chunks than documents wanted, since several chunks can come from one document
+        candidates = np.flatnonzero(scores >= self.min_score)
+        for i in candidates[np.argsort(-scores[candidates])][:k * 20]:
+            doc = int(chunk_docs[i])
+            if doc in seen:
+                continue
+            seen.add(doc)
+            if article and " ".join(chunks[i].split()) in article:
+                continue
+            references.append({**docs[doc], "score": round(float(scores[i]), 4), "excerpt": " ".join(chunks[i].split())[:REFERENCE_EXCERPT_CHARS]})
+            if len(references) == k:
+                break
+        return references
+
+    def submit(self, embedding, article_text=None):
+        """Start a search for the caller to collect later, so it overlaps with other work.
+
+        Returns None without searching when earlier searches are still
+        running, so a corpus too slow for the deadline sheds load rather
+        than queueing work nobody waits for.
+        """
+        if not self.in_flight.acquire(blocking=False):
+            metrics.errors.inc(stage="references_skipped")
+            return None
+        future = self.executor.submit(self.search, embedding, article_text)
+        future.add_done_callback(lambda _: self.in_flight.release())
+        return future
+
+    def collect(self, future, timings=None):
+        """The references a submitted search found, or none if it misses the deadline."""
+        start = time.perf_counter()
+        try:
+            return future.result(timeout=self.timeout)
+        except FutureTimeout:
+            future.cancel()
+            logging.warning(f"Prior coverage search exceeded {self.timeout * 1000:.0f}ms, assessing without it")
+            metrics.errors.inc(stage="references_timeout")
+            return []
+        except Exception as e:
+            logging.error(f"Prior coverage search failed: {e}")
+            metrics.errors.inc(stage="references")
+            return []
+        finally:
+            if timings is not None:
+                timings["references_ms"] = round((time.perf_counter() - start) * 1000, 1)
+
+    async def acollect(self, future, timings=None):
+        start = time.perf_counter()
+        try:
+            return await asyncio.wait_for(asyncio.wrap_future(future), self.timeout)
+        except asyncio.TimeoutError:
+            logging.warning(f"Prior coverage search exceeded {self.timeout * 1000:.0f}ms, assessing without it")
+            metrics.errors.inc(stage="references_timeout")
+            return []
+        except Exception as e:
+            logging.error(f"Prior coverage search failed: {e}")
+            metrics.errors.inc(stage="references")
+            return []
+        finally:
+            if timings is not None:
+                timings["references_ms"] = round((time.perf_counter() - start) * 1000, 1)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Ingest PDF and HTML reference documents into the prior-coverage corpus.")
+    parser.add_argument("paths", nargs="*", default=[REFERENCE_DIR], help="Files, directories or glob patterns.")
+    parser.add_argument("--corpus", default=REFERENCE_CORPUS_DIR)
+    parser.add_argument("--workers", type=int, default=REFERENCE_WORKERS, help="Parser processes.")
+    parser.add_argument("--batch-size", type=int, default=REFERENCE_EMBED_BATCH, help="Chunks per embedding call.")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO)
+    print(json.dumps(ingest(args.paths, corpus_dir=args.corpus, workers=args.workers, batch_size=args.batch_size), indent=2))
+
+
+if __name__ == "__main__":
+    main()
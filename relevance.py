@@ -0,0 +1,136 @@
+import logging
+from os import environ
+
+import numpy as np
+from llama_index.core import Settings
+
+from router import ArticleRouter
+
+RELEVANCE_THRESHOLD = float(environ.get("RELEVANCE_THRESHOLD", "0.8"))
+GATE_MAX_CHARS = int(environ.get("RELEVANCE_GATE_MAX_CHARS", "6000"))
+GATE_TOP_SCORES = 5
+# Most monitors whose embeddings guide condensation
+GATE_MATCH_LIMIT = 50
+
+
+def normalize_rows(matrix):
+    """Scale each row of a matrix to unit length, leaving zero rows untouched."""
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return matrix / norms
+
+
+class MatrixSearch:
+    """Exact search over a matrix of unit-normalized monitor embeddings, one row per monitor."""
+
+    def __init__(self, rows, matrix, normalized=False):
+        self.monitor_rows = rows
+        matrix = np.asarray(matrix, dtype=np.float32)
+        if not len(rows):
+            matrix = np.zeros((0, 0), dtype=np.float32)
+        elif not normalized:
+            matrix = normalize_rows(matrix)
+        self.matrix = matrix
+        members = {}
+        for i, row in enumerate(rows):
+            members.setdefault(row["company"].lower(), []).append(i)
+        self.members = {company: np.array(ids, dtype=np.int64) for company, ids in members.items()}
+
+    def __len__(self):
+        return len(self.monitor_rows)
+
+    def search(self, query, k, companies=None):
+        """Top-k (row indices, cosine scores) for a unit-normalized query vector, optionally within some companies."""
+        empty = np.zeros(0, dtype=np.int64)
+        if not self.monitor_rows:
+            return empty, np.zeros(0, dtype=np.float32)
+        query = np.asarray(query, dtype=np.float32)
+        if companies is None:
+            ids, scores = np.arange(len(self.monitor_rows)), self.matrix @ query
+        else:
+            ids = np.concatenate([empty] + [self.members.get(company.lower(), empty) for company in companies])
+            scores = self.matrix[ids] @ query
+        top = np.argsort(-scores, kind="stable")[:k]
+        return ids[top], scores[top]
+
+    def rows(self, ids):
+        return [self.monitor_rows[i] for i in ids]
+
+    def get_vectors(self, ids):
+        return self.matrix[np.asarray(ids, dtype=np.int64)]
+
+    def entities(self):
+        return self.monitor_rows
+
+    def find(self, names, limit):
+        names = set(names)
+        return [
+            i for i, row in enumerate(self.monitor_rows)
+            if row["monitor"].lower() in names or row["company"].lower() in names
+        ][:limit]
+
+
+class RelevanceGate:
+    """Cheap pre-filter that decides whether an article is worth sending to the LLM.
+
+    The article is embedded once and its nearest monitors are looked up in
+    a monitor search: MatrixSearch scores every monitor in one matrix
+    product, an IVFStore only probes the closest inverted lists. Any monitor
+    or company name appearing verbatim in the article passes the gate
+    regardless of score.
+
+    Articles that name monitors, companies or their aliases are routed to
+    those companies: only their monitors are scored and retrieved. Articles
+    naming none are scored against every monitor.
+    """
+
+    def __init__(self, search, embed_model=None, threshold=RELEVANCE_THRESHOLD, aliases=(), router=None):
+        self.search = search
+        self.embed_model = embed_model or Settings.embed_model
+        self.threshold = threshold
+        # A previous gate's router is updated with just the monitors that changed since it was built
+        self.router = router.updated(search.entities(), aliases) if router is not None else ArticleRouter(search.entities(), aliases)
+
+    def nearest(self, embedding, k, companies=None):
+        """The k monitors closest to an article embedding, as (ids, cosine scores)."""
+        query = np.asarray(embedding, dtype=np.float32)
+        return self.search.search(query / (np.linalg.norm(query) or 1.0), k, companies=companies or None)
+
+    def embed(self, article_text):
+        return self.embed_model.get_text_embedding(article_text[:GATE_MAX_CHARS])
+
+    async def aembed(self, article_text):
+        return await self.embed_model.aget_text_embedding(article_text[:GATE_MAX_CHARS])
+
+    def check(self, article_text, threshold=None, embedding=None):
+        """Score an article against the monitors and report whether it passes the gate."""
+        threshold = self.threshold if threshold is None else float(threshold)
+        exact, companies = self.router.route(article_text)
+        ids, scores = self.nearest(self.embed(article_text) if embedding is None else embedding, GATE_TOP_SCORES, companies)
+        return {**self._decision(exact, ids, scores, threshold), "companies": companies}
+
+    def matched_vectors(self, gate, embedding, threshold=None, fallback=3):
+        """Embeddings of the monitors an article matched, or of its closest ones if none did, given its check() result."""
+        threshold = self.threshold if threshold is None else float(threshold)
+        companies = gate["companies"]
+        ids, scores = self.nearest(embedding, GATE_MATCH_LIMIT, companies)
+        matched = [int(i) for i in ids[scores >= threshold]]
+        matched += self.search.find(gate["exact_matches"] + [company.lower() for company in companies], GATE_MATCH_LIMIT)
+        if not matched:
+            matched = [int(i) for i in ids[:fallback]]
+        return self.search.get_vectors(sorted(set(matched)))
+
+    def _decision(self, exact, ids, scores, threshold):
+        max_score = float(scores[0]) if len(scores) else 0.0
+        passed = bool(exact) or max_score >= threshold
+        logging.info(f"Relevance gate {'passed' if passed else 'rejected'} (max score {max_score:.3f}, exact {exact})")
+        return {
+            "passed": passed,
+            "threshold": threshold,
+            "max_score": round(max_score, 4),
+            "exact_matches": exact,
+            "scores": [
+                {"monitor": row["monitor"], "company": row["company"], "score": round(float(score), 4)}
+                for row, score in zip(self.search.rows(ids), scores) if row is not None
+            ],
+        }
@@ -0,0 +1,180 @@
+import copy
+import csv
+import logging
+import os
+import re
+from collections import Counter, deque
+
+# Extra names that route an article to a company, as alias,company rows (e.g. "Galaxy Note, Samsung")
+ALIASES_CSV = os.environ.get("MONITOR_ALIASES_CSV", "monitors/aliases.csv")
+WORD = re.compile(r"\w+")
+
+
+def words(text):
+    return WORD.findall(text.lower())
+
+
+def read_aliases(path=ALIASES_CSV):
+    """Read aliases.csv into (alias, company) pairs; a missing file means no aliases."""
+    if not path or not os.path.exists(path):
+        return []
+    aliases = []
+    with open(path, newline="") as file:
+        for row in csv.DictReader(file, skipinitialspace=True):
+            row = {(key or "").strip(): (value or "").strip() for key, value in row.items()}
+            if row.get("alias") and row.get("company"):
+                aliases.append((row["alias"], row["company"]))
+    return aliases
+
+
+class EntityMatcher:
+    """Aho-Corasick automaton over whole words, matching many names in one pass over a text.
+
+    Patterns are lower-cased word sequences, so matches always fall on word
+    boundaries. States are dicts from word to next state; scanning follows
+    one transition per word plus failure links, which keeps it linear in
+    the length of the article however many patterns there are.
+    """
+
+    def __init__(self, patterns):
+        self.goto = [{}]
+        self.fail = [0]
+        self.out = {}
+        for pattern, value in patterns:
+            state = 0
+            for word in words(pattern):
+                next_state = self.goto[state].get(word)
+                if next_state is None:
+                    next_state = len(self.goto)
+                    self.goto[state][word] = next_state
+                    self.goto.append({})
+                    self.fail.append(0)
+                state = next_state
+            if state:
+                self.out.setdefault(state, set()).add(value)
+        self._link()
+
+    def _link(self):
+        """Fill in failure links breadth-first, merging the outputs of each state's suffixes."""
+        queue = deque(self.goto[0].values())
+        while queue:
+            state = queue.popleft()
+            for word, next_state in self.goto[state].items():
+                queue.append(next_state)
+                fallback = self.fail[state]
+                while fallback and word not in self.goto[fallback]:
+                    fallback = self.fail[fallback]
+                target = self.goto[fallback].get(word, 0)
+                self.fail[next_state] = target if target != next_state else 0
+                if self.fail[next_state] in self.out:
+                    self.out[next_state] = self.out.get(next_state, set()) | self.out[self.fail[next_state]]
+
+    def __len__(self):
+        return len(self.goto)
+
+    def scan(self, text):
+        """Values of every pattern occurring in text."""
+        goto, fail, out = self.goto, self.fail, self.out
+        hits = set()
+        state = 0
+        for word in words(text):
+            while state and word not in goto[state]:
+                state = fail[state]
+            state = goto[state].get(word, 0)
+            if state in out:
+                hits.add(state)
+        return set().union(*(out[state] for state in hits))
+
+
+class ArticleRouter:
+    """Finds the monitors, companies and aliases an article names and the company shards it belongs to.
+
+    Monitor names route to their monitor's company, company names to
+    themselves and aliases to the company they stand for. Companies are
+    reported as spelled in monitors.csv so they can be used as filters.
+
+    The automaton matches names; what each name routes to is looked up
+    afterwards, so updated() can reuse it for a changed monitor set. Names
+    it does not know go into a small overlay automaton until there are
+    enough changes to rebuild the main one.
+    """
+
+    def __init__(self, rows, aliases=()):
+        self.aliases = list(aliases)
+        self.entities = {(row["monitor"], row["company"]) for row in rows}
+        self.companies = Counter()
+        self.targets = {}
+        for monitor, company in self.entities:
+            self._add_entity(monitor, company)
+        known = {company.lower() for company in self.companies}
+        for alias, company in self.aliases:
+            if company.lower() not in known:
+                logging.warning(f"Ignoring alias {alias!r} of unknown company {company!r}")
+        self._rebuild()
+
+    def _change(self, name, target, delta):
+        """Count a name's route to target up or down, returning the name's key in the automaton."""
+        key = " ".join(words(name))
+        # Copied before changing, since routers made by updated() share the counts of unchanged names
+        counts = dict(self.targets.get(key, {}))
+        counts[target] = counts.get(target, 0) + delta
+        if counts[target] <= 0:
+            del counts[target]
+        self.targets[key] = counts
+        return key
+
+    def _add_entity(self, monitor, company, delta=1):
+        keys = [self._change(monitor, (monitor.lower(), company), delta)]
+        if company:
+            keys.append(self._change(company, (company.lower(), company), delta))
+            self.companies[company] += delta
+            # A company's aliases route to it while it has monitors
+            if self.companies[company] == (1 if delta > 0 else 0):
+                for alias, alias_company in self.aliases:
+                    if alias_company.lower() == company.lower():
+                        keys.append(self._change(alias, (alias.lower(), company), delta))
+            if not self.companies[company]:
+                del self.companies[company]
+        return keys
+
+    def _rebuild(self):
+        names = [key for key, counts in self.targets.items() if counts]
+        self.matcher = EntityMatcher((key, key) for key in names)
+        self.known = frozenset(names)
+        self.overlay, self.overlay_keys, self.changes = None, frozenset(), 0
+
+    def updated(self, rows, aliases=()):
+        """A router for a changed monitor set that shares this one's automaton.
+
+        Only the monitors added or removed since this router are applied; the
+        main automaton is rebuilt once the changes reach a quarter of its names.
+        """
+        if list(aliases) != self.aliases:
+            return ArticleRouter(rows, aliases)
+        entities = {(row["monitor"], row["company"]) for row in rows}
+        router = copy.copy(self)
+        router.entities = entities
+        router.companies = Counter(self.companies)
+        router.targets = dict(self.targets)
+        for monitor, company in self.entities - entities:
+            router._add_entity(monitor, company, -1)
+        new_keys = set()
+        for monitor, company in entities - self.entities:
+            new_keys.update(router._add_entity(monitor, company))
+        router.changes = self.changes + len(self.entities ^ entities)
+        if router.changes > max(1000, len(self.known) // 4):
+            router._rebuild()
+            return router
+        new_keys -= self.known | self.overlay_keys
+        if new_keys:
+            router.overlay_keys = self.overlay_keys | new_keys
+            router.overlay = EntityMatcher((key, key) for key in router.overlay_keys)
+        return router
+
+    def route(self, article_text):
+        """Return (sorted matched names, sorted companies to route to)."""
+        keys = self.matcher.scan(article_text)
+        if self.overlay is not None:
+            keys |= self.overlay.scan(article_text)
+        found = set().union(*(self.targets.get(key, {}) for key in keys))
+        return sorted({name for name, _ in found}), sorted({company for _, company in found if company})
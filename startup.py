@@ -0,0 +1,83 @@
+import logging
+import threading
+import time
+
+
+class NotReady(Exception):
+    pass
+
+
+class AgentLoader:
+    """Builds the agent in a background thread so the server can bind and answer probes meanwhile.
+
+    build receives a dict to record its own timings in and returns the agent.
+    """
+
+    def __init__(self, build):
+        self.build = build
+        self.agent = None
+        self.error = None
+        self.timings = {}
+        self.ready = threading.Event()
+        self.thread = None
+        self.lock = threading.Lock()
+
+    def start(self):
+        with self.lock:
+            # A loader thread that died without finishing, as after a fork, is started again
+            if not self.ready.is_set() and (self.thread is None or not self.thread.is_alive()):
+                self.thread = threading.Thread(target=self._run, name="agent-loader", daemon=True)
+                self.thread.start()
+        return self
+
+    def before_fork(self):
+        """Wait for a load in progress, so forked children inherit the agent instead of each building one."""
+        thread = self.thread
+        if thread is not None and thread is not threading.current_thread():
+            thread.join()
+
+    def after_fork(self):
+        """Keep the parent's agent in a forked child, reopening its per-process resources with agent.after_fork().
+
+        A child forked while the agent was still loading, or after it failed to load, builds its own.
+        """
+        self.lock = threading.Lock()
+        self.ready = threading.Event()
+        self.thread = None
+        if self.agent is not None:
+            try:
+                self.agent.after_fork()
+                self.ready.set()
+                return self
+            except Exception as e:
+                logging.exception(f"Could not reuse the agent after fork, building a new one: {e}")
+        self.agent, self.error, self.timings = None, None, {}
+        return self.start()
+
+    def _run(self):
+        start = time.perf_counter()
+        try:
+            self.agent = self.build(self.timings)
+            logging.info(f"Agent ready after {time.perf_counter() - start:.2f}s {self.timings}")
+        except Exception as e:
+            logging.exception(f"Agent failed to load: {e}")
+            self.error = str(e)
+        self.timings["ready_s"] = round(time.perf_counter() - start, 3)
+        self.ready.set()
+
+    def get(self, timeout=0):
+        """Return the agent, raising NotReady if it is not built within timeout seconds (None waits)."""
+        self.start()
+        if not self.ready.wait(timeout):
+            raise NotReady("Agent is still loading")
+        if self.agent is None:
+            raise NotReady(f"Agent failed to load: {self.error}")
+        return self.agent
+
+    def status(self) -> dict:
+        return {
+            "ready": self.agent is not None,
+            "loading": self.thread is not None and self.thread.is_alive() and not self.ready.is_set(),
+            "error": self.error,
+            "timings": dict(self.timings),
+        }
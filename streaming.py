@@ -0,0 +1,50 @@
+import json
+
+
+class VerdictStreamParser:
+    """Incrementally extracts per-monitor verdict objects from a streamed JSON response.
+
+    Chunks are scanned once, tracking string and escape state, so every
+    complete {...} object containing a 'monitor' key is returned as soon as
+    its closing brace arrives, whether the verdicts are a bare list or are
+    wrapped in {"monitors": [...]}.
+    """
+
+    def __init__(self):
+        self.buffer = []
+        self.length = 0
+        self.starts = []
+        self.in_string = False
+        self.escaped = False
+
+    def feed(self, chunk) -> list:
+        verdicts = []
+        for char in chunk:
+            self.buffer.append(char)
+            position = self.length
+            self.length += 1
+            if self.in_string:
+                if self.escaped:
+                    self.escaped = False
+                elif char == "\\":
+                    self.escaped = True
+                elif char == '"':
+                    self.in_string = False
+            elif char == '"':
+                self.in_string = True
+            elif char == "{":
+                self.starts.append(position)
+            elif char == "}" and self.starts:
+                start = self.starts.pop()
+                try:
+                    candidate = json.loads("".join(self.buffer[start:]))
+                except json.JSONDecodeError:
+                    continue
+                if isinstance(candidate, dict) and "monitor" in candidate:
+                    verdicts.append(candidate)
+        return verdicts
+
+
+def sse(event, data) -> str:
+    """Format one Server-Sent Events message."""
+    return f"event: {event}\ndata: {json.dumps(data, default=str)}\n\n"
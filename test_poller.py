@@ -0,0 +1,137 @@
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+from poller import FeedPoller
+
+RSS = """<?xml version="1.0"?>
+<rss version="2.0"><channel><title>News</title>
+{items}
+</channel></rss>"""
+
+ATOM = """<?xml version="1.0"?>
+<feed xmlns="http://www.w3.org/2005/Atom"><title>News</title>
+<entry><title>One</title><link rel="alternate" href="https://news.example.com/atom-1"/></entry>
+<entry><title>Two</title><link rel="self" href="https://news.example.com/self"/><link href="https://news.example.com/atom-2"/></entry>
+</feed>"""
+
+SITEMAP_INDEX = """<?xml version="1.0"?>
+<sitemapindex xmlns="http://www.sitemaps.org/schemas/sitemap/0.9">
+<sitemap><loc>{base}/sitemap-1.xml</loc></sitemap>
+</sitemapindex>"""
+
+SITEMAP = """<?xml version="1.0"?>
+<urlset xmlns="http://www.sitemaps.org/schemas/sitemap/0.9">
+<url><loc>https://news.example.com/sitemap-1</loc></url>
+<url><loc>https://news.example.com/sitemap-2</loc></url>
+</urlset>"""
+
+
+class FeedServer:
+    """Serves feed documents with ETags and answers matching If-None-Match with a 304."""
+
+    def __init__(self):
+        self.documents = {}
+        self.requests = []
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                server.requests.append((self.path, self.headers.get("If-None-Match")))
+                if self.path not in server.documents:
+                    self.send_error(404)
+                    return
+                etag, body = server.documents[self.path]
+                if self.headers.get("If-None-Match") == etag:
+                    self.send_response(304)
+                    self.end_headers()
+                    return
+                body = body.encode()
+                self.send_response(200)
+                self.send_header("Content-Type", "application/xml")
+                self.send_header("Content-Length", str(len(body)))
+                self.send_header("ETag", etag)
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        self.httpd = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.base = f"http://127.0.0.1:{self.httpd.server_port}"
+        threading.Thread(target=self.httpd.serve_forever, daemon=True).start()
+
+    def serve(self, path, body, etag):
+        self.documents[path] = (f'"{etag}"', body)
+
+    def url(self, path):
+        return self.base + path
+
+    def close(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+
+def rss(*links):
+    return RSS.format(items="".join(f"<item><link>{link}</link></item>" for link in links))
+
+
+@pytest.fixture
+def server():
+    server = FeedServer()
+    yield server
+    server.close()
+
+
+@pytest.fixture
+def make_poller(tmp_path):
+    def make(sources, sink):
+        return FeedPoller(sink, sources=[{"url": url, "interval": 60} for url in sources], state_path=str(tmp_path / "state.db"), workers=2)
+    return make
+
+
+def test_conditional_get_and_seen_set(server, make_poller):
+    server.serve("/rss.xml", rss("https://news.example.com/a", "https://news.example.com/b"), "v1")
+    delivered = []
+    poller = make_poller([server.url("/rss.xml")], lambda item, feed: delivered.append((item, feed)))
+    url = server.url("/rss.xml")
+
+    assert poller.poll_once(url) == ["https://news.example.com/a", "https://news.example.com/b"]
+    # Unchanged feed: the stored ETag is sent back and the 304 yields nothing
+    assert poller.poll_once(url) == []
+    assert server.requests[-1] == ("/rss.xml", '"v1"')
+
+    # A changed feed only delivers items not already in the seen-set, including tracking variants
+    server.serve("/rss.xml", rss("https://www.news.example.com/a?utm_source=feed", "https://news.example.com/c"), "v2")
+    assert poller.poll_once(url) == ["https://news.example.com/c"]
+    assert delivered == [(item, url) for item in ["https://news.example.com/a", "https://news.example.com/b", "https://news.example.com/c"]]
+
+
+def test_atom_and_sitemap_index(server, make_poller):
+    server.serve("/atom.xml", ATOM, "a1")
+    server.serve("/sitemap_index.xml", SITEMAP_INDEX.format(base=server.base), "s1")
+    server.serve("/sitemap-1.xml", SITEMAP, "s2")
+    poller = make_poller([server.url("/atom.xml"), server.url("/sitemap_index.xml")], lambda item, feed: True)
+
+    assert poller.poll_once(server.url("/atom.xml")) == ["https://news.example.com/atom-1", "https://news.example.com/atom-2"]
+    # The index has no items of its own; its child sitemaps become sources
+    assert poller.poll_once(server.url("/sitemap_index.xml")) == []
+    assert server.url("/sitemap-1.xml") in poller.sources
+    assert poller.poll_once(server.url("/sitemap-1.xml")) == ["https://news.example.com/sitemap-1", "https://news.example.com/sitemap-2"]
+
+
+def test_rejected_items_are_retried(server, make_poller):
+    server.serve("/rss.xml", rss("https://news.example.com/a", "https://news.example.com/b"), "v1")
+    rejected = {"https://news.example.com/b"}
+    poller = make_poller([server.url("/rss.xml")], lambda item, feed: item not in rejected)
+    url = server.url("/rss.xml")
+
+    assert poller.poll_once(url) == ["https://news.example.com/a"]
+    # The validators were not saved, so the next poll refetches the feed instead of getting a 304
+    rejected.clear()
+    assert poller.poll_once(url) == ["https://news.example.com/b"]
+    assert server.requests[-1] == ("/rss.xml", None)
+    # Once everything is accepted the ETag is kept
+    assert poller.poll_once(url) == []
+    assert server.requests[-1] == ("/rss.xml", '"v1"')
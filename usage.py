@@ -0,0 +1,127 @@
+import contextvars
+import time
+from contextlib import contextmanager
+
+from llama_index.core.callbacks import CBEventType, TokenCountingHandler
+from llama_index.core.callbacks.base_handler import BaseCallbackHandler
+
+from metrics import llm_turn_latency
+
+_current_counter = contextvars.ContextVar("token_counter", default=None)
+_current_timings = contextvars.ContextVar("timings", default=None)
+
+
+class RequestTokenCounter(BaseCallbackHandler):
+    """Callback handler that forwards LLM events to the token counter of the current request.
+
+    The LLM and its callback manager are shared by every request, so the
+    per-request TokenCountingHandler is looked up from a context variable
+    instead of being attached to the LLM.
+    """
+
+    def __init__(self):
+        super().__init__(event_starts_to_ignore=[], event_ends_to_ignore=[])
+
+    def on_event_start(self, event_type, payload=None, event_id="", parent_id="", **kwargs):
+        counter = _current_counter.get()
+        if counter is not None:
+            counter.on_event_start(event_type, payload, event_id=event_id, parent_id=parent_id, **kwargs)
+        return event_id
+
+    def on_event_end(self, event_type, payload=None, event_id="", **kwargs):
+        counter = _current_counter.get()
+        if counter is not None:
+            counter.on_event_end(event_type, payload, event_id=event_id, **kwargs)
+
+    def start_trace(self, trace_id=None):
+        pass
+
+    def end_trace(self, trace_id=None, trace_map=None):
+        pass
+
+
+class LLMTurnTimer(BaseCallbackHandler):
+    """Callback handler timing every LLM call, including each turn of the ReAct loop."""
+
+    def __init__(self):
+        super().__init__(event_starts_to_ignore=[], event_ends_to_ignore=[])
+        self.started = {}
+
+    def on_event_start(self, event_type, payload=None, event_id="", parent_id="", **kwargs):
+        if event_type == CBEventType.LLM:
+            self.started[event_id] = time.perf_counter()
+        return event_id
+
+    def on_event_end(self, event_type, payload=None, event_id="", **kwargs):
+        start = self.started.pop(event_id, None)
+        if start is not None:
+            llm_turn_latency.observe(time.perf_counter() - start)
+
+    def start_trace(self, trace_id=None):
+        pass
+
+    def end_trace(self, trace_id=None, trace_map=None):
+        pass
+
+
+@contextmanager
+def count_tokens():
+    """Count the LLM tokens used by the current request (thread or asyncio task)."""
+    counter = TokenCountingHandler()
+    token = _current_counter.set(counter)
+    try:
+        yield counter
+    finally:
+        _current_counter.reset(token)
+
+
+@contextmanager
+def timed(timings, stage):
+    """Record the wall time of a block in timings as '<stage>_ms'."""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        timings[f"{stage}_ms"] = round((time.perf_counter() - start) * 1000, 1)
+
+
+@contextmanager
+def request_timings(timings):
+    """Make timings the current request's, for stages timed deep inside LlamaIndex (see timed_stage)."""
+    token = _current_timings.set(timings)
+    try:
+        yield timings
+    finally:
+        _current_timings.reset(token)
+
+
+@contextmanager
+def timed_stage(stage):
+    """Add the wall time of a block to the current request's '<stage>_ms', summing repeated calls."""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        timings = _current_timings.get()
+        if timings is not None:
+            key = f"{stage}_ms"
+            timings[key] = round(timings.get(key, 0) + (time.perf_counter() - start) * 1000, 1)
+
+
+def counter_usage(counter) -> dict:
+    return {
+        "turns": len(counter.llm_token_counts),
+        "prompt_tokens": counter.prompt_llm_token_count,
+        "completion_tokens": counter.completion_llm_token_count,
+        "total_tokens": counter.total_llm_token_count,
+    }
+
+
+def usage_from_raw(raw) -> dict:
+    """Read OpenAI token usage from a raw chat completion, as an object or a dict."""
+    usage = raw.get("usage") if isinstance(raw, dict) else getattr(raw, "usage", None)
+    if usage is None:
+        return {"prompt_tokens": 0, "completion_tokens": 0, "total_tokens": 0}
+    if not isinstance(usage, dict):
+        usage = usage.model_dump() if hasattr(usage, "model_dump") else vars(usage)
+    return {key: usage.get(key) or 0 for key in ("prompt_tokens", "completion_tokens", "total_tokens")}